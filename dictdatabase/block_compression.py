@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import bisect
+import itertools
+import os
+import struct
+import zlib
+from typing import BinaryIO, List, Tuple
+
+# Design decisions:
+# - Compressed .ddb files consist of blocks of the JSON bytes that are
+#   compressed independently, followed by a table of their sizes. Reading a
+#   range only decompresses the blocks it overlaps, so the indexed partial reads
+#   and writes also work with compression.
+# - Writing from an index keeps the blocks before the block containing it, and
+#   compresses the rest again, like writing a .json file from an index rewrites
+#   the rest of it. A full write compresses all bytes again.
+# - Files written by previous versions are a single zlib stream without the
+#   footer. They are still read, but decompressed as a whole, and converted to
+#   blocks by the next write.
+
+# Binary compressed file layout:
+# - Blocks: Each block is at most BLOCK_SIZE bytes of the JSON bytes, compressed
+#   with zlib.
+# - Block table: The compressed and the uncompressed size of each block.
+# - Footer: The offset of the block table, the number of blocks, the version
+#   and the magic, at the end of the file, so that writing from a block on only
+#   has to truncate the file there.
+BLOCK_MAGIC = b"DDBZ"
+BLOCK_VERSION = 1
+FOOTER = struct.Struct("<QIH4s")
+BLOCK = struct.Struct("<II")
+
+# Number of uncompressed bytes per block. Smaller blocks make reading a range
+# decompress less, but compress worse (bytes)
+BLOCK_SIZE = 64 * 1024
+
+# The zlib compression level, which favors speed over size
+COMPRESSION_LEVEL = 1
+
+
+class BlockTable:
+	"""
+	The sizes of the blocks of a compressed file, both in the file and in the
+	uncompressed bytes, and their start offsets, each followed by the total size.
+	"""
+
+	__slots__ = ("compressed_sizes", "sizes", "compressed_offsets", "offsets")
+
+	compressed_sizes: List[int]
+	sizes: List[int]
+	compressed_offsets: List[int]
+	offsets: List[int]
+
+	def __init__(self, compressed_sizes: List[int], sizes: List[int]) -> None:
+		self.compressed_sizes = compressed_sizes
+		self.sizes = sizes
+		self.compressed_offsets = [0, *itertools.accumulate(compressed_sizes)]
+		self.offsets = [0, *itertools.accumulate(sizes)]
+
+	def __len__(self) -> int:
+		return len(self.offsets) - 1
+
+	def block_at(self, index: int) -> int:
+		"""
+		Returns the number of the block that contains the uncompressed byte at
+		the index, or the number of blocks if the index is at or after the end.
+		"""
+		if index >= self.offsets[-1]:
+			return len(self)
+		return bisect.bisect_right(self.offsets, index) - 1
+
+
+def read_table(f: BinaryIO) -> BlockTable | None:
+	"""
+	Returns the block table of an open compressed file, or None if it is a
+	single zlib stream, as written by previous versions.
+	"""
+	size = f.seek(0, os.SEEK_END)
+	if size < FOOTER.size:
+		return None
+	f.seek(size - FOOTER.size)
+	table_offset, block_count, version, magic = FOOTER.unpack(f.read(FOOTER.size))
+	# A zlib stream ends with a checksum, which could be the magic by chance
+	if magic != BLOCK_MAGIC or table_offset + block_count * BLOCK.size + FOOTER.size != size:
+		return None
+	if version != BLOCK_VERSION:
+		raise ValueError(f"Unsupported compressed file version {version}")
+	f.seek(table_offset)
+	sizes = list(BLOCK.iter_unpack(f.read(block_count * BLOCK.size)))
+	return BlockTable([s[0] for s in sizes], [s[1] for s in sizes])
+
+
+def read_spans(f: BinaryIO, spans: List[Tuple[int | None, int | None]]) -> List[bytes]:
+	"""
+	Read multiple ranges of the uncompressed bytes of an open compressed file.
+	Each block is decompressed at most once, and only if a range overlaps it.
+
+	Args:
+	- `f`: The compressed file, opened for binary reading.
+	- `spans`: The start (inclusive) and end (exclusive) index of each range,
+	which are interpreted like the indices of a slice.
+	"""
+	table = read_table(f)
+	if table is None:
+		f.seek(0)
+		json_bytes = zlib.decompress(f.read())
+		return [json_bytes[start:end] for start, end in spans]
+
+	blocks = {}
+	spans_bytes = []
+	for start, end in spans:
+		start, end, _ = slice(start, end).indices(table.offsets[-1])
+		if start >= end:
+			spans_bytes.append(b"")
+			continue
+		first, last = table.block_at(start), table.block_at(end - 1)
+		for i in range(first, last + 1):
+			if i not in blocks:
+				f.seek(table.compressed_offsets[i])
+				blocks[i] = zlib.decompress(f.read(table.compressed_offsets[i + 1] - table.compressed_offsets[i]))
+		span_bytes = b"".join(blocks[i] for i in range(first, last + 1))
+		spans_bytes.append(span_bytes[start - table.offsets[first] : end - table.offsets[first]])
+	return spans_bytes
+
+
+def compress(json_bytes: bytes) -> Tuple[List[bytes], List[int]]:
+	"""
+	Returns the compressed blocks of the bytes, and their uncompressed sizes.
+	"""
+	chunks = [json_bytes[i : i + BLOCK_SIZE] for i in range(0, len(json_bytes), BLOCK_SIZE)]
+	return [zlib.compress(chunk, COMPRESSION_LEVEL) for chunk in chunks], [len(chunk) for chunk in chunks]
+
+
+def write(f: BinaryIO, json_bytes: bytes, start: int = 0) -> None:
+	"""
+	Write the bytes to an open compressed file from the uncompressed index
+	`start` on, and truncate the rest. Only the blocks from the one containing
+	`start` on are written again.
+
+	Args:
+	- `f`: The compressed file, opened for binary reading and writing.
+	- `json_bytes`: The bytes to write.
+	- `start`: The index in the uncompressed bytes to write to.
+	"""
+	table = read_table(f) if start > 0 else BlockTable([], [])
+	if table is None:
+		# Convert a single zlib stream to blocks
+		f.seek(0)
+		prefix = zlib.decompress(f.read())[:start]
+		json_bytes = prefix + b"\x00" * (start - len(prefix)) + json_bytes
+		table, start = BlockTable([], []), 0
+
+	# The block containing the start is compressed again with its first bytes.
+	# Like a truncated file, a start after the end is padded with null bytes,
+	# also when converting a single zlib stream above.
+	first = table.block_at(start)
+	if first == len(table):
+		json_bytes = b"\x00" * (start - table.offsets[-1]) + json_bytes
+	elif start > table.offsets[first]:
+		f.seek(table.compressed_offsets[first])
+		block_bytes = f.read(table.compressed_offsets[first + 1] - table.compressed_offsets[first])
+		json_bytes = zlib.decompress(block_bytes)[: start - table.offsets[first]] + json_bytes
+	blocks, sizes = compress(json_bytes)
+	table = BlockTable(table.compressed_sizes[:first] + [len(block) for block in blocks], table.sizes[:first] + sizes)
+
+	f.seek(table.compressed_offsets[first])
+	f.truncate()
+	f.write(b"".join(blocks))
+	f.write(b"".join(BLOCK.pack(*block_sizes) for block_sizes in zip(table.compressed_sizes, table.sizes)))
+	f.write(FOOTER.pack(table.compressed_offsets[-1], len(table), BLOCK_VERSION, BLOCK_MAGIC))
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import threading
+from typing import Iterable
+
+from . import config, indexing
+
+# Design decisions:
+# - The Bloom filter of a database holds all keys of its outermost object, so
+#   that looking up a key that is not in the database mostly does not have to
+#   search the database file.
+# - It is stored in a binary file next to the .index file, together with the
+#   stamp of the database file it is valid for. Partial writes do not add or
+#   remove keys, so they only update the stamp in place. Full writes rebuild it.
+# - The positions of a key are derived from one 64 bit hash by double hashing.
+
+# Binary Bloom filter file layout:
+# - Header: magic, version, data stamp, number of bits, number of hashes.
+# - Bits: The bit array, least significant bit first.
+BLOOM_FILTER_MAGIC = b"DDBB"
+BLOOM_FILTER_VERSION = 1
+HEADER = struct.Struct("<4sHqqqQB")
+STAMP = struct.Struct("<qqq")
+STAMP_OFFSET = struct.calcsize("<4sH")
+
+# With 10 bits and 3 hashes per key, about 1.7% of the missing keys are not
+# known to be missing, and still have to be searched for
+BLOOM_FILTER_BITS_PER_KEY = 10
+BLOOM_FILTER_HASH_COUNT = 3
+
+
+def bloom_filter_path(db_name: str) -> str:
+	"""
+	Returns the path of the Bloom filter file of a database.
+	"""
+	db_name = db_name.replace("/", "___")
+	return os.path.join(config.storage_directory, ".ddb", f"{db_name}.bloom")
+
+
+def key_positions(key: str, bit_count: int, hash_count: int) -> list[int]:
+	"""
+	Returns the positions of the bits of a key.
+	"""
+	h1, h2 = struct.unpack("<II", hashlib.blake2b(key.encode(), digest_size=8).digest())
+	return [(h1 + i * (h2 | 1)) % bit_count for i in range(hash_count)]
+
+
+class BloomFilter(indexing.CachedFile):
+	"""
+	The Bloom filter of the keys of the outermost object of a database.
+	"""
+
+	__slots__ = ("data_stamp", "bits", "hash_count")
+
+	data_stamp: tuple[int, int, int] | None  # Inode, size and mtime of the database file the filter is valid for
+	bits: bytes  # The bit array, empty if there is no filter
+	hash_count: int  # Number of bits set per key
+
+	def __init__(self, db_name: str) -> None:
+		self.path = bloom_filter_path(db_name)
+		self.lock = threading.RLock()
+		self._load()
+
+	def _load(self) -> None:
+		self.data_stamp, self.bits, self.hash_count = None, b"", 0
+		content = self._read()
+		if content is None or len(content) < HEADER.size:
+			return
+		magic, version, *data_stamp, bit_count, hash_count = HEADER.unpack_from(content)
+		if (
+			magic != BLOOM_FILTER_MAGIC
+			or version != BLOOM_FILTER_VERSION
+			or len(content) != HEADER.size + bit_count // 8
+		):
+			# The file is corrupt or being replaced, so it is not used
+			return
+		self.data_stamp = tuple(data_stamp) if any(data_stamp) else None
+		self.bits, self.hash_count = content[HEADER.size :], hash_count
+
+	def is_valid(self, data_stamp: tuple[int, int, int] | None) -> bool:
+		return data_stamp is not None and self.data_stamp == data_stamp and len(self.bits) > 0
+
+	def might_contain(self, key: str) -> bool:
+		"""
+		Returns False if the key is not in the database, or True if it may be.
+		"""
+		bits = self.bits
+		for position in key_positions(key, len(bits) * 8, self.hash_count):
+			if not bits[position >> 3] & (1 << (position & 7)):
+				return False
+		return True
+
+	def build(self, keys: Iterable[str], data_stamp: tuple[int, int, int] | None) -> None:
+		"""
+		Replace the filter by one of the given keys, and write it to the file.
+
+		Args:
+		- `keys`: All keys of the outermost object of the database.
+		- `data_stamp`: The stamp of the database file the keys are from.
+		"""
+		keys = list(keys)
+		bit_count = max(64, (len(keys) * BLOOM_FILTER_BITS_PER_KEY + 7) // 8 * 8)
+		bits, hash_count = bytearray(bit_count // 8), BLOOM_FILTER_HASH_COUNT
+		for key in keys:
+			for position in key_positions(key, bit_count, hash_count):
+				bits[position >> 3] |= 1 << (position & 7)
+		header = HEADER.pack(
+			BLOOM_FILTER_MAGIC, BLOOM_FILTER_VERSION, *(data_stamp or (0, 0, 0)), bit_count, hash_count
+		)
+		with self.lock:
+			self._replace(header + bits)
+			self.data_stamp, self.bits, self.hash_count = data_stamp, bytes(bits), hash_count
+
+	def set_data_stamp(self, data_stamp: tuple[int, int, int] | None) -> None:
+		"""
+		Set the stamp of the database file the filter is valid for, after a
+		write that did not change its keys, or None if it is not valid anymore.
+		"""
+		with self.lock:
+			if data_stamp == self.data_stamp or self.stamp is None:
+				return
+			try:
+				with open(self.path, "r+b", buffering=0) as f:
+					f.seek(STAMP_OFFSET)
+					f.write(STAMP.pack(*(data_stamp or (0, 0, 0))))
+					self.stamp = indexing.file_stamp(os.fstat(f.fileno()))
+			except FileNotFoundError:
+				self.stamp = None
+			self.data_stamp = data_stamp
+
+
+bloom_filter_cache = indexing.IndexerCache(BloomFilter)
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=bloom_filter_cache._reset_after_fork)
+
+
+def get_bloom_filter(db_name: str) -> BloomFilter:
+	"""
+	Returns the cached BloomFilter of a database, or loads it.
+	"""
+	return bloom_filter_cache.get(db_name)
@@ -9,3 +9,4 @@ SPACE = 32
 TAB = 9
 NEWLINE = 10
 COMMA = 44
+COLON = 58
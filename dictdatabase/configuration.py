@@ -2,12 +2,25 @@ from __future__ import annotations
 
 
 class Confuguration:
-	__slots__ = ("storage_directory", "indent", "use_compression", "use_orjson")
+	__slots__ = (
+		"storage_directory",
+		"indent",
+		"use_compression",
+		"use_orjson",
+		"lock_backend",
+		"lock_wait_strategy",
+		"lock_metrics",
+		"index_validation",
+	)
 
 	storage_directory: str
 	indent: int | str | None  # eg. "\t" or 4 or None
 	use_compression: bool
 	use_orjson: bool
+	lock_backend: str  # "file", "fcntl" or "daemon"
+	lock_wait_strategy: str  # "poll", "backoff" or "inotify"
+	lock_metrics: bool
+	index_validation: str  # "sha256", "blake2b", "crc32" or "trust"
 
 	def __init__(
 		self,
@@ -15,11 +28,19 @@ class Confuguration:
 		indent: str | int | None = "\t",
 		use_compression: bool = False,
 		use_orjson: bool = True,
+		lock_backend: str = "file",
+		lock_wait_strategy: str = "poll",
+		lock_metrics: bool = False,
+		index_validation: str = "sha256",
 	) -> None:
 		self.storage_directory = storage_directory
 		self.indent = indent
 		self.use_compression = use_compression
 		self.use_orjson = use_orjson
+		self.lock_backend = lock_backend
+		self.lock_wait_strategy = lock_wait_strategy
+		self.lock_metrics = lock_metrics
+		self.index_validation = index_validation
 
 
 config = Confuguration()
@@ -1,5 +1,13 @@
+from __future__ import annotations
+
+import bisect
+import mmap
 import os
-from typing import Union
+import random
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Union
 
 import orjson
 
@@ -23,8 +31,147 @@ from . import config
 # Idea 3:
 # - Leave everything as is. While not ideal, it works. When empty read error occurs, don't use the index for that read
 
+# Design decisions:
+# - Entries are stored with base offsets, sorted by start offset. Shifts after a
+#   value changed its length are accumulated lazily in a Fenwick tree over the
+#   ranks, so a shift is O(log n) instead of updating every entry.
+# - The index file has a fixed-width record per entry, which also holds the
+#   Fenwick tree node of its rank, and a list of the ranks sorted by key. It is
+#   memory-mapped, so that looking up a key only bisects the sorted keys instead
+#   of parsing the whole file, and updating an existing entry only overwrites
+#   its record and O(log n) tree nodes in place.
+# - Entries that cannot be updated in place, like new keys, are appended to the
+#   end of the file. Then, the file is loaded into memory, and the appended
+#   entries are compacted into the records once replaying them would cost about
+#   as much as loading the records. Lost updates due to concurrent compactions
+#   are detected by the value hash, like all other stale index entries.
+
+# Binary index file layout:
+# - Header: magic, version, generation, record count, string table size, data
+#   stamp, sorted flag. The generation changes with every compaction, so that
+#   in-place updates are only done in the file that was loaded. The data stamp
+#   is the inode, size and mtime of the database file all entries are valid
+#   for, or zeros if that is unknown. The sorted flag is set if the keys of the
+#   outermost object of that database file are known to be sorted.
+# - Records: One per entry, sorted by start offset.
+# - Key order: The rank of each record, sorted by the UTF-8 bytes of its key.
+# - String table: The keys and indent strings the records point to.
+# - Appended entries: Each with its key, indent string and hash bytes inline.
+# Files of another version are rebuilt, so the version changes with the layout
+INDEX_MAGIC = b"DDBI"
+INDEX_VERSION = 1
+HEADER = struct.Struct("<4sHQIQqqqB")
+STAMP = struct.Struct("<qqqB")
+# start, end, indent_level, hash length, hash | shift, key offset, key length, indent offset, indent length
+ENTRY = struct.Struct("<qqIB32s")
+RECORD = struct.Struct("<qqIB32sqIIII")
+SHIFT = struct.Struct("<q")
+KEY_REF = struct.Struct("<II")
+RANK = struct.Struct("<I")
+# start, end, old_value_end, indent_level, key length, indent length, hash length
+APPENDED = struct.Struct("<qqqIIIB")
+
+# Appended entries are compacted into the records once there are more than this
+# minimum, and more than this fraction of the number of records
+INDEX_APPEND_MIN_COMPACTION = 16
+INDEX_APPEND_MAX_FRACTION = 1 / 64
+
+# Full writes only index keys of files of at least this size. Searching
+# smaller files for a key is cheap, but replacing the index file is not
+INDEX_BUILD_MIN_SIZE = 1024 * 64  # (bytes)
+
+# Full writes only index every this many keys of the outermost object, as a
+# sample of the sorted keys. The other keys are searched for only between the
+# values of the indexed keys before and after them, see `Indexer.neighbors`
+INDEX_SAMPLE_INTERVAL = 16
+
+# Maximum number of indexed keys that are skipped when searching for the
+# neighbors of a key, because they contain dots or their entry is invalid
+INDEX_NEIGHBOR_MAX_SKIP = 64
+
+# Maximum number of Indexers that are cached per process
+INDEXER_CACHE_SIZE = 64
+
+
+def index_path(db_name: str) -> str:
+	"""
+	Returns the path of the index file of a database.
+	"""
+	db_name = db_name.replace("/", "___")
+	return os.path.join(config.storage_directory, ".ddb", f"{db_name}.index")
+
+
+def file_stamp(st: os.stat_result) -> tuple[int, int, int]:
+	return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class CachedFile:
+	"""
+	A file of a database in the .ddb directory, like its index file, that is
+	loaded once per process and cached, see `IndexerCache`. Subclasses implement
+	`_load`, which loads the file with `_read`.
+	"""
+
+	__slots__ = ("path", "lock", "stamp")
+
+	path: str
+	lock: threading.RLock
+	stamp: tuple[int, int, int] | None  # Inode, size and mtime of the file when it was last loaded or written
+
+	def refresh(self) -> None:
+		"""
+		Reload the file if it changed since it was last loaded or written by
+		this object.
+		"""
+		try:
+			stamp = file_stamp(os.stat(self.path))
+		except FileNotFoundError:
+			stamp = None
+		if stamp != self.stamp:
+			with self.lock:
+				self._load()
+
+	def _load(self) -> None:
+		raise NotImplementedError
 
-class Indexer:
+	def _read(self) -> bytes | None:
+		"""
+		Returns the content of the file and sets `stamp` to its stamp, or
+		returns None and sets `stamp` to None if it does not exist.
+		"""
+		self.stamp = None
+		try:
+			with open(self.path, "rb") as f:
+				self.stamp = file_stamp(os.fstat(f.fileno()))
+				return f.read()
+		except FileNotFoundError:
+			return None
+
+	def _replace(self, content: bytes) -> bool:
+		"""
+		Replace the file by the content atomically, so that other processes
+		never read a partially written file, and set `stamp` to its stamp.
+
+		Returns:
+		- False if the file could not be replaced.
+		"""
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp_path, "wb") as f:
+			f.write(content)
+			f.flush()
+			stamp = file_stamp(os.fstat(f.fileno()))
+		try:
+			os.replace(tmp_path, self.path)
+		except PermissionError:
+			# On Windows, the file cannot be replaced while another process maps it
+			os.unlink(tmp_path)
+			return False
+		self.stamp = stamp
+		return True
+
+
+class Indexer(CachedFile):
 	"""
 	The Indexer takes the name of a database file, and tries to load the .index file
 	of the corresponding database file.
@@ -32,39 +179,431 @@ class Indexer:
 	The name of the index file is the name of the database file, with the extension
 	.index and all "/" replaced with "___"
 
-	The content of the index file is a json object, where the keys are keys inside
-	the database json file, and the values are lists of 5 elements:
+	The index file stores an entry for keys inside the database json file, with
+	5 elements:
 	- start_index: The index of the first byte of the value of the key in the database file
 	- end_index: The index of the last byte of the value of the key in the database file
 	- indent_level: The indent level of the key in the database file
 	- indent_with: The indent string used.
-	- value_hash: The hash of the value bytes
+	- value_hash: The hex digest of the value bytes, of at most 32 bytes
+
+	Additionally, the index file stores the stamp of the database file, for
+	which all entries are known to be valid, see `data_stamp`, and whether its
+	keys are sorted, see `keys_sorted`.
+
+	Index files in the previous json format are migrated when they are loaded.
+	Binary index files of another version are ignored, so that their entries
+	are indexed again by the next reads and writes.
+	Indexers are shared by the threads of a process, see `get_indexer`.
 	"""
 
-	__slots__ = ("data", "path")
+	__slots__ = (
+		"data_stamp",
+		"keys_sorted",
+		"generation",
+		"record_count",
+		"appended",
+		"mapping",
+		"data",
+		"keys",
+		"ranks",
+		"shifts",
+		"key_order",
+	)
 
-	def __init__(self, db_name: str) -> None:
-		# Make path of index file
-		db_name = db_name.replace("/", "___")
-		self.path = os.path.join(config.storage_directory, ".ddb", f"{db_name}.index")
+	data_stamp: tuple[int, int, int] | None  # Inode, size and mtime of the database file all entries are valid for
+	keys_sorted: bool  # If the keys of the outermost object of that database file are sorted
+	generation: int  # Generation of the loaded file, or 0 if it was not loaded
+	record_count: int  # Number of records in the loaded file
+	appended: int  # Number of appended entries after the records
+	mapping: mmap.mmap | None  # The loaded file, as long as the entries are not loaded into memory
+	data: dict[str, list]  # Entries with start and end offsets before the shifts
+	keys: list[str]  # Keys sorted by start offset
+	ranks: dict[str, int]  # 1-based position of each key in keys
+	shifts: list[int]  # Fenwick tree of the shifts that apply from a rank on
+	key_order: list[str] | None  # Sorted keys, while the entries are loaded into memory
 
+	def __init__(self, db_name: str) -> None:
+		self.path = index_path(db_name)
+		self.lock = threading.RLock()
+		self.mapping = None
 		os.makedirs(os.path.dirname(self.path), exist_ok=True)
-		if not os.path.exists(self.path):
-			self.data = {}
-			return
+		self._load()
+
+	########################################################################################
+	#### Loading
+	########################################################################################
+
+	def _load(self) -> None:
+		self.stamp, self.data_stamp, self.keys_sorted = None, None, False
+		self.generation, self.record_count, self.appended = 0, 0, 0
+		if self.mapping is not None:
+			self.mapping.close()
+		self.mapping = None
+		self._rebuild({})
 
 		try:
 			with open(self.path, "rb") as f:
-				self.data = orjson.loads(f.read())
+				st = os.fstat(f.fileno())
+				self.stamp = file_stamp(st)
+				if st.st_size == 0:
+					return
+				m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except FileNotFoundError:
+			return
+		try:
+			if m[:1] == b"{":
+				with m:
+					self._migrate_json(m[:])
+			else:
+				self._map(m)
+		except (OSError, ValueError, struct.error, UnicodeDecodeError):
+			# The file is being replaced or is corrupt, so don't use the index
+			self.generation, self.record_count, self.appended = 0, 0, 0
+			self.mapping = None
+			self._rebuild({})
+
+	def _map(self, m: mmap.mmap) -> None:
+		"""
+		Use the mapped binary index file. If entries were appended to it, load
+		it into memory and replay them.
+		"""
+		magic, version, generation, record_count, table_size, *data_stamp, keys_sorted = HEADER.unpack_from(m, 0)
+		if magic != INDEX_MAGIC or version != INDEX_VERSION:
+			m.close()
+			return
+		self.data_stamp = tuple(data_stamp) if any(data_stamp) else None
+		self.keys_sorted = bool(keys_sorted)
+		records_end = HEADER.size + record_count * (RECORD.size + RANK.size) + table_size
+		if len(m) < records_end:
+			raise ValueError("Incomplete index file")
+		self.generation, self.record_count = generation, record_count
+		self.mapping = m
+		if len(m) > records_end:
+			self._load_mapping()
+
+	def _load_mapping(self) -> None:
+		"""
+		Load the records of the mapped index file into memory, replay the
+		appended entries and close the mapping.
+		"""
+		m, count = self.mapping, self.record_count
+		table_start = HEADER.size + count * (RECORD.size + RANK.size)
+		table_size = HEADER.unpack_from(m, 0)[4]
+		table = m[table_start : table_start + table_size]
+
+		data, shifts = {}, [0]
+		indents: dict[tuple[int, int], str] = {}
+		for start, end, indent_level, hash_length, hash, shift, k_offset, k_length, i_offset, i_length in struct.iter_unpack(
+			RECORD.format, m[HEADER.size : HEADER.size + count * RECORD.size]
+		):
+			key = table[k_offset : k_offset + k_length].decode()
+			if (indent_with := indents.get((i_offset, i_length))) is None:
+				indent_with = indents[(i_offset, i_length)] = table[i_offset : i_offset + i_length].decode()
+			data[key] = [start, end, indent_level, indent_with, hash[:hash_length].hex()]
+			shifts.append(shift)
+		# The records are already sorted by start offset
+		self.data, self.keys, self.shifts, self.key_order = data, list(data), shifts, None
+		self.ranks = {k: i for i, k in enumerate(self.keys, start=1)}
+		self.mapping = None
+
+		pos, appended = table_start + table_size, []
+		while pos + APPENDED.size <= len(m):
+			start, end, old_value_end, indent_level, k_length, i_length, hash_length = APPENDED.unpack_from(m, pos)
+			pos += APPENDED.size
+			if pos + k_length + i_length + hash_length > len(m):
+				# A concurrent append may not be complete yet
+				break
+			key = m[pos : pos + k_length].decode()
+			pos += k_length
+			indent_with = m[pos : pos + i_length].decode()
+			pos += i_length
+			value_hash = m[pos : pos + hash_length].hex()
+			pos += hash_length
+			appended.append((key, start, end, indent_level, indent_with, value_hash, old_value_end))
+		m.close()
+		self._replay(appended)
+
+	def _replay(self, appended: list[tuple]) -> None:
+		"""
+		Apply appended entries. New keys are collected with their current
+		offsets and inserted into the order at once, instead of one by one.
+		"""
+		new = {}
+		for key, start, end, indent_level, indent_with, value_hash, old_value_end in appended:
+			self.appended += 1
+			if key in self.ranks and key not in new and self._get(key)[0] == start:
+				self._apply(key, start, end, indent_level, indent_with, value_hash, old_value_end)
+				for entry in new.values():
+					if entry[0] > old_value_end:
+						entry[0] += end - old_value_end
+						entry[1] += end - old_value_end
+				continue
+			if delta := end - old_value_end:
+				self._add_shift(self._first_rank_after(old_value_end), delta)
+				for entry in new.values():
+					if entry[0] > old_value_end:
+						entry[0] += delta
+						entry[1] += delta
+			new[key] = [start, end, indent_level, indent_with, value_hash]
+		if new:
+			data = self._materialize()
+			data.update(new)
+			self._rebuild(data)
+
+	def _migrate_json(self, content: bytes) -> None:
+		"""
+		Load an index file in the previous json format, and replace it by a binary one.
+		"""
+		try:
+			data = orjson.loads(content)
 		except orjson.JSONDecodeError:
-			self.data = {}
+			data = {}
+		self._rebuild(data)
+		self.compact()
+
+	def _rebuild(self, data: dict[str, list]) -> None:
+		"""
+		Rebuild the order and clear the shifts, given entries with current offsets.
+		"""
+		self.data = data
+		self.keys = sorted(data, key=lambda k: data[k][0])
+		self.ranks = {k: i for i, k in enumerate(self.keys, start=1)}
+		self.shifts = [0] * (len(self.keys) + 1)
+		self.key_order = None
+
+	########################################################################################
+	#### Entries
+	########################################################################################
+
+	def _count(self) -> int:
+		return self.record_count if self.mapping is not None else len(self.keys)
+
+	def __len__(self) -> int:
+		with self.lock:
+			return self._count()
+
+	def _rank(self, key: str) -> int | None:
+		"""
+		Returns the rank of a key, or None if it has no entry.
+		"""
+		if self.mapping is None:
+			return self.ranks.get(key)
+		if (position := self._key_position(key)) == self.record_count:
+			return None
+		rank, key_bytes = self._ordered(position)
+		return rank if key_bytes == key.encode() else None
+
+	def _key_position(self, key: str) -> int:
+		"""
+		Returns the position of the first key in sorted order that is not less
+		than `key`, or the number of entries if there is none.
+		"""
+		if self.mapping is None:
+			if self.key_order is None:
+				self.key_order = sorted(self.data)
+			return bisect.bisect_left(self.key_order, key)
+		key_bytes, lo, hi = key.encode(), 0, self.record_count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._ordered(mid)[1] < key_bytes:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def _ordered(self, position: int) -> tuple[int, bytes]:
+		"""
+		Returns the rank and the UTF-8 bytes of the key at a position in sorted
+		order. Sorting strings and their UTF-8 bytes results in the same order.
+		"""
+		if (m := self.mapping) is None:
+			key = self.key_order[position]
+			return self.ranks[key], key.encode()
+		count = self.record_count
+		rank = RANK.unpack_from(m, HEADER.size + count * RECORD.size + position * RANK.size)[0]
+		k_offset, k_length = KEY_REF.unpack_from(m, HEADER.size + (rank - 1) * RECORD.size + ENTRY.size + SHIFT.size)
+		table_start = HEADER.size + count * (RECORD.size + RANK.size)
+		return rank, m[table_start + k_offset : table_start + k_offset + k_length]
+
+	def _entry(self, rank: int) -> list:
+		"""
+		Returns the entry at a rank, with its offsets before the shifts.
+		"""
+		if (m := self.mapping) is None:
+			return self.data[self.keys[rank - 1]]
+		record = RECORD.unpack_from(m, HEADER.size + (rank - 1) * RECORD.size)
+		start, end, indent_level, hash_length, hash, _, _, _, i_offset, i_length = record
+		table_start = HEADER.size + self.record_count * (RECORD.size + RANK.size)
+		indent_with = m[table_start + i_offset : table_start + i_offset + i_length].decode()
+		return [start, end, indent_level, indent_with, hash[:hash_length].hex()]
+
+	def _key(self, rank: int) -> str:
+		if (m := self.mapping) is None:
+			return self.keys[rank - 1]
+		k_offset, k_length = KEY_REF.unpack_from(m, HEADER.size + (rank - 1) * RECORD.size + ENTRY.size + SHIFT.size)
+		table_start = HEADER.size + self.record_count * (RECORD.size + RANK.size)
+		return m[table_start + k_offset : table_start + k_offset + k_length].decode()
+
+	def _start(self, rank: int) -> int:
+		if (m := self.mapping) is None:
+			return self.data[self.keys[rank - 1]][0]
+		return SHIFT.unpack_from(m, HEADER.size + (rank - 1) * RECORD.size)[0]
+
+	def _node(self, rank: int) -> int:
+		if (m := self.mapping) is None:
+			return self.shifts[rank]
+		return SHIFT.unpack_from(m, HEADER.size + (rank - 1) * RECORD.size + ENTRY.size)[0]
+
+	def _shift(self, rank: int) -> int:
+		"""
+		Returns the sum of all shifts that apply to the entry at `rank`.
+		"""
+		total = 0
+		while rank > 0:
+			total += self._node(rank)
+			rank &= rank - 1
+		return total
+
+	def _add_shift(self, rank: int, delta: int) -> list[int]:
+		"""
+		Shift the entries from `rank` on by `delta` bytes.
+
+		Returns:
+		- The ranks of the updated Fenwick tree nodes.
+		"""
+		shifts, updated = self.shifts, []
+		while rank < len(shifts):
+			shifts[rank] += delta
+			updated.append(rank)
+			rank += rank & -rank
+		return updated
+
+	def _first_rank_after(self, offset: int, rank: int = 0) -> int:
+		"""
+		Returns the rank of the first entry that starts after `offset`, or the
+		number of entries plus one if there is none. If the entry after `rank`
+		does, it is returned without searching.
+		"""
+		count = self._count()
+		if 0 < rank < count and self._start(rank + 1) + self._shift(rank + 1) > offset:
+			return rank + 1
+		lo, hi = 1, count + 1
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._start(mid) + self._shift(mid) > offset:
+				hi = mid
+			else:
+				lo = mid + 1
+		return lo
+
+	def _materialize(self) -> dict[str, list]:
+		"""
+		Returns all entries with their current offsets.
+		"""
+		if self.mapping is not None:
+			self._load_mapping()
+		# The sum of the shifts of a rank is its node plus the sum of the shifts
+		# of the rank without its lowest bit, so all sums can be built in O(n)
+		data, sums, shifts = {}, [0] * len(self.shifts), self.shifts
+		for rank, key in enumerate(self.keys, start=1):
+			sums[rank] = shift = shifts[rank] + sums[rank & (rank - 1)]
+			start, end, *rest = self.data[key]
+			data[key] = [start + shift, end + shift, *rest]
+		return data
+
+	def _apply(
+		self,
+		key: str,
+		start_index: int,
+		end_index: int,
+		indent_level: int,
+		indent_with: str,
+		value_hash: str,
+		old_value_end: int,
+	) -> list[int] | None:
+		"""
+		Update the entry of a key in memory, and shift all entries after the
+		previous end of its value by the change of its length.
+
+		Returns:
+		- The ranks of the updated Fenwick tree nodes, or None if the order of
+		the entries was rebuilt.
+		"""
+		rank = self.ranks.get(key)
+		updated = []
+		if delta := end_index - old_value_end:
+			updated = self._add_shift(self._first_rank_after(old_value_end, rank or 0), delta)
+
+		# The entry can be updated in place if its position in the order does not change
+		if rank is not None and self._get(key)[0] == start_index:
+			shift = self._shift(rank)
+			self.data[key] = [start_index - shift, end_index - shift, indent_level, indent_with, value_hash]
+			return updated
+		data = self._materialize()
+		data[key] = [start_index, end_index, indent_level, indent_with, value_hash]
+		self._rebuild(data)
+		return None
+
+	def _get(self, key: str) -> Union[list, None]:
+		"""
+		Returns the entry of a key with its current offsets, even if it was
+		invalidated, or None if there is none.
+		"""
+		if (rank := self._rank(key)) is None:
+			return None
+		start, end, *rest = self._entry(rank)
+		shift = self._shift(rank)
+		return [start + shift, end + shift, *rest]
 
 	def get(self, key: str) -> Union[list, None]:
 		"""
 		Returns a list of 5 elements for a key if it exists, otherwise None
 		Elements:[start_index, end_index, indent_level, indent_with, value_hash]
 		"""
-		return self.data.get(key, None)
+		with self.lock:
+			if (entry := self._get(key)) is None or not entry[4]:
+				return None
+			return entry
+
+	def neighbors(self, key: str, end: str | None = None) -> tuple[list | None, list | None]:
+		"""
+		Returns the valid entries of the keys before and after a key in sorted
+		order, with their current offsets, or None if there is none. If `end` is
+		given, the entry after is the one of the first key that is not less than
+		`end` instead. Keys with dots are skipped, because their entries can be
+		of nested values, see `io_unsafe.find_key_in_json_bytes`.
+		"""
+		with self.lock:
+			count = self._count()
+			before = after = self._key_position(key)
+			if end is not None:
+				after = self._key_position(end)
+			elif after < count and self._ordered(after)[1] == key.encode():
+				after += 1
+			return (
+				self._neighbor(range(before - 1, max(before - 1 - INDEX_NEIGHBOR_MAX_SKIP, -1), -1)),
+				self._neighbor(range(after, min(after + INDEX_NEIGHBOR_MAX_SKIP, count))),
+			)
+
+	def _neighbor(self, positions: range) -> list | None:
+		"""
+		Returns the first valid entry of a key without dots at the positions in
+		sorted order, with its current offsets, or None if there is none.
+		"""
+		for position in positions:
+			rank, key_bytes = self._ordered(position)
+			if b"." in key_bytes:
+				continue
+			start, end, *rest = self._entry(rank)
+			if rest[2]:
+				shift = self._shift(rank)
+				return [start + shift, end + shift, *rest]
+		return None
+
+	########################################################################################
+	#### Writing
+	########################################################################################
 
 	def write(
 		self,
@@ -73,20 +612,352 @@ class Indexer:
 		end_index: int,
 		indent_level: int,
 		indent_with: str,
-		value_hash: int,
+		value_hash: str,
 		old_value_end: int,
+		data_stamp: tuple[int, int, int] | None = None,
 	) -> None:
 		"""
-		Write index information for a key to the index file
+		Write index information for a key to the index file. The entries that
+		start after `old_value_end` are shifted by the change of the value length.
+		The data stamp of the index is replaced by `data_stamp`. If the index has
+		no entries yet, the keys are not known to be sorted anymore.
 		"""
+		with self.lock:
+			self.refresh()
+			self._invalidate_nested(key, start_index, old_value_end)
+			keys_sorted = self.keys_sorted and self._count() > 0
+			stamp_changed = data_stamp != self.data_stamp or keys_sorted != self.keys_sorted
+			self.data_stamp, self.keys_sorted = data_stamp, keys_sorted
+			if self.mapping is not None and self._write_mapped(
+				key, start_index, end_index, indent_level, indent_with, value_hash, old_value_end, stamp_changed
+			):
+				return
+			if self.mapping is not None:
+				self._load_mapping()
 
-		if self.data.get(key, None) is not None:
+			# Records can only be updated in place if they still match the loaded file
+			in_place = (
+				self.generation != 0
+				and self.appended == 0
+				and key in self.data
+				and self.data[key][3] == indent_with
+				and len(self.keys) == self.record_count
+			)
+			updated = self._apply(key, start_index, end_index, indent_level, indent_with, value_hash, old_value_end)
+			if in_place and updated is not None:
+				start, end, *_ = self.data[key]
+				nodes = [(r, self.shifts[r]) for r in updated]
+				writes = self._record_writes(
+					self.ranks[key], start, end, indent_level, value_hash, nodes, stamp_changed
+				)
+				if self._write_in_place(writes):
+					return
+
+			# Without a loaded binary index file, there is nothing to append to
+			if self.generation == 0 or self.appended >= max(
+				INDEX_APPEND_MIN_COMPACTION, len(self.data) * INDEX_APPEND_MAX_FRACTION
+			):
+				self.compact()
+				return
+			key_bytes, indent_bytes, hash_bytes = key.encode(), indent_with.encode(), bytes.fromhex(value_hash)
+			appended = APPENDED.pack(
+				start_index,
+				end_index,
+				old_value_end,
+				indent_level,
+				len(key_bytes),
+				len(indent_bytes),
+				len(hash_bytes),
+			)
+			if stamp_changed and not self._write_in_place([self._data_stamp_write()]):
+				self.compact()
+				return
+			with open(self.path, "ab") as f:
+				f.write(appended + key_bytes + indent_bytes + hash_bytes)
+				f.flush()
+				self.stamp = file_stamp(os.fstat(f.fileno()))
+			self.appended += 1
+
+	def shift(
+		self,
+		start_index: int,
+		end_index: int,
+		old_value_end: int,
+		data_stamp: tuple[int, int, int] | None = None,
+	) -> None:
+		"""
+		Shift the entries after a value without an entry of its own, like
+		`write` does, so that it does not have to be indexed.
+		The data stamp of the index is replaced by `data_stamp`.
+		"""
+		with self.lock:
+			self.refresh()
+			self._invalidate_nested(None, start_index, old_value_end)
+			self.data_stamp, stamp_changed = data_stamp, data_stamp != self.data_stamp
 			delta = end_index - old_value_end
-			for entry in self.data.values():
-				if entry[0] > old_value_end:
-					entry[0] += delta
-					entry[1] += delta
-
-		self.data[key] = [start_index, end_index, indent_level, indent_with, value_hash]
-		with open(self.path, "wb") as f:
-			f.write(orjson.dumps(self.data))
+			if not delta and not stamp_changed:
+				return
+			if self.mapping is not None:
+				nodes, node = [], self._first_rank_after(old_value_end)
+				while delta and node <= self.record_count:
+					nodes.append((node, self._node(node) + delta))
+					node += node & -node
+				if self._write_in_place(self._node_writes(nodes, stamp_changed)):
+					return
+				self._load_mapping()
+
+			# Like in `write`, the records can only be updated if they still match the loaded file
+			in_place = self.generation != 0 and self.appended == 0 and len(self.keys) == self.record_count
+			updated = self._add_shift(self._first_rank_after(old_value_end), delta) if delta else []
+			nodes = [(r, self.shifts[r]) for r in updated]
+			if not in_place or not self._write_in_place(self._node_writes(nodes, stamp_changed)):
+				self.compact()
+
+	def _invalidate_nested(self, key: str | None, start_index: int, old_value_end: int) -> None:
+		"""
+		Invalidate the entries of values nested in the old value of a key, except
+		the entry of the key itself.
+		"""
+		rank = self._rank(key) if key is not None else None
+		nested_keys, rank = [], self._first_rank_after(start_index, rank or 0)
+		while rank <= self._count() and self._start(rank) + self._shift(rank) < old_value_end:
+			nested_keys.append(self._key(rank))
+			rank += 1
+		for nested_key in nested_keys:
+			if nested_key != key:
+				self.invalidate(nested_key)
+
+	def invalidate(self, key: str) -> None:
+		"""
+		Mark the entry of a key as invalid, so that `get` does not return it.
+		Its offsets are still shifted, until the next compaction drops it.
+		"""
+		with self.lock:
+			if (entry := self._get(key)) is None or not entry[4]:
+				return
+			start, end, indent_level, indent_with, _ = entry
+			self.write(key, start, end, indent_level, indent_with, "", end, self.data_stamp)
+
+	def build(self, data: dict[str, list], data_stamp: tuple[int, int, int] | None, keys_sorted: bool = False) -> None:
+		"""
+		Replace all entries at once, and write them to the index file.
+
+		Args:
+		- `data`: The entries of all keys, with their current offsets.
+		- `data_stamp`: The stamp of the database file the entries are valid for.
+		- `keys_sorted`: If the keys of the outermost object of that file are sorted.
+		"""
+		with self.lock:
+			if self.mapping is not None:
+				self.mapping.close()
+				self.mapping = None
+			self.data_stamp, self.keys_sorted = data_stamp, keys_sorted
+			self._rebuild(data)
+			self._write_file()
+
+	def set_data_stamp(self, data_stamp: tuple[int, int, int] | None) -> None:
+		"""
+		Set the stamp of the database file for which all entries are valid.
+		"""
+		with self.lock:
+			if data_stamp != self.data_stamp:
+				self.data_stamp = data_stamp
+				self._write_in_place([self._data_stamp_write()])
+
+	def _write_mapped(
+		self,
+		key: str,
+		start_index: int,
+		end_index: int,
+		indent_level: int,
+		indent_with: str,
+		value_hash: str,
+		old_value_end: int,
+		stamp_changed: bool,
+	) -> bool:
+		"""
+		Update an existing entry in the mapped index file in place, without
+		loading the file.
+
+		Returns:
+		- False if the entry cannot be updated in place.
+		"""
+		if (rank := self._rank(key)) is None:
+			return False
+		base_start, _, _, old_indent_with, _ = self._entry(rank)
+		shift = self._shift(rank)
+		if base_start + shift != start_index or old_indent_with != indent_with:
+			return False
+		nodes = []
+		if delta := end_index - old_value_end:
+			node = self._first_rank_after(old_value_end, rank)
+			while node <= self.record_count:
+				nodes.append((node, self._node(node) + delta))
+				node += node & -node
+		start, end = start_index - shift, end_index - shift
+		return self._write_in_place(
+			self._record_writes(rank, start, end, indent_level, value_hash, nodes, stamp_changed)
+		)
+
+	def _record_writes(
+		self,
+		rank: int,
+		start: int,
+		end: int,
+		indent_level: int,
+		value_hash: str,
+		nodes: list[tuple[int, int]],
+		stamp_changed: bool,
+	) -> list[tuple[int, bytes]]:
+		"""
+		Returns the writes that overwrite the entry of the record at `rank` with
+		the given base offsets, the given Fenwick tree nodes, and the data stamp
+		if it changed.
+		"""
+		hash_bytes = bytes.fromhex(value_hash)
+		entry = ENTRY.pack(start, end, indent_level, len(hash_bytes), hash_bytes)
+		return [(HEADER.size + (rank - 1) * RECORD.size, entry), *self._node_writes(nodes, stamp_changed)]
+
+	def _node_writes(self, nodes: list[tuple[int, int]], stamp_changed: bool) -> list[tuple[int, bytes]]:
+		"""
+		Returns the writes that overwrite the given Fenwick tree nodes, and the
+		data stamp if it changed.
+		"""
+		writes = [(HEADER.size + (node - 1) * RECORD.size + ENTRY.size, SHIFT.pack(value)) for node, value in nodes]
+		if stamp_changed:
+			writes.append(self._data_stamp_write())
+		return writes
+
+	def _data_stamp_write(self) -> tuple[int, bytes]:
+		return HEADER.size - STAMP.size, STAMP.pack(*(self.data_stamp or (0, 0, 0)), self.keys_sorted)
+
+	def _write_in_place(self, writes: list[tuple[int, bytes]]) -> bool:
+		"""
+		Write bytes at the given positions of the index file.
+
+		Returns:
+		- False if the index file was replaced since it was loaded.
+		"""
+		if self.generation == 0:
+			return False
+		try:
+			f = open(self.path, "r+b", buffering=0)
+		except FileNotFoundError:
+			return False
+		with f:
+			header = f.read(HEADER.size)
+			if len(header) != HEADER.size or HEADER.unpack(header)[2] != self.generation:
+				return False
+			for pos, data in writes:
+				f.seek(pos)
+				f.write(data)
+			self.stamp = file_stamp(os.fstat(f.fileno()))
+		return True
+
+	def compact(self) -> None:
+		"""
+		Write all entries with their current offsets to the index file,
+		without appended entries.
+		"""
+		with self.lock:
+			self._rebuild({k: entry for k, entry in self._materialize().items() if entry[4]})
+			self._write_file()
+
+	def _write_file(self) -> None:
+		"""
+		Replace the index file by the entries in memory, which must not be shifted.
+		"""
+		data = self.data
+		table, records, offsets = bytearray(), bytearray(), {}
+		key_refs = []
+		for key in self.keys:
+			start, end, indent_level, indent_with, value_hash = data[key]
+			key_bytes, indent_bytes, hash_bytes = key.encode(), indent_with.encode(), bytes.fromhex(value_hash)
+			if (indent_offset := offsets.get(indent_with)) is None:
+				indent_offset = offsets[indent_with] = len(table)
+				table += indent_bytes
+			key_refs.append(key_bytes)
+			records += RECORD.pack(
+				start,
+				end,
+				indent_level,
+				len(hash_bytes),
+				hash_bytes,
+				0,
+				len(table),
+				len(key_bytes),
+				indent_offset,
+				len(indent_bytes),
+			)
+			table += key_bytes
+		order = sorted(range(1, len(key_refs) + 1), key=lambda rank: key_refs[rank - 1])
+		key_order = struct.pack(f"<{len(order)}I", *order)
+
+		generation = random.getrandbits(64) or 1
+		data_stamp = self.data_stamp or (0, 0, 0)
+		header = HEADER.pack(
+			INDEX_MAGIC, INDEX_VERSION, generation, len(self.keys), len(table), *data_stamp, self.keys_sorted
+		)
+		if self._replace(header + records + key_order + table):
+			self.generation, self.record_count, self.appended = generation, len(self.keys), 0
+
+
+class IndexerCache:
+	"""
+	Process-wide cache of the most recently used Indexers, so that repeated
+	lookups do not load the index file again. A cached Indexer is reloaded if
+	its index file changed since it was last loaded or written.
+
+	Other kinds of CachedFiles can be cached as well, if they are created from
+	the name of the database.
+	"""
+
+	__slots__ = ("mutex", "indexers", "factory")
+
+	mutex: threading.Lock
+	indexers: OrderedDict[tuple[str, str], Indexer]  # By storage directory and database name, least recently used first
+	factory: Callable[[str], Indexer]
+
+	def __init__(self, factory: Callable[[str], Indexer] = Indexer) -> None:
+		self.mutex = threading.Lock()
+		self.indexers = OrderedDict()
+		self.factory = factory
+
+	def get(self, db_name: str) -> Indexer:
+		path = (config.storage_directory, db_name)
+		with self.mutex:
+			if (indexer := self.indexers.get(path)) is not None:
+				self.indexers.move_to_end(path)
+		if indexer is not None:
+			indexer.refresh()
+			return indexer
+
+		# Load outside of the mutex, so that other indexes can be used meanwhile
+		indexer = self.factory(db_name)
+		with self.mutex:
+			indexer = self.indexers.setdefault(path, indexer)
+			while len(self.indexers) > INDEXER_CACHE_SIZE:
+				self.indexers.popitem(last=False)
+		return indexer
+
+	def clear(self) -> None:
+		with self.mutex:
+			self.indexers = OrderedDict()
+
+	def _reset_after_fork(self) -> None:
+		"""
+		The child of a fork must not share the mutexes of the parent.
+		"""
+		self.__init__(self.factory)
+
+
+indexer_cache = IndexerCache()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=indexer_cache._reset_after_fork)
+
+
+def get_indexer(db_name: str) -> Indexer:
+	"""
+	Returns the cached Indexer of a database, or loads it.
+	"""
+	return indexer_cache.get(db_name)
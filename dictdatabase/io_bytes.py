@@ -1,7 +1,11 @@
+from __future__ import annotations
+
+import contextlib
+import mmap
 import os
-import zlib
+from typing import Iterator
 
-from . import config, utils
+from . import block_compression, config, utils
 
 
 def read(db_name: str, *, start: int = None, end: int = None) -> bytes:
@@ -10,13 +14,10 @@ def read(db_name: str, *, start: int = None, end: int = None) -> bytes:
 	changes, so a compressed ddb file can also be read if compression is
 	disabled, and vice versa.
 
-	If no compression is used, efficient reading can be done by specifying a start
-	and end byte index, such that only the bytes in that range are read from the
-	file.
-
-	If compression is used, specifying a start and end byte index is still possible,
-	but the entire file has to be read and decompressed first, and then the bytes
-	in the range are returned. This is because the compressed file is not seekable.
+	Efficient reading can be done by specifying a start and end byte index, such
+	that only the bytes in that range are read from the file. If compression is
+	used, only the compressed blocks that overlap the range are read and
+	decompressed, see `block_compression`.
 
 	Args:
 	- `db_name`: The name of the database file to read from.
@@ -45,12 +46,96 @@ def read(db_name: str, *, start: int = None, end: int = None) -> bytes:
 	if not ddb_exists:
 		raise FileNotFoundError(f'No database file exists for "{db_name}"')
 	with open(ddb_path, "rb") as f:
-		json_bytes = zlib.decompress(f.read())
-		if start is None and end is None:
-			return json_bytes
-		start = start or 0
-		end = end or len(json_bytes)
-		return json_bytes[start:end]
+		return block_compression.read_spans(f, [(start, end)])[0]
+
+
+@contextlib.contextmanager
+def mapped(db_name: str) -> Iterator[bytes | mmap.mmap]:
+	"""
+	Map the content of a file into memory, without reading it. Searching and
+	slicing the mapping only reads the needed parts of the file, so the memory
+	used for them does not grow with the file size.
+
+	If compression is used, the whole file is read and decompressed instead,
+	see `mapped_range` to only read a part of it.
+
+	Args:
+	- `db_name`: The name of the database file to map.
+
+	Raises:
+	- `FileNotFoundError`: If the file does not exist as .json nor .ddb.
+	- `FileExistsError`: If the file exists as .json and .ddb.
+	"""
+
+	json_path, json_exists, _, ddb_exists = utils.file_info(db_name)
+
+	if not json_exists or ddb_exists:
+		yield read(db_name)
+		return
+	with open(json_path, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			# Empty files cannot be mapped
+			yield b""
+			return
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+			yield mapping
+
+
+@contextlib.contextmanager
+def mapped_range(db_name: str, start: int, end: int | None) -> Iterator[tuple[bytes | mmap.mmap, int]]:
+	"""
+	Like `mapped`, but if compression is used, only the bytes from `start` to
+	`end` are read and decompressed. Yields the bytes and the index of the file
+	they start at, which is 0 if the file is mapped.
+
+	Args:
+	- `db_name`: The name of the database file to map.
+	- `start`: The start byte index of the needed range.
+	- `end`: The end byte index of the needed range, or None for the end of the file.
+
+	Raises:
+	- `FileNotFoundError`: If the file does not exist as .json nor .ddb.
+	- `FileExistsError`: If the file exists as .json and .ddb.
+	"""
+
+	_, json_exists, _, ddb_exists = utils.file_info(db_name)
+
+	if json_exists and not ddb_exists:
+		with mapped(db_name) as mapping:
+			yield mapping, 0
+	else:
+		yield read(db_name, start=start, end=end), start
+
+
+def read_spans(db_name: str, spans: list[tuple[int, int]]) -> list[bytes]:
+	"""
+	Read multiple byte ranges of a file, while opening it only once. If
+	compression is used, each compressed block is only decompressed once.
+
+	Args:
+	- `db_name`: The name of the database file to read from.
+	- `spans`: The start (inclusive) and end (exclusive) byte index of each range.
+
+	Raises:
+	- `FileNotFoundError`: If the file does not exist as .json nor .ddb.
+	- `FileExistsError`: If the file exists as .json and .ddb.
+	"""
+
+	json_path, json_exists, ddb_path, ddb_exists = utils.file_info(db_name)
+
+	if json_exists:
+		if ddb_exists:
+			raise FileExistsError(f'Inconsistent: "{db_name}" exists as .json and .ddb.Please remove one of them.')
+		spans_bytes = []
+		with open(json_path, "rb") as f:
+			for start, end in spans:
+				f.seek(start)
+				spans_bytes.append(f.read(end - start))
+		return spans_bytes
+	if not ddb_exists:
+		raise FileNotFoundError(f'No database file exists for "{db_name}"')
+	with open(ddb_path, "rb") as f:
+		return block_compression.read_spans(f, spans)
 
 
 def write(db_name: str, dump: bytes, *, start: int = None) -> None:
@@ -63,7 +148,12 @@ def write(db_name: str, dump: bytes, *, start: int = None) -> None:
 	- `dump`: The bytes to write to the file, representing correct JSON when
 	decoded.
 	- `start`: The start byte index to write to. If None, the whole file is overwritten.
-	If the original content was longer, the rest truncated.
+	If the original content was longer, the rest truncated. If compression is
+	used, only the compressed blocks from the one containing it on are written.
+
+	Raises:
+	- `FileNotFoundError`: If `start` is given, but the file does not exist as
+	.json nor .ddb.
 	"""
 
 	json_path, json_exists, ddb_path, ddb_exists = utils.file_info(db_name)
@@ -71,19 +161,25 @@ def write(db_name: str, dump: bytes, *, start: int = None) -> None:
 	# Write bytes or string to file
 	remove_file = None
 	if config.use_compression:
-		if start is not None:
-			raise RuntimeError("Cannot write to compressed file at a specific index")
-		write_file = ddb_path
+		write_file, write_file_exists = ddb_path, ddb_exists
 		if json_exists:
 			remove_file = json_path
-		dump = zlib.compress(dump, 1)
 	else:
-		write_file = json_path
+		write_file, write_file_exists = json_path, json_exists
 		if ddb_exists:
 			remove_file = ddb_path
 
+	# If the file exists in the other format, its bytes before the start are
+	# written to the new file as well
+	if start is not None and not write_file_exists:
+		dump = read(db_name, end=start) + dump
+		start = None
+
 	# Write bytes or string to file
-	if start is None:
+	if config.use_compression:
+		with open(write_file, "wb" if start is None else "r+b") as f:
+			block_compression.write(f, dump, start or 0)
+	elif start is None:
 		with open(write_file, "wb") as f:
 			f.write(dump)
 	else:
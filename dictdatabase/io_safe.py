@@ -1,14 +1,18 @@
+from __future__ import annotations
+
+import contextlib
 import os
 
-from . import config, io_unsafe, locking, utils
+from . import config, io_unsafe, lock_table, locking, utils, value_indexes
 
 
-def read(file_name: str) -> dict:
+def read(file_name: str, timeout: float | None = None, blocking: bool = True) -> dict:
 	"""
 	Read the content of a file as a dict.
 
 	Args:
 	- `file_name`: The name of the file to read from.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
 	"""
 
 	_, json_exists, _, ddb_exists = utils.file_info(file_name)
@@ -16,17 +20,18 @@ def read(file_name: str) -> dict:
 	if not json_exists and not ddb_exists:
 		return None
 
-	with locking.ReadLock(file_name):
+	with locking.ReadLock(file_name, timeout, blocking):
 		return io_unsafe.read(file_name)
 
 
-def partial_read(file_name: str, key: str) -> dict:
+def partial_read(file_name: str, key: str, timeout: float | None = None, blocking: bool = True) -> dict:
 	"""
 	Read only the value of a key-value pair from a file.
 
 	Args:
 	- `file_name`: The name of the file to read from.
 	- `key`: The key to read the value of.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
 	"""
 
 	_, json_exists, _, ddb_exists = utils.file_info(file_name)
@@ -34,32 +39,142 @@ def partial_read(file_name: str, key: str) -> dict:
 	if not json_exists and not ddb_exists:
 		return None
 
-	with locking.ReadLock(file_name):
+	with locking.ReadLock(file_name, timeout, blocking):
 		return io_unsafe.partial_read(file_name, key)
 
 
-def write(file_name: str, data: dict) -> None:
+def read_range(
+	file_name: str,
+	start: str | None,
+	end: str | None,
+	timeout: float | None = None,
+	blocking: bool = True,
+) -> dict | None:
+	"""
+	Read the items of a file whose keys are at least `start` and less than
+	`end`, if given.
+
+	Args:
+	- `file_name`: The name of the file to read from.
+	- `start`, `end`: The range of the keys, see `io_unsafe.read_range`.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
+	"""
+
+	if not utils.file_exists(file_name):
+		return None
+
+	with locking.ReadLock(file_name, timeout, blocking):
+		return io_unsafe.read_range(file_name, start, end)
+
+
+def build_index(file_name: str, timeout: float | None = None, blocking: bool = True) -> None:
+	"""
+	Index all keys of the outermost object of a file.
+
+	Args:
+	- `file_name`: The name of the file to index.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
+
+	Raises:
+	- `FileNotFoundError`: If the file does not exist.
+	"""
+
+	if not utils.file_exists(file_name):
+		raise FileNotFoundError(f"Database {file_name} does not exist")
+
+	# Replacing the index files would race with the in-place index updates of readers
+	with locking.WriteLock(file_name, timeout, blocking):
+		io_unsafe.build_index(file_name)
+
+
+def query(file_name: str, conditions: dict, timeout: float | None = None, blocking: bool = True) -> dict | None:
+	"""
+	Read the items of a file whose values fulfill all conditions.
+
+	Args:
+	- `file_name`: The name of the file to read from.
+	- `conditions`: The conditions, see `value_indexes.parse_conditions`.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
+	"""
+
+	if not utils.file_exists(file_name):
+		return None
+
+	with locking.ReadLock(file_name, timeout, blocking):
+		items = io_unsafe.query(file_name, conditions)
+
+	# Rebuilding the value indexes requires a write lock, so they are only
+	# rebuilt if no other thread or process holds a lock, else on a later query
+	if value_indexes.get_value_index(file_name).needs_rebuild(utils.file_stamp(file_name)):
+		rebuild_lock = locking.WriteLock(file_name, blocking=False)
+		# E.g. within a session on the file, this thread already holds a lock
+		if not lock_table.process_locks.is_held(rebuild_lock):
+			with contextlib.suppress(locking.LockTimeoutError), rebuild_lock:
+				io_unsafe.rebuild_value_indexes(file_name)
+	return items
+
+
+def create_value_index(file_name: str, field: str, timeout: float | None = None, blocking: bool = True) -> None:
+	"""
+	Declare and build a value index on a field of the values of a file.
+
+	Args:
+	- `file_name`: The name of the file.
+	- `field`: The field of the values to index.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
+
+	Raises:
+	- `FileNotFoundError`: If the file does not exist.
+	"""
+
+	if not utils.file_exists(file_name):
+		raise FileNotFoundError(f"Database {file_name} does not exist")
+
+	with locking.WriteLock(file_name, timeout, blocking):
+		io_unsafe.create_value_index(file_name, field)
+
+
+def delete_value_index(file_name: str, field: str, timeout: float | None = None, blocking: bool = True) -> None:
+	"""
+	Remove the value index on a field of the values of a file.
+
+	Args:
+	- `file_name`: The name of the file.
+	- `field`: The field of the values that is indexed.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
+	"""
+
+	with locking.WriteLock(file_name, timeout, blocking):
+		value_indexes.get_value_index(file_name).remove(field)
+
+
+def write(file_name: str, data: dict, timeout: float | None = None, blocking: bool = True) -> None:
 	"""
 	Ensures that writing only starts if there is no reading or writing in progress.
 
 	Args:
 	- `file_name`: The name of the file to write to.
 	- `data`: The data to write to the file.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
 	"""
 
 	dirname = os.path.dirname(f"{config.storage_directory}/{file_name}.any")
 	os.makedirs(dirname, exist_ok=True)
 
-	with locking.WriteLock(file_name):
+	lock = locking.WriteLock(file_name, timeout, blocking)
+	with lock:
+		# Do not write if the lock daemon released the lock meanwhile
+		lock._check_held()
 		io_unsafe.write(file_name, data)
 
 
-def delete(file_name: str) -> None:
+def delete(file_name: str, timeout: float | None = None, blocking: bool = True) -> None:
 	"""
 	Ensures that deleting only starts if there is no reading or writing in progress.
 
 	Args:
 	- `file_name`: The name of the file to delete.
+	- `timeout`, `blocking`: How to wait for the lock, see `locking.AbstractLock`.
 	"""
 
 	json_path, json_exists, ddb_path, ddb_exists = utils.file_info(file_name)
@@ -67,7 +182,9 @@ def delete(file_name: str) -> None:
 	if not json_exists and not ddb_exists:
 		return
 
-	with locking.WriteLock(file_name):
+	lock = locking.WriteLock(file_name, timeout, blocking)
+	with lock:
+		lock._check_held()
 		if json_exists:
 			os.remove(json_path)
 		if ddb_exists:
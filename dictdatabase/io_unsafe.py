@@ -2,16 +2,16 @@ from __future__ import annotations
 
 import hashlib
 import json
+import zlib
 from dataclasses import dataclass
 
 import orjson
 
-from . import byte_codes, config, indexing, io_bytes, utils
+from . import bloom_filters, byte_codes, config, indexing, io_bytes, utils, value_indexes
 
 
 @dataclass(frozen=True)  # slots=True not supported by python 3.8 and 3.9
 class PartialDict:
-	prefix: bytes
 	key: str
 	value: dict
 	value_start: int
@@ -26,6 +26,8 @@ class PartialFileHandle:
 	indent_level: int
 	indent_with: str
 	indexer: indexing.Indexer
+	# If the key was found between indexed keys, it is not indexed when written
+	found_between_neighbors: bool = False
 
 
 ########################################################################################
@@ -43,11 +45,122 @@ def read(db_name: str) -> dict:
 	return orjson.loads(io_bytes.read(db_name))
 
 
+########################################################################################
+#### Index validation
+########################################################################################
+
+
+def hash_value_bytes(value_bytes: bytes) -> str:
+	"""
+	Hash the bytes of a value for its index entry, depending on
+	`config.index_validation`. The "trust" mode falls back to crc32.
+	"""
+	if config.index_validation == "sha256":
+		return hashlib.sha256(value_bytes).hexdigest()
+	if config.index_validation == "blake2b":
+		return hashlib.blake2b(value_bytes, digest_size=8).hexdigest()
+	return f"{zlib.crc32(value_bytes):08x}"
+
+
+def is_index_current(indexer: indexing.Indexer, db_name: str) -> bool:
+	"""
+	Returns True if the database file did not change since the entries of an
+	index were written, or if there are none yet.
+	"""
+	data_stamp = indexer.data_stamp
+	return (data_stamp is not None and data_stamp == utils.file_stamp(db_name)) or len(indexer) == 0
+
+
+def is_index_trusted(indexer: indexing.Indexer, db_name: str) -> bool:
+	"""
+	In the "trust" mode of `config.index_validation`, the entries of an index
+	are trusted without hashing if the index is current.
+	"""
+	return config.index_validation == "trust" and is_index_current(indexer, db_name)
+
+
+def is_value_valid(indexer: indexing.Indexer, db_name: str, value_bytes: bytes, value_hash: str) -> bool:
+	if is_index_trusted(indexer, db_name):
+		return True
+	return value_hash == hash_value_bytes(value_bytes)
+
+
 ########################################################################################
 #### Partial Reading
 ########################################################################################
 
 
+def find_key_in_json_bytes(json_bytes: bytes, key: str) -> tuple[int, int]:
+	"""
+	Find a key of the outermost object. If there is none, and the key contains
+	dots, find it as a path through nested objects instead, e.g. "user.posts.123".
+
+	Returns:
+	- A tuple of the key start (inclusive) and end (exclusive) index,
+	or `(-1, -1)` if the key is not found.
+	"""
+	key_start, key_end = utils.find_outermost_key_in_json_bytes(json_bytes, key)
+	if key_end == -1 and "." in key:
+		return utils.find_key_path_in_json_bytes(json_bytes, key.split("."))
+	return key_start, key_end
+
+
+def find_value_between_neighbors(
+	indexer: indexing.Indexer,
+	db_name: str,
+	key: str,
+) -> tuple[int, int, int, str, bytes] | None:
+	"""
+	Search for a key of the outermost object only between the values of the
+	indexed keys before and after it, since the keys are sorted, see
+	`serialize_data_to_json_bytes`. Only the bytes in between are searched, see
+	`io_bytes.mapped_range`. This requires the index to be current.
+
+	Returns:
+	- The start and end index of the value, its indent level and indent string,
+	and the value bytes, or None if the key was not found that way.
+	"""
+	if not is_index_current(indexer, db_name):
+		return None
+	before, after = indexer.neighbors(key)
+	if before is None and after is None:
+		return None
+	window_start = before[1] if before is not None else 0
+	if after is not None and after[0] <= window_start:
+		return None
+	with io_bytes.mapped_range(db_name, window_start, after[0] if after is not None else None) as (json_bytes, offset):
+		# The indices in the bytes are the indices in the file minus the offset
+		window_start -= offset
+		window_end = after[0] - offset if after is not None else len(json_bytes)
+		# The window must start after a value and end after a key, with at most
+		# a space before the value
+		if before is not None and json_bytes[window_start : window_start + 1] != b",":
+			return None
+		if after is not None and not json_bytes[max(window_start, window_end - 2) : window_end].rstrip().endswith(b":"):
+			return None
+		# Between two values of the outermost object, the nesting level is 1
+		nesting = 0 if before is None else 1
+		key_start, key_end = utils.find_outermost_key_in_json_bytes(json_bytes, key, nesting, window_start, window_end)
+		if key_end == -1:
+			return None
+		start = key_end + (1 if json_bytes[key_end] == byte_codes.SPACE else 0)
+		end = utils.seek_index_through_value_bytes(json_bytes, start)
+		indent_level, indent_with = utils.detect_indentation_in_json_bytes(json_bytes, key_start)
+		return offset + start, offset + end, indent_level, indent_with, json_bytes[start:end]
+
+
+def is_key_missing(db_name: str, key: str) -> bool:
+	"""
+	Returns True if the Bloom filter of the db knows that a key is not in its
+	outermost object, and neither is the first key of the path it may be, see
+	`find_key_in_json_bytes`. Otherwise, the db has to be searched for it.
+	"""
+	bloom_filter = bloom_filters.get_bloom_filter(db_name)
+	if not bloom_filter.is_valid(utils.file_stamp(db_name)) or bloom_filter.might_contain(key):
+		return False
+	return "." not in key or not bloom_filter.might_contain(key.split(".", 1)[0])
+
+
 def try_read_bytes_using_indexer(indexer: indexing.Indexer, db_name: str, key: str) -> bytes | None:
 	"""
 	Check if the key info is saved in the file's index file.
@@ -59,7 +172,7 @@ def try_read_bytes_using_indexer(indexer: indexing.Indexer, db_name: str, key: s
 		return None
 	start, end, _, _, value_hash = index
 	partial_bytes = io_bytes.read(db_name, start=start, end=end)
-	if value_hash != hashlib.sha256(partial_bytes).hexdigest():
+	if not is_value_valid(indexer, db_name, partial_bytes, value_hash):
 		return None
 	return partial_bytes
 
@@ -75,30 +188,103 @@ def partial_read(db_name: str, key: str) -> dict | None:
 	"""
 
 	# Search for key in the index file
-	indexer = indexing.Indexer(db_name)
+	indexer = indexing.get_indexer(db_name)
 	if (value_bytes := try_read_bytes_using_indexer(indexer, db_name, key)) is not None:
 		return orjson.loads(value_bytes)
 
-	# Not found in index file, search for key in the entire file
-	all_file_bytes = io_bytes.read(db_name)
-	key_start, key_end = utils.find_outermost_key_in_json_bytes(all_file_bytes, key)
-
-	if key_end == -1:
+	# Keys that are not in the db are mostly known without searching it
+	if is_key_missing(db_name, key):
 		return None
 
-	# Key found, now determine the bounding byte indices of the value
-	start = key_end + (1 if all_file_bytes[key_end] == byte_codes.SPACE else 0)
-	end = utils.seek_index_through_value_bytes(all_file_bytes, start)
+	# Not found in index file, search for key between the indexed keys around it.
+	# That is about as fast as an index hit, so the key is not indexed.
+	if (found := find_value_between_neighbors(indexer, db_name, key)) is not None:
+		return orjson.loads(found[4])
 
-	indent_level, indent_with = utils.detect_indentation_in_json_bytes(all_file_bytes, key_start)
-	value_bytes = all_file_bytes[start:end]
-	value_hash = hashlib.sha256(value_bytes).hexdigest()
+	# Otherwise, search for key in the entire file. Without compression, it is
+	# mapped into memory, so that only the bytes of the value are copied.
+	with io_bytes.mapped(db_name) as all_file_bytes:
+		key_start, key_end = find_key_in_json_bytes(all_file_bytes, key)
+
+		if key_end == -1:
+			return None
+
+		# Key found, now determine the bounding byte indices of the value
+		start = key_end + (1 if all_file_bytes[key_end] == byte_codes.SPACE else 0)
+		end = utils.seek_index_through_value_bytes(all_file_bytes, start)
+
+		indent_level, indent_with = utils.detect_indentation_in_json_bytes(all_file_bytes, key_start)
+		value_bytes = all_file_bytes[start:end]
+	value_hash = hash_value_bytes(value_bytes)
 
 	# Write key info to index file
-	indexer.write(key, start, end, indent_level, indent_with, value_hash, end)
+	data_stamp = utils.file_stamp(db_name) if is_index_current(indexer, db_name) else None
+	indexer.write(key, start, end, indent_level, indent_with, value_hash, end, data_stamp)
 	return orjson.loads(value_bytes)
 
 
+def partial_read_many(db_name: str, keys: list[str]) -> dict:
+	"""
+	Partially read multiple keys from a db, like `partial_read`, but read the
+	values of all indexed keys at once. Keys that are not found are omitted.
+	"""
+	indexer = indexing.get_indexer(db_name)
+	# Searching the file for each key that is not indexed yet would be slower
+	if len(indexer) < len(keys):
+		build_index(db_name)
+	entries = {key: entry for key in keys if (entry := indexer.get(key)) is not None}
+	spans = io_bytes.read_spans(db_name, [(entry[0], entry[1]) for entry in entries.values()])
+	values_bytes = dict(zip(entries, spans))
+
+	items = {}
+	for key in keys:
+		value_bytes = values_bytes.get(key)
+		if value_bytes is not None and is_value_valid(indexer, db_name, value_bytes, entries[key][4]):
+			items[key] = orjson.loads(value_bytes)
+		elif (value := partial_read(db_name, key)) is not None:
+			items[key] = value
+	return items
+
+
+def read_range(db_name: str, start: str | None, end: str | None) -> dict:
+	"""
+	Read the items of the outermost object of the db whose keys are at least
+	`start` and less than `end`, if given. If the index is current and the keys
+	are sorted, only the items between the indexed keys around the range are
+	read and parsed, see `find_value_between_neighbors`. Otherwise, the whole
+	db is.
+	"""
+	if start is not None and end is not None and start >= end:
+		return {}
+	indexer = indexing.get_indexer(db_name)
+	items = None
+	if indexer.keys_sorted and is_index_current(indexer, db_name):
+		# The items up to the value of the key after the range are parsed as an object
+		before, after = indexer.neighbors(start or "", end)
+		if end is None:
+			after = None
+		offset = before[1] if before is not None else 0
+		window_bytes = io_bytes.read(db_name, start=offset, end=after[1] if after is not None else None)
+		# After a value, the next key follows a comma, unless the object ends
+		if before is not None and window_bytes[:1] == b",":
+			window_bytes = b"{" + window_bytes[1:]
+		elif before is not None:
+			window_bytes = b"{}" if window_bytes.lstrip()[:1] == b"}" else b""
+		if after is not None:
+			window_bytes += b"}"
+		try:
+			items = orjson.loads(window_bytes)
+		except orjson.JSONDecodeError:
+			# The entries do not match the db, so the whole db is read instead
+			items = None
+	if not isinstance(items, dict):
+		data = read(db_name)
+		if not isinstance(data, dict):
+			return {}
+		items = dict(sorted(data.items(), key=lambda item: item[0]))
+	return {k: v for k, v in items.items() if (start is None or k >= start) and (end is None or k < end)}
+
+
 ################################################################################
 #### Writing
 ################################################################################
@@ -118,13 +304,70 @@ def serialize_data_to_json_bytes(data: dict) -> bytes:
 		return db_dump.encode()
 
 
+def serialized_indentation() -> str | None:
+	"""
+	Returns the indentation of `serialize_data_to_json_bytes`, or None if the
+	keys of the outermost object do not start a line with it.
+	"""
+	if not config.indent:
+		return None
+	if config.use_orjson:
+		return "  "
+	return " " * config.indent if isinstance(config.indent, int) else config.indent
+
+
 def write(db_name: str, data: dict) -> None:
 	"""
 	Write the dict db dumped as a json string
-	to the file of the db_path.
+	to the file of the db_path. If it is big enough, index a sample of its keys.
 	"""
 	data_bytes = serialize_data_to_json_bytes(data)
 	io_bytes.write(db_name, data_bytes)
+	if isinstance(data, dict) and len(data_bytes) >= indexing.INDEX_BUILD_MIN_SIZE:
+		write_index(db_name, data_bytes, serialized_indentation(), indexing.INDEX_SAMPLE_INTERVAL)
+	else:
+		# If the size did not change, the stamp of the db file may not change
+		# either within the resolution of its mtime, so the index is not current
+		indexing.get_indexer(db_name).set_data_stamp(None)
+		bloom_filters.get_bloom_filter(db_name).set_data_stamp(None)
+	if isinstance(data, dict) and (value_index := value_indexes.get_value_index(db_name)).fields:
+		value_index.build(data, utils.file_stamp(db_name))
+
+
+################################################################################
+#### Index building
+################################################################################
+
+
+def write_index(db_name: str, json_bytes: bytes, indent_with: str | None = None, interval: int = 1) -> None:
+	"""
+	Index the keys of the outermost object of the db, given its current bytes,
+	and build its Bloom filter.
+
+	Args:
+	- `indent_with`: The indentation the bytes were serialized with, if known,
+	see `utils.find_top_level_values`.
+	- `interval`: Only index every this many keys, see `indexing.INDEX_SAMPLE_INTERVAL`.
+	"""
+	data, indentation = {}, None
+	values = utils.find_top_level_values(json_bytes, indent_with)
+	for key, key_start, start, end in values[::interval]:
+		# With a known indentation, all keys are indented the same
+		if indentation is None or not indent_with:
+			indentation = utils.detect_indentation_in_json_bytes(json_bytes, key_start)
+		data[key] = [start, end, *indentation, hash_value_bytes(json_bytes[start:end])]
+	keys_sorted = all(a[0] < b[0] for a, b in zip(values, values[1:]))
+	data_stamp = utils.file_stamp(db_name)
+	indexing.get_indexer(db_name).build(data, data_stamp, keys_sorted)
+	bloom_filters.get_bloom_filter(db_name).build([value[0] for value in values], data_stamp)
+
+
+def build_index(db_name: str) -> None:
+	"""
+	Index all keys of the outermost object of the db in a single pass over the
+	file, instead of searching the file for each key that is not indexed yet.
+	"""
+	write_index(db_name, io_bytes.read(db_name))
 
 
 ################################################################################
@@ -143,33 +386,24 @@ def try_get_partial_file_handle_by_index(
 	If the data could be read from the index file, a tuple of the partial file
 	handle and None is returned.
 	If the data could not be read from the index file, a tuple of None and the file
-	bytes is returned, so that the file bytes can be searched for the key.
+	bytes is returned, so that the file bytes can be searched for the key. If the
+	key is not indexed, the file bytes are not read and None is returned instead.
 	"""
 
 	if (index := indexer.get(key)) is None:
-		return None, io_bytes.read(db_name)
+		return None, None
 	start, end, indent_level, indent_with, value_hash = index
 
-	# If compression is enabled, all data has to be read from the file
-	if config.use_compression:
-		all_file_bytes = io_bytes.read(db_name)
-		value_bytes = all_file_bytes[start:end]
-		if value_hash != hashlib.sha256(value_bytes).hexdigest():
-			return None, all_file_bytes
-		value_data = orjson.loads(value_bytes)
-		partial_dict = PartialDict(all_file_bytes[:start], key, value_data, start, end, all_file_bytes[end:])
-
-	# If compression is disabled, only the value and suffix have to be read
-	else:
-		value_and_suffix_bytes = io_bytes.read(db_name, start=start)
-		value_length = end - start
-		value_bytes = value_and_suffix_bytes[:value_length]
-		if value_hash != hashlib.sha256(value_bytes).hexdigest():
-			# If the hashes don't match, read the prefix to concat the full file bytes
-			prefix_bytes = io_bytes.read(db_name, end=start)
-			return None, prefix_bytes + value_and_suffix_bytes
-		value_data = orjson.loads(value_bytes)
-		partial_dict = PartialDict(None, key, value_data, start, end, value_and_suffix_bytes[value_length:])
+	# Only the value and suffix have to be read
+	value_and_suffix_bytes = io_bytes.read(db_name, start=start)
+	value_length = end - start
+	value_bytes = value_and_suffix_bytes[:value_length]
+	if not is_value_valid(indexer, db_name, value_bytes, value_hash):
+		# If the hashes don't match, read the prefix to concat the full file bytes
+		prefix_bytes = io_bytes.read(db_name, end=start)
+		return None, prefix_bytes + value_and_suffix_bytes
+	value_data = orjson.loads(value_bytes)
+	partial_dict = PartialDict(key, value_data, start, end, value_and_suffix_bytes[value_length:])
 
 	return PartialFileHandle(db_name, partial_dict, indent_level, indent_with, indexer), None
 
@@ -185,13 +419,27 @@ def get_partial_file_handle(db_name: str, key: str) -> PartialFileHandle:
 	"""
 
 	# Search for key in the index file
-	indexer = indexing.Indexer(db_name)
+	indexer = indexing.get_indexer(db_name)
 	partial_handle, all_file_bytes = try_get_partial_file_handle_by_index(indexer, db_name, key)
 	if partial_handle is not None:
 		return partial_handle
+	if all_file_bytes is None and is_key_missing(db_name, key):
+		raise KeyError(f'Key "{key}" not found in db "{db_name}"')
 
-	# Not found in index file, search for key in the entire file
-	key_start, key_end = utils.find_outermost_key_in_json_bytes(all_file_bytes, key)
+	# Not found in index file, search for key between the indexed keys around it.
+	found = None
+	if all_file_bytes is None:
+		found = find_value_between_neighbors(indexer, db_name, key)
+	if found is not None:
+		start, end, indent_level, indent_with, value_bytes = found
+		suffix_bytes = io_bytes.read(db_name, start=end)
+		partial_dict = PartialDict(key, orjson.loads(value_bytes), start, end, suffix_bytes)
+		return PartialFileHandle(db_name, partial_dict, indent_level, indent_with, indexer, True)
+
+	# Otherwise, search for key in the entire file
+	if all_file_bytes is None:
+		all_file_bytes = io_bytes.read(db_name)
+	key_start, key_end = find_key_in_json_bytes(all_file_bytes, key)
 
 	if key_end == -1:
 		raise KeyError(f'Key "{key}" not found in db "{db_name}"')
@@ -203,11 +451,22 @@ def get_partial_file_handle(db_name: str, key: str) -> PartialFileHandle:
 	indent_level, indent_with = utils.detect_indentation_in_json_bytes(all_file_bytes, key_start)
 
 	partial_value = orjson.loads(all_file_bytes[start:end])
-	prefix_bytes = all_file_bytes[:start] if config.use_compression else None
-	partial_dict = PartialDict(prefix_bytes, key, partial_value, start, end, all_file_bytes[end:])
+	partial_dict = PartialDict(key, partial_value, start, end, all_file_bytes[end:])
 	return PartialFileHandle(db_name, partial_dict, indent_level, indent_with, indexer)
 
 
+def invalidate_containing_entries(pf: PartialFileHandle) -> None:
+	"""
+	If the key is a path through nested objects, the entries of the objects
+	that contain its value are not valid anymore after it is written.
+	"""
+	key, start, end = pf.partial_dict.key, pf.partial_dict.value_start, pf.partial_dict.value_end
+	for i in range(key.count(".")):
+		parent = key.rsplit(".", i + 1)[0]
+		if (entry := pf.indexer.get(parent)) is not None and entry[0] < start and entry[1] >= end:
+			pf.indexer.invalidate(parent)
+
+
 def partial_write(pf: PartialFileHandle) -> None:
 	"""
 	Write a partial file handle to the db.
@@ -221,20 +480,83 @@ def partial_write(pf: PartialFileHandle) -> None:
 		replace_with = ("\n" + (pf.indent_level * pf.indent_with)).encode()
 		partial_bytes = partial_bytes.replace(replace_this, replace_with)
 
-	# Write key info to index file
-	pf.indexer.write(
-		key=pf.partial_dict.key,
-		start_index=pf.partial_dict.value_start,
-		end_index=pf.partial_dict.value_start + len(partial_bytes),
-		indent_level=pf.indent_level,
-		indent_with=pf.indent_with,
-		value_hash=hashlib.sha256(partial_bytes).hexdigest(),
-		old_value_end=pf.partial_dict.value_end,
-	)
-
-	if pf.partial_dict.prefix is None:
-		# Prefix could not be determined due to compression, so write the entire file
-		io_bytes.write(pf.db_name, partial_bytes + pf.partial_dict.suffix, start=pf.partial_dict.value_start)
+	# Write key info to index file. Until the data is written, the index is not current.
+	current = is_index_current(pf.indexer, pf.db_name)
+	value_index = value_indexes.get_value_index(pf.db_name)
+	bloom_filter = bloom_filters.get_bloom_filter(pf.db_name)
+	data_stamp = utils.file_stamp(pf.db_name)
+	value_index_valid, bloom_filter_valid = value_index.is_valid(data_stamp), bloom_filter.is_valid(data_stamp)
+	invalidate_containing_entries(pf)
+	if pf.found_between_neighbors:
+		pf.indexer.shift(
+			start_index=pf.partial_dict.value_start,
+			end_index=pf.partial_dict.value_start + len(partial_bytes),
+			old_value_end=pf.partial_dict.value_end,
+		)
 	else:
-		# Prefix was determined, so only write the changed part and the suffix
-		io_bytes.write(pf.db_name, pf.partial_dict.prefix + partial_bytes + pf.partial_dict.suffix)
+		pf.indexer.write(
+			key=pf.partial_dict.key,
+			start_index=pf.partial_dict.value_start,
+			end_index=pf.partial_dict.value_start + len(partial_bytes),
+			indent_level=pf.indent_level,
+			indent_with=pf.indent_with,
+			value_hash=hash_value_bytes(partial_bytes),
+			old_value_end=pf.partial_dict.value_end,
+		)
+
+	# Only write the changed part and the suffix
+	io_bytes.write(pf.db_name, partial_bytes + pf.partial_dict.suffix, start=pf.partial_dict.value_start)
+
+	if current or value_index.fields or bloom_filter_valid:
+		data_stamp = utils.file_stamp(pf.db_name)
+		if current:
+			pf.indexer.set_data_stamp(data_stamp)
+		if value_index.fields:
+			value_index.update(pf.partial_dict.key, pf.partial_dict.value, data_stamp if value_index_valid else None)
+		# The keys of the outermost object did not change
+		if bloom_filter_valid:
+			bloom_filter.set_data_stamp(data_stamp)
+
+
+################################################################################
+#### Queries
+################################################################################
+
+
+def create_value_index(db_name: str, field: str) -> None:
+	"""
+	Declare a value index on a field of the values of the db, and build it.
+	"""
+	value_indexes.get_value_index(db_name).build(read(db_name), utils.file_stamp(db_name), [field])
+
+
+def query(db_name: str, conditions: dict) -> dict:
+	"""
+	Returns the items of the outermost object of the db whose values fulfill
+	all conditions, see `value_indexes.parse_conditions`, in sorted order of
+	their keys. If all fields have a value index, only the values of the
+	matching keys are read. Otherwise, the whole db is read, and the value
+	indexes are not rebuilt, see `rebuild_value_indexes`.
+	"""
+	parsed = value_indexes.parse_conditions(conditions)
+	value_index = value_indexes.get_value_index(db_name)
+	data_stamp = utils.file_stamp(db_name)
+	if value_index.is_valid(data_stamp) and (keys := value_index.query(parsed)) is not None:
+		return partial_read_many(db_name, keys)
+
+	data = read(db_name)
+	if not isinstance(data, dict):
+		return {}
+	return {key: data[key] for key in sorted(data) if value_indexes.matches(data[key], parsed)}
+
+
+def rebuild_value_indexes(db_name: str) -> None:
+	"""
+	Rebuild the declared value indexes of the db if it was changed otherwise,
+	e.g. by another program. Requires a write lock, since the value index file
+	is replaced.
+	"""
+	value_index = value_indexes.get_value_index(db_name)
+	data_stamp = utils.file_stamp(db_name)
+	if value_index.needs_rebuild(data_stamp) and isinstance(data := read(db_name), dict):
+		value_index.build(data, data_stamp)
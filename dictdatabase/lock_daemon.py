@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import contextlib
+import math
+import os
+import selectors
+import socket
+import time
+
+try:
+	import fcntl
+except ImportError:  # Not available on Windows
+	fcntl = None
+
+# Design decisions:
+# - Each lock uses its own connection, so a lock is held exactly as long as
+#   its connection is open. If a process dies, the kernel closes its
+#   connections and the daemon releases the locks, so no orphan detection is
+#   required. Leases additionally release the locks of hung processes.
+# - The protocol is line based text, so that it can be debugged with socat.
+# - The daemon is single threaded, all state changes happen in one event loop.
+# - Invalid requests are answered with an error and have no effect, so that a
+#   misbehaving client cannot stop the daemon, which would release all locks.
+
+# Duration without any connection after which the daemon exits
+DAEMON_IDLE_TIMEOUT = 10.0  # (s)
+
+# Duration to wait for an auto-spawned daemon to accept connections
+DAEMON_START_TIMEOUT = 5.0  # (s)
+
+# The maximum length of a request line. Clients that send longer lines are
+# disconnected, so that they cannot exhaust the memory of the daemon (bytes)
+MAX_REQUEST_LENGTH = 64 * 1024
+
+
+def socket_path(storage_directory: str) -> str:
+	return os.path.join(storage_directory, ".ddb", "lockd.sock")
+
+
+def parse_lock_request(args: str) -> tuple[str, float, str]:
+	"""
+	Parse the arguments `<mode> <lease> <name>` of an `acquire` or `try`
+	request into the mode, the lease and the name of the lock.
+
+	Raises:
+	- `ValueError`: If the arguments are invalid.
+	"""
+	parts = args.split(" ", 2)
+	if len(parts) != 3 or parts[0] not in ("read", "write", "upgrade") or not parts[2]:
+		raise ValueError(f"Invalid lock request {args!r}")
+	lease = float(parts[1])
+	if not 0 < lease < math.inf:
+		raise ValueError(f"Invalid lease {parts[1]!r}")
+	return parts[0], lease, parts[2]
+
+
+class Client:
+	"""
+	A connection to the daemon. It can wait for or hold one lock.
+	"""
+
+	__slots__ = ("sock", "buffer", "name", "mode", "lease", "lease_until")
+
+	sock: socket.socket
+	buffer: bytes
+	name: str | None
+	mode: str | None  # "read", "write" or "upgrade"
+	lease: float
+	lease_until: float | None  # Only set while the lock is held
+
+	def __init__(self, sock: socket.socket) -> None:
+		self.sock = sock
+		self.buffer = b""
+		self.name = None
+		self.mode = None
+		self.lease = 0.0
+		self.lease_until = None
+
+
+class LockState:
+	"""
+	The holders and the FIFO queue of waiting clients of one lock.
+	"""
+
+	__slots__ = ("holders", "queue", "upgrading")
+
+	holders: dict[Client, str]
+	queue: collections.deque[Client]
+	upgrading: Client | None  # Holder that waits for the other holders to leave
+
+	def __init__(self) -> None:
+		self.holders = {}
+		self.queue = collections.deque()
+		self.upgrading = None
+
+	def is_compatible(self, mode: str) -> bool:
+		modes = self.holders.values()
+		if mode == "read":
+			return "write" not in modes
+		if mode == "upgrade":
+			return "write" not in modes and "upgrade" not in modes
+		return not modes
+
+
+class LockServer:
+	"""
+	Grants read, write and upgradeable locks to the clients that connect to
+	the unix socket at `socket_path`. Waiting clients are granted in FIFO
+	order, so a waiting writer keeps new readers out.
+
+	Requests:
+	- `acquire <mode> <lease> <name>`: Wait for the lock and reply `granted`.
+	The lock is released if it is not renewed within `lease` seconds.
+	- `try <mode> <lease> <name>`: Like `acquire`, but reply `busy` instead
+	of waiting.
+	- `upgrade`: Upgrade the held upgradeable lock once all other holders
+	left, and reply `upgraded`. Meanwhile, no other client is granted.
+	- `abort`: Abort a pending upgrade and reply `aborted`. If the lock was
+	already upgraded, there is no reply.
+	- `renew`: Renew the lease of the held lock.
+	- `waiters`: Reply `waiters <n>` with the number of waiting clients.
+	Closing the connection releases the lock. Invalid requests, like a second
+	`acquire` or an `upgrade` without a held upgradeable lock, are answered
+	with `error <reason>` and have no effect.
+	"""
+
+	__slots__ = ("path", "listener", "selector", "clients", "locks", "idle_since")
+
+	path: str
+	listener: socket.socket
+	selector: selectors.BaseSelector
+	clients: dict[socket.socket, Client]
+	locks: dict[str, LockState]
+	idle_since: float
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(path)  # Stale socket of a daemon that did not exit cleanly
+		self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.listener.bind(path)
+		self.listener.listen(128)
+		self.selector = selectors.DefaultSelector()
+		self.selector.register(self.listener, selectors.EVENT_READ)
+		self.clients = {}
+		self.locks = {}
+		self.idle_since = time.monotonic()
+
+	def serve(self) -> None:
+		"""
+		Run the event loop until the daemon was idle for `DAEMON_IDLE_TIMEOUT`.
+		"""
+		try:
+			while True:
+				now = time.monotonic()
+				self._expire_leases(now)
+				if self.clients:
+					self.idle_since = now
+				elif now - self.idle_since > DAEMON_IDLE_TIMEOUT:
+					return
+				for key, _ in self.selector.select(self._next_timeout(now)):
+					if key.fileobj is self.listener:
+						self._accept()
+					else:
+						self._receive(self.clients[key.fileobj])
+		finally:
+			# Unlink the socket first, so that new clients spawn a new daemon
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self.path)
+			for client in list(self.clients.values()):
+				client.sock.close()
+			self.listener.close()
+			self.selector.close()
+
+	def _next_timeout(self, now: float) -> float:
+		timeout = DAEMON_IDLE_TIMEOUT
+		for client in self.clients.values():
+			if client.lease_until is not None:
+				timeout = min(timeout, client.lease_until - now)
+		return max(timeout, 0.0)
+
+	def _expire_leases(self, now: float) -> None:
+		expired = [c for c in self.clients.values() if c.lease_until is not None and c.lease_until < now]
+		for client in expired:
+			self._disconnect(client)
+
+	def _accept(self) -> None:
+		sock, _ = self.listener.accept()
+		self.clients[sock] = Client(sock)
+		self.selector.register(sock, selectors.EVENT_READ)
+
+	def _receive(self, client: Client) -> None:
+		try:
+			data = client.sock.recv(4096)
+		except OSError:
+			data = b""
+		if not data:
+			self._disconnect(client)
+			return
+		client.buffer += data
+		while b"\n" in client.buffer:
+			line, client.buffer = client.buffer.split(b"\n", 1)
+			try:
+				self._handle(client, line.decode())
+			except ValueError as e:
+				self._send(client, f"error {e}")
+		if len(client.buffer) > MAX_REQUEST_LENGTH:
+			self._disconnect(client)
+
+	def _handle(self, client: Client, line: str) -> None:
+		"""
+		Handle a request of a client.
+
+		Raises:
+		- `ValueError`: If the request is invalid, before it changed any state.
+		"""
+		command, _, args = line.partition(" ")
+		state = self.locks.get(client.name)
+		if command in ("acquire", "try"):
+			self._acquire(client, command, args)
+		elif command in ("upgrade", "abort"):
+			if state is None or client not in state.holders:
+				raise ValueError(f"Cannot {command} without a held lock")
+			if command == "upgrade":
+				self._upgrade(client, state)
+			else:
+				self._abort(client, state)
+		elif command == "renew":
+			if client.lease_until is not None:
+				client.lease_until = time.monotonic() + client.lease
+		elif command == "waiters":
+			self._send(client, f"waiters {len(state.queue) if state else 0}")
+		else:
+			raise ValueError(f"Unknown command {command!r}")
+
+	def _acquire(self, client: Client, command: str, args: str) -> None:
+		if client.name is not None:
+			raise ValueError("The connection already holds or waits for a lock")
+		mode, lease, name = parse_lock_request(args)
+		state = self.locks.get(name)
+		if command == "try" and state and (state.queue or state.upgrading or not state.is_compatible(mode)):
+			self._send(client, "busy")
+			return
+		client.mode, client.lease, client.name = mode, lease, name
+		state = self.locks.setdefault(name, LockState())
+		state.queue.append(client)
+		self._grant(state)
+
+	def _upgrade(self, client: Client, state: LockState) -> None:
+		if state.holders[client] != "upgrade" or state.upgrading is client:
+			raise ValueError("Cannot upgrade without a held upgradeable lock")
+		state.upgrading = client
+		self._grant(state)
+
+	def _abort(self, client: Client, state: LockState) -> None:
+		if state.upgrading is client:
+			state.upgrading = None
+			self._send(client, "aborted")
+			self._grant(state)
+
+	def _grant(self, state: LockState) -> None:
+		if (upgrading := state.upgrading) is not None:
+			if len(state.holders) > 1:
+				return
+			state.holders[upgrading] = "write"
+			state.upgrading = None
+			self._send(upgrading, "upgraded")
+		while state.queue and state.is_compatible(state.queue[0].mode):
+			client = state.queue.popleft()
+			state.holders[client] = client.mode
+			client.lease_until = time.monotonic() + client.lease
+			self._send(client, "granted")
+
+	def _send(self, client: Client, message: str) -> None:
+		try:
+			client.sock.sendall(f"{message}\n".encode())
+		except OSError:
+			pass  # The client disconnected, which is handled when its EOF is read
+
+	def _disconnect(self, client: Client) -> None:
+		self.selector.unregister(client.sock)
+		client.sock.close()
+		del self.clients[client.sock]
+		if (state := self.locks.get(client.name)) is None:
+			return
+		state.holders.pop(client, None)
+		if client in state.queue:
+			state.queue.remove(client)
+		if state.upgrading is client:
+			state.upgrading = None
+		if not state.holders and not state.queue:
+			del self.locks[client.name]
+		else:
+			self._grant(state)
+
+
+def serve(storage_directory: str) -> None:
+	"""
+	Run the lock daemon of a storage directory, unless another one already
+	runs. Only one daemon can hold the exclusive flock on `lockd.flock`.
+	"""
+	ddb_dir = os.path.join(storage_directory, ".ddb")
+	os.makedirs(ddb_dir, exist_ok=True)
+	lock_fd = os.open(os.path.join(ddb_dir, "lockd.flock"), os.O_RDWR | os.O_CREAT, 0o666)
+	try:
+		start_time = time.monotonic()
+		while True:
+			try:
+				fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				break
+			except BlockingIOError:
+				pass
+			# Another daemon runs, unless it is just exiting
+			if os.path.exists(socket_path(storage_directory)):
+				return
+			if time.monotonic() - start_time > DAEMON_START_TIMEOUT:
+				return
+			time.sleep(0.001)
+		LockServer(socket_path(storage_directory)).serve()
+	finally:
+		os.close(lock_fd)
+
+
+def main(argv: list[str] | None = None) -> None:
+	parser = argparse.ArgumentParser(description="Lock daemon for the DictDataBase storage directory.")
+	parser.add_argument("storage_directory", nargs="?", default="ddb_storage")
+	args = parser.parse_args(argv)
+	serve(args.storage_directory)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from . import config, lock_daemon, locking
+
+# Design decisions:
+# - Each lock uses its own connection to the lock daemon, see `lock_daemon`.
+#   The connection is kept on the lock, which holds the lock as long as it is
+#   open.
+# - If the connection breaks while the lock is held, the daemon released the
+#   lock. This is only noticed when sending the next request, so writes and
+#   releases renew the lease first, and raise `LockLostError` then.
+
+# The maximum length of a unix socket path is 104 bytes on macOS and 108 on Linux
+MAX_SOCKET_PATH_LENGTH = 103
+
+
+def spawn(storage_directory: str) -> None:
+	"""
+	Start the lock daemon of a storage directory in the background.
+	"""
+	package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	env = dict(os.environ)
+	env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_dir, env.get("PYTHONPATH")]))
+	process = subprocess.Popen(
+		[sys.executable, "-m", "dictdatabase.lock_daemon", os.path.abspath(storage_directory)],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		start_new_session=True,
+		env=env,
+	)
+	# Reap the daemon when it exits
+	threading.Thread(target=process.wait, name="ddb-lockd-reaper", daemon=True).start()
+
+
+def connect(storage_directory: str) -> socket.socket:
+	"""
+	Connect to the lock daemon of a storage directory, and spawn it if it
+	does not run yet.
+
+	Raises:
+	- `RuntimeError`: If the lock daemon is not supported on this platform,
+	the socket path is too long, or the daemon did not start in time.
+	"""
+	# The daemon needs flock, so that only one daemon runs per storage directory
+	if lock_daemon.fcntl is None or not hasattr(socket, "AF_UNIX"):
+		raise RuntimeError('The "daemon" lock backend is not available on this platform.')
+	path = lock_daemon.socket_path(storage_directory)
+	if len(os.fsencode(path)) > MAX_SOCKET_PATH_LENGTH:
+		raise RuntimeError(f"The lock daemon socket path is too long: {path}")
+
+	spawned_at = None
+	while True:
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(path)
+			return sock
+		except (FileNotFoundError, ConnectionRefusedError):
+			sock.close()
+		if spawned_at is None:
+			spawned_at = time.monotonic()
+			spawn(storage_directory)
+		elif time.monotonic() - spawned_at > lock_daemon.DAEMON_START_TIMEOUT:
+			raise RuntimeError(f"The lock daemon did not start within {lock_daemon.DAEMON_START_TIMEOUT}s.")
+		time.sleep(0.001)
+
+
+class DaemonConnection:
+	"""
+	Client side of a connection to the lock daemon, which holds one lock.
+	"""
+
+	__slots__ = ("sock", "send_lock", "buffer", "lost")
+
+	sock: socket.socket
+	send_lock: threading.Lock  # The heartbeat renews the lease from another thread
+	buffer: bytes
+	lost: bool  # If the connection broke, so that the daemon released the lock
+
+	def __init__(self, storage_directory: str) -> None:
+		self.sock = connect(storage_directory)
+		self.send_lock = threading.Lock()
+		self.buffer = b""
+		self.lost = False
+
+	def send(self, message: str) -> None:
+		"""
+		Send a request.
+
+		Raises:
+		- `OSError`: If the connection broke, which also sets `lost`.
+		"""
+		with self.send_lock:
+			try:
+				self.sock.sendall(f"{message}\n".encode())
+			except OSError:
+				self.lost = True
+				raise
+
+	def receive(self, timeout: float | None) -> str | None:
+		"""
+		Receive the next reply, or None if the timeout passed.
+
+		Raises:
+		- `ConnectionError`: If the daemon closed the connection.
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while b"\n" not in self.buffer:
+			remaining = None if deadline is None else deadline - time.monotonic()
+			if remaining is not None and remaining <= 0:
+				return None
+			# The socket stays blocking, since the heartbeat sends on it meanwhile
+			if not select.select([self.sock], [], [], remaining)[0]:
+				return None
+			data = self.sock.recv(4096)
+			if not data:
+				self.lost = True
+				raise ConnectionResetError("The lock daemon closed the connection.")
+			self.buffer += data
+		line, self.buffer = self.buffer.split(b"\n", 1)
+		return line.decode()
+
+	def close(self) -> None:
+		self.sock.close()
+
+
+def acquire(lock: locking.AbstractLock) -> None:
+	"""
+	Acquire the lock from the lock daemon of the storage directory, which
+	is spawned if it does not run yet. The daemon grants the locks in FIFO
+	order, and releases them when the connection is closed, or when their
+	lease of `REMOVE_ORPHAN_LOCK_TIMEOUT` seconds was not renewed by the
+	heartbeat. Non-blocking locks are only granted if they do not have to
+	wait.
+
+	Raises:
+	- `LockTimeoutError`: If the lock could not be acquired before its deadline.
+	"""
+	command = "try" if lock.timeout == 0.0 else "acquire"
+	while True:
+		connect_start = time.monotonic()
+		connection = DaemonConnection(config.storage_directory)
+		# Starting the daemon does not count towards the timeout
+		lock.deadline += time.monotonic() - connect_start
+		try:
+			connection.send(f"{command} {lock.mode} {locking.REMOVE_ORPHAN_LOCK_TIMEOUT} {lock.db_name}")
+			reply = connection.receive(None if command == "try" else lock.deadline - time.monotonic())
+		except ConnectionError:
+			# The daemon exited before it accepted the connection
+			connection.close()
+			if time.monotonic() > lock.deadline:
+				raise locking.LockTimeoutError(f"Timeout while waiting for {lock.mode} lock.") from None
+			continue
+		except BaseException:
+			connection.close()
+			raise
+		if reply != "granted":
+			connection.close()
+			raise locking.LockTimeoutError(f"Timeout while waiting for {lock.mode} lock.")
+		break
+	lock.daemon_connection = connection
+	lock.has_lock = lock.has_lock.new_with_updated_time()
+	locking.lock_registry.register(lock)
+
+
+def check_held(lock: locking.AbstractLock) -> None:
+	"""
+	Check that the lock daemon still holds the lock, by renewing its lease.
+
+	Raises:
+	- `LockLostError`: If the connection to the lock daemon broke.
+	"""
+	connection = lock.daemon_connection
+	with contextlib.suppress(OSError):
+		connection.send("renew")
+	if connection.lost:
+		raise locking.LockLostError(f"The lock daemon released the {lock.mode} lock on {lock.db_name} early.")
+
+
+def release(lock: locking.AbstractLock) -> None:
+	"""
+	Release the lock by closing its connection.
+
+	Raises:
+	- `LockLostError`: If the daemon had released the lock already.
+	"""
+	try:
+		check_held(lock)
+	finally:
+		lock.daemon_connection.close()
+		lock.daemon_connection = None
+
+
+def upgrade(lock: locking.UpgradeableLock) -> None:
+	"""
+	Ask the lock daemon for the upgrade. If it does not reply in time, the
+	upgrade is aborted, unless the daemon upgraded the lock meanwhile.
+
+	Raises:
+	- `LockTimeoutError`: If the lock could not be upgraded before its deadline.
+	"""
+	lock.daemon_connection.send("upgrade")
+	if lock.daemon_connection.receive(max(lock.deadline - time.monotonic(), 0.0)) == "upgraded":
+		return
+	lock.daemon_connection.send("abort")
+	if lock.daemon_connection.receive(None) != "upgraded":
+		raise locking.LockTimeoutError("Timeout while waiting for write lock.")
+
+
+def has_waiters(lock: locking.AbstractLock) -> bool:
+	"""
+	Check if another process waits for the held lock.
+	"""
+	lock.daemon_connection.send("waiters")
+	return lock.daemon_connection.receive(None) != "waiters 0"
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import time
+
+from . import locking, waiting
+
+try:
+	import fcntl
+except ImportError:  # Not available on Windows
+	fcntl = None
+
+# Design decisions:
+# - The "fcntl" lock backend uses advisory flock locks on kernel lock files in
+#   the lock directory of the database. The kernel releases them when their
+#   process dies, so no orphan detection and no heartbeat is required.
+# - flock has no timeout, so the locks are requested without blocking, and
+#   waited for according to `config.lock_wait_strategy` in between.
+
+
+def flock_until_timeout(fd: int, operation: int, deadline: float, mode: str) -> int:
+	"""
+	Apply a non-blocking flock operation on the file descriptor until it
+	succeeds. Between attempts, wait according to `config.lock_wait_strategy`.
+	Releasing a flock does not change the directory, so the `"inotify"`
+	strategy uses exponential backoff here.
+
+	Returns:
+	- The number of failed attempts.
+
+	Raises:
+	- `LockTimeoutError`: If the lock could not be acquired before the deadline.
+	"""
+	waiter = None
+	polls = 0
+	try:
+		while True:
+			try:
+				fcntl.flock(fd, operation | fcntl.LOCK_NB)
+				return polls
+			except BlockingIOError:
+				polls += 1
+			if time.monotonic() > deadline:
+				raise locking.LockTimeoutError(f"Timeout while waiting for {mode} lock.")
+			if waiter is None:
+				waiter = waiting.make_waiter(None, locking.SLEEP_TIMEOUT)
+			waiter.wait()
+	finally:
+		if waiter is not None:
+			waiter.close()
+
+
+def kernel_lock_path(lock: locking.AbstractLock, kind: str) -> str:
+	return os.path.join(lock.need_lock.ddb_dir, f"{lock.db_name}.{kind}.flock")
+
+
+def acquire(lock: locking.AbstractLock) -> None:
+	"""
+	Acquire the lock with advisory flock locks instead of lock files.
+
+	Each database has three kernel lock files. The data lock file is
+	locked shared by readers and upgradeable locks, and exclusive by
+	writers. The gate lock file is held exclusively while waiting for the
+	data lock, so that a waiting writer keeps new readers out, which gives
+	the same fairness as the oldest need lock of the file based protocol.
+	Writers and upgradeable locks first lock the intent lock file
+	exclusively, which upgradeable locks hold until they are released.
+	Therefore, a writer never holds the gate while an upgradeable lock
+	needs it for upgrading.
+
+	Raises:
+	- `RuntimeError`: If flock is not available on this platform.
+	- `LockTimeoutError`: If the lock could not be acquired before its deadline.
+	"""
+
+	if fcntl is None:
+		raise RuntimeError('The "fcntl" lock backend is not available on this platform.')
+
+	operation = fcntl.LOCK_EX if lock.mode == "write" else fcntl.LOCK_SH
+	os.makedirs(lock.need_lock.ddb_dir, exist_ok=True)
+	intent_fd = None
+	if lock.mode != "read":
+		intent_fd = os.open(kernel_lock_path(lock, "intent"), os.O_RDWR | os.O_CREAT, 0o666)
+	gate_fd = os.open(kernel_lock_path(lock, "gate"), os.O_RDWR | os.O_CREAT, 0o666)
+	data_fd = os.open(kernel_lock_path(lock, "data"), os.O_RDWR | os.O_CREAT, 0o666)
+	try:
+		if intent_fd is not None:
+			lock.polls += flock_until_timeout(intent_fd, fcntl.LOCK_EX, lock.deadline, lock.mode)
+		lock.polls += flock_until_timeout(gate_fd, fcntl.LOCK_EX, lock.deadline, lock.mode)
+		try:
+			lock.polls += flock_until_timeout(data_fd, operation, lock.deadline, lock.mode)
+		finally:
+			fcntl.flock(gate_fd, fcntl.LOCK_UN)
+	except BaseException:
+		os.close(data_fd)
+		if intent_fd is not None:
+			os.close(intent_fd)
+		raise
+	finally:
+		os.close(gate_fd)
+	lock.kernel_lock_fd = data_fd
+	if lock.mode == "upgrade":
+		lock.kernel_intent_fd = intent_fd
+	elif intent_fd is not None:
+		os.close(intent_fd)
+
+
+def release(lock: locking.AbstractLock) -> None:
+	"""
+	Release the flocks of the lock and close their file descriptors.
+	"""
+	fcntl.flock(lock.kernel_lock_fd, fcntl.LOCK_UN)
+	os.close(lock.kernel_lock_fd)
+	lock.kernel_lock_fd = None
+	if lock.kernel_intent_fd is not None:
+		os.close(lock.kernel_intent_fd)
+		lock.kernel_intent_fd = None
+
+
+def upgrade(lock: locking.UpgradeableLock) -> None:
+	"""
+	Convert the shared data flock to an exclusive one. A flock conversion
+	is not atomic, so the gate is held meanwhile to keep other processes
+	out. Only readers, which release the data lock eventually, can hold
+	the data lock at the same time.
+
+	Raises:
+	- `LockTimeoutError`: If the lock could not be upgraded before its deadline.
+	"""
+	gate_fd = os.open(kernel_lock_path(lock, "gate"), os.O_RDWR | os.O_CREAT, 0o666)
+	try:
+		lock.polls += flock_until_timeout(gate_fd, fcntl.LOCK_EX, lock.deadline, "write")
+		try:
+			lock.polls += flock_until_timeout(lock.kernel_lock_fd, fcntl.LOCK_EX, lock.deadline, "write")
+		except BaseException:
+			# A failed conversion may have released the shared lock
+			fcntl.flock(lock.kernel_lock_fd, fcntl.LOCK_SH)
+			raise
+		finally:
+			fcntl.flock(gate_fd, fcntl.LOCK_UN)
+	finally:
+		os.close(gate_fd)
+
+
+def has_waiters(lock: locking.AbstractLock) -> bool:
+	"""
+	Check if another process waits for the held lock, which then holds the
+	gate lock.
+	"""
+	gate_fd = os.open(kernel_lock_path(lock, "gate"), os.O_RDWR | os.O_CREAT, 0o666)
+	try:
+		fcntl.flock(gate_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except BlockingIOError:
+		return True
+	finally:
+		os.close(gate_fd)
+	return False
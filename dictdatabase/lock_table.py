@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from . import config, locking
+
+# Design decisions:
+# - Threads of the same process coordinate in memory first, so that at most one
+#   of them acquires the cross-process lock of a database at a time, and
+#   readers can share it without touching the lock backend again.
+
+# Duration in which threads may join a read lock that is already held by their
+# process, before checking if other processes are waiting for the lock
+SHARED_LOCK_RECHECK_TIMEOUT = 0.001 * 10  # (ms)
+
+
+class ProcessLock:
+	"""
+	In-process state of the lock of one database. Threads of the same process
+	coordinate through this state first, so that only one of them holds the
+	cross-process lock at a time:
+	- Readers share the cross-process read lock of the first reader. It is
+	released when the last reader leaves.
+	- Writers wait until no other thread holds the lock, and then acquire
+	the cross-process write lock themselves.
+	- Upgradeable locks are acquired like write locks, but readers can join
+	their cross-process lock until they are upgraded.
+	"""
+
+	__slots__ = (
+		"condition",
+		"users",
+		"readers",
+		"writer",
+		"upgrader",
+		"writers_waiting",
+		"holder",
+		"acquiring",
+		"draining",
+		"shared_since",
+	)
+
+	condition: threading.Condition
+	users: int  # Threads that currently hold or wait for this lock
+	readers: set[int]  # Idents of the threads that hold a read lock
+	writer: int | None  # Ident of the thread that holds the write lock
+	upgrader: int | None  # Ident of the thread that holds the upgradeable lock
+	writers_waiting: int
+	holder: locking.AbstractLock | None  # The lock that holds the cross-process lock
+	acquiring: bool  # Whether a thread currently acquires the cross-process lock
+	draining: bool  # Whether new readers wait until the cross-process read lock was released
+	shared_since: float  # When the cross-process read lock was last checked for other waiters
+
+	def __init__(self) -> None:
+		self.condition = threading.Condition()
+		self.users = 0
+		self.readers = set()
+		self.writer = None
+		self.upgrader = None
+		self.writers_waiting = 0
+		self.holder = None
+		self.acquiring = False
+		self.draining = False
+		self.shared_since = 0.0
+
+	def is_held_by(self, ident: int) -> bool:
+		return ident in self.readers or self.writer == ident or self.upgrader == ident
+
+	def is_busy(self) -> bool:
+		"""Whether any thread holds the lock or acquires the cross-process lock."""
+		return bool(self.readers) or self.writer is not None or self.upgrader is not None or self.acquiring
+
+	def discard(self, ident: int) -> None:
+		self.readers.discard(ident)
+		if self.writer == ident:
+			self.writer = None
+		if self.upgrader == ident:
+			self.upgrader = None
+
+	def record_holders(self, lock: locking.AbstractLock) -> None:
+		if config.lock_metrics:
+			holders = len(self.readers) + (self.writer is not None) + (self.upgrader is not None)
+			locking.lock_metrics.record_holders(lock.db_name, holders)
+
+	def reserve_read(self, lock: locking.AbstractLock, ident: int, deadline: float) -> bool:
+		"""
+		Wait until the thread may join the cross-process read lock that is
+		already held by this process, or acquire it itself. Only called while
+		holding the condition.
+
+		Returns:
+		- True if the thread joined the held cross-process lock.
+
+		Raises:
+		- `LockTimeoutError`: If the deadline passed.
+		"""
+		while True:
+			if self.writer is None and not self.writers_waiting and not self.acquiring:
+				if self.holder is None:
+					self.readers.add(ident)
+					return False
+				if self.can_join_shared():
+					self.readers.add(ident)
+					lock.owner = ident
+					self.record_holders(lock)
+					return True
+			if not self.condition.wait(deadline - time.monotonic()):
+				raise locking.LockTimeoutError(f"Timeout while waiting for {lock.mode} lock.")
+
+	def reserve_exclusive(self, lock: locking.AbstractLock, ident: int, deadline: float) -> None:
+		"""
+		Wait until no other thread holds or acquires the lock, and reserve it
+		for the thread as writer or upgrader. Only called while holding the
+		condition.
+
+		Raises:
+		- `LockTimeoutError`: If the deadline passed.
+		"""
+		self.writers_waiting += 1
+		try:
+			while self.is_busy():
+				if not self.condition.wait(deadline - time.monotonic()):
+					raise locking.LockTimeoutError(f"Timeout while waiting for {lock.mode} lock.")
+		finally:
+			self.writers_waiting -= 1
+		if lock.mode == "upgrade":
+			self.upgrader = ident
+		else:
+			self.writer = ident
+
+	def can_join_shared(self) -> bool:
+		"""
+		Determine if a reader may join the cross-process read lock that is
+		already held by this process. To not starve writers of other
+		processes, this is only possible for `SHARED_LOCK_RECHECK_TIMEOUT`
+		seconds before it is checked again that no other process is waiting.
+		If one is, the lock drains: new readers wait until the last reader
+		released the cross-process lock, and then queue up behind the other
+		process.
+		"""
+		if self.draining:
+			return False
+		if time.monotonic() - self.shared_since < SHARED_LOCK_RECHECK_TIMEOUT:
+			return True
+		if self.holder._has_foreign_waiters():
+			self.draining = True
+			return False
+		self.shared_since = time.monotonic()
+		return True
+
+
+class ProcessLockTable:
+	"""
+	Process wide table of `ProcessLock`s, keyed by lock directory and
+	normalized database name. Entries are removed when no thread holds or
+	waits for them anymore.
+	"""
+
+	__slots__ = ("mutex", "entries")
+
+	mutex: threading.Lock
+	entries: dict[tuple[str, str], ProcessLock]
+
+	def __init__(self) -> None:
+		self.mutex = threading.Lock()
+		self.entries = {}
+
+	def _enter(self, key: tuple[str, str]) -> ProcessLock:
+		with self.mutex:
+			if (entry := self.entries.get(key)) is None:
+				entry = self.entries[key] = ProcessLock()
+			entry.users += 1
+			return entry
+
+	def _leave(self, key: tuple[str, str], entry: ProcessLock) -> None:
+		with self.mutex:
+			entry.users -= 1
+			if entry.users == 0:
+				del self.entries[key]
+
+	def is_held(self, lock: locking.AbstractLock) -> bool:
+		"""
+		Check if the current thread holds a lock on the database of the lock.
+		"""
+		with self.mutex:
+			entry = self.entries.get((lock.need_lock.ddb_dir, lock.db_name))
+		if entry is None:
+			return False
+		with entry.condition:
+			return entry.is_held_by(threading.get_ident())
+
+	def acquire(self, lock: locking.AbstractLock) -> None:
+		"""
+		Acquire the lock for the current thread. Only if no other thread of
+		this process holds a compatible cross-process lock, the cross-process
+		lock is acquired with `lock`.
+
+		Raises:
+		- `RuntimeError`: If the current thread already holds the lock.
+		- `LockTimeoutError`: If the lock could not be acquired within its timeout.
+		"""
+		start_ns = time.monotonic_ns() if config.lock_metrics else None
+		lock.start_deadline()
+		lock.polls = 0
+		try:
+			if (entry := self.reserve(lock, lock.deadline)) is not None:
+				# Acquire the cross-process lock without blocking the other threads
+				try:
+					lock._lock_cross_process()
+				except BaseException:
+					self.cancel(lock, entry)
+					raise
+				self.grant(lock, entry)
+		except BaseException as e:
+			if start_ns is not None:
+				locking.record_failed_acquisition(lock, e)
+			raise
+		if start_ns is not None:
+			locking.lock_metrics.record_acquire(lock.db_name, time.monotonic_ns() - start_ns, lock.polls)
+
+	def reserve(self, lock: locking.AbstractLock, deadline: float) -> ProcessLock | None:
+		"""
+		Wait until the current thread may acquire the lock in this process.
+		If the lock could join a cross-process lock that is already held, it
+		is acquired and None is returned. This is the case for read locks if
+		other threads hold a read or upgradeable lock, or if the current
+		thread already holds any lock on the database. Otherwise, the entry
+		is reserved for acquiring the cross-process lock, and then must be
+		passed to either `grant` or `cancel`.
+
+		Raises:
+		- `RuntimeError`: If the current thread already holds the lock and
+		`lock` is not a read lock.
+		- `LockTimeoutError`: If the deadline passed.
+		"""
+		ident = threading.get_ident()
+		key = (lock.need_lock.ddb_dir, lock.db_name)
+		entry = self._enter(key)
+		try:
+			with entry.condition:
+				if entry.is_held_by(ident):
+					if lock.mode != "read":
+						raise RuntimeError(f"Thread already has a lock. Do not try to obtain a {lock.mode} lock twice.")
+					# Reentrant read lock, which is covered by the held lock
+					lock.owner = ident
+					lock.reentrant = True
+					return None
+
+				if lock.mode != "read":
+					entry.reserve_exclusive(lock, ident, deadline)
+				elif entry.reserve_read(lock, ident, deadline):
+					return None
+				entry.acquiring = True
+				return entry
+		except BaseException:
+			self._leave(key, entry)
+			raise
+
+	def grant(self, lock: locking.AbstractLock, entry: ProcessLock) -> None:
+		"""
+		Complete a reservation after `lock` acquired the cross-process lock.
+		"""
+		with entry.condition:
+			entry.holder = lock
+			entry.acquiring = False
+			entry.shared_since = time.monotonic()
+			lock.owner = threading.get_ident()
+			entry.record_holders(lock)
+			entry.condition.notify_all()
+
+	def cancel(self, lock: locking.AbstractLock, entry: ProcessLock) -> None:
+		"""
+		Cancel a reservation, if the cross-process lock could not be acquired.
+		"""
+		with entry.condition:
+			entry.discard(threading.get_ident())
+			entry.acquiring = False
+			entry.condition.notify_all()
+		self._leave((lock.need_lock.ddb_dir, lock.db_name), entry)
+
+	def release(self, lock: locking.AbstractLock) -> None:
+		"""
+		Release the lock of the thread that acquired it with `lock`. If no
+		other thread of this process holds the lock anymore, the cross-process
+		lock is released. Releasing a lock that is not held does nothing.
+		"""
+		if lock.owner is None:
+			return
+		key = (lock.need_lock.ddb_dir, lock.db_name)
+		with self.mutex:
+			entry = self.entries[key]
+		if lock.reentrant:
+			lock.owner, lock.reentrant = None, False
+			self._leave(key, entry)
+			return
+		try:
+			with entry.condition:
+				entry.discard(lock.owner)
+				lock.owner = None
+				entry.record_holders(lock)
+				entry.condition.notify_all()
+				if not entry.readers and entry.writer is None and entry.upgrader is None:
+					holder, entry.holder = entry.holder, None
+					entry.draining = False
+					holder._unlock_cross_process()
+		finally:
+			self._leave(key, entry)
+
+	def upgrade(self, lock: locking.UpgradeableLock) -> None:
+		"""
+		Upgrade the upgradeable lock of the current thread to a write lock.
+		New readers are kept out, and once all threads of this process that
+		joined the lock have left, the cross-process lock is upgraded.
+		Upgrading a lock that was already upgraded does nothing.
+
+		Raises:
+		- `LockTimeoutError`: If the lock could not be upgraded within its
+		timeout. The lock is still held as an upgradeable lock.
+		"""
+		if lock.mode == "write":
+			return
+		lock.start_deadline()
+		with self.mutex:
+			entry = self.entries[(lock.need_lock.ddb_dir, lock.db_name)]
+		with entry.condition:
+			entry.writers_waiting += 1
+			try:
+				while entry.readers:
+					if not entry.condition.wait(lock.deadline - time.monotonic()):
+						raise locking.LockTimeoutError("Timeout while waiting for write lock.")
+			finally:
+				entry.writers_waiting -= 1
+			entry.acquiring = True
+		try:
+			lock._upgrade_cross_process()
+		finally:
+			with entry.condition:
+				if lock.mode == "write":
+					entry.upgrader, entry.writer = None, lock.owner
+				entry.acquiring = False
+				entry.condition.notify_all()
+
+	def _reset_after_fork(self) -> None:
+		"""
+		The child of a fork does not hold the locks of its parent.
+		"""
+		self.__init__()
+
+
+process_locks = ProcessLockTable()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=process_locks._reset_after_fork)
@@ -4,15 +4,21 @@ import contextlib
 import os
 import threading
 import time
+from typing import Iterable
 
-from . import config
+from . import config, lock_daemon_client, lock_fcntl, lock_table, waiting
 
 # Design decisions:
 # - Do not use pathlib, because it is slower than os
+# - This module implements the locks and the lock file backend. The "fcntl"
+#   and "daemon" backends are in `lock_fcntl` and `lock_daemon_client`, and
+#   threads of the same process coordinate in `lock_table` first.
 
 # Constants
 SLEEP_TIMEOUT = 0.001 * 1  # (ms)
-LOCK_KEEP_ALIVE_TIMEOUT = 0.001 * 0.08  # (ms)
+
+# Interval in which the heartbeat thread checks if held locks need a refresh
+LOCK_KEEP_ALIVE_TIMEOUT = 1.0  # (s)
 
 # Duration to wait updating the timestamp of the lock file
 ALIVE_LOCK_REFRESH_INTERVAL_NS = 1_000_000_000 * 10  # (s)
@@ -24,6 +30,26 @@ REMOVE_ORPHAN_LOCK_TIMEOUT = 20.0
 AQUIRE_LOCK_TIMEOUT = 60.0
 
 
+# Databases for which it was checked that no lock files of the flat lock layout
+# of previous versions are held, as (storage directory, normalized db name)
+legacy_locks_checked: set[tuple[str, str]] = set()
+
+
+class LockTimeoutError(RuntimeError):
+	"""
+	Raised if a lock could not be acquired within its timeout, or immediately
+	if it was requested with `blocking=False`.
+	"""
+
+
+class LockLostError(RuntimeError):
+	"""
+	Raised when writing with or releasing a lock of the "daemon" backend, if
+	the connection to the lock daemon broke while the lock was held. Then, the
+	daemon released the lock, and other processes may have acquired it since.
+	"""
+
+
 def os_touch(path: str) -> None:
 	"""
 	Create an empty file at the given path. This mimics the UNIX touch command
@@ -35,6 +61,151 @@ def os_touch(path: str) -> None:
 	os.close(fd)
 
 
+def normalize_db_name(db_name: str) -> str:
+	"""
+	Normalize db_name to avoid file naming conflicts.
+	"""
+	return db_name.replace("/", "___").replace(".", "____")
+
+
+class LockStats:
+	"""
+	Aggregated lock metrics of one database in the current process.
+	"""
+
+	__slots__ = (
+		"acquisitions",
+		"wait_ns",
+		"max_wait_ns",
+		"polls",
+		"timeouts",
+		"orphans_removed",
+		"holders",
+		"max_holders",
+	)
+
+	acquisitions: int  # Acquired locks
+	wait_ns: int  # Total duration between requesting and acquiring the locks
+	max_wait_ns: int
+	polls: int  # Lock state checks while waiting, like snapshots or flock attempts
+	timeouts: int
+	orphans_removed: int
+	holders: int  # Threads of this process that currently hold the lock
+	max_holders: int
+
+	def __init__(self) -> None:
+		for name in self.__slots__:
+			setattr(self, name, 0)
+
+	def as_dict(self) -> dict[str, int]:
+		return {name: getattr(self, name) for name in self.__slots__}
+
+
+class LockMetrics:
+	"""
+	Process wide lock metrics, aggregated per normalized database name.
+	Locks only record metrics if `config.lock_metrics` is enabled, so that
+	disabled metrics only cost one attribute check per lock.
+	"""
+
+	__slots__ = ("mutex", "stats")
+
+	mutex: threading.Lock
+	stats: dict[str, LockStats]
+
+	def __init__(self) -> None:
+		self.mutex = threading.Lock()
+		self.stats = {}
+
+	def _stats(self, db_name: str) -> LockStats:
+		if (stats := self.stats.get(db_name)) is None:
+			stats = self.stats[db_name] = LockStats()
+		return stats
+
+	def record_acquire(self, db_name: str, wait_ns: int, polls: int) -> None:
+		with self.mutex:
+			stats = self._stats(db_name)
+			stats.acquisitions += 1
+			stats.wait_ns += wait_ns
+			stats.max_wait_ns = max(stats.max_wait_ns, wait_ns)
+			stats.polls += polls
+
+	def record_failure(self, db_name: str, polls: int, timed_out: bool) -> None:
+		with self.mutex:
+			stats = self._stats(db_name)
+			stats.timeouts += timed_out
+			stats.polls += polls
+
+	def record_orphan(self, db_name: str) -> None:
+		with self.mutex:
+			self._stats(db_name).orphans_removed += 1
+
+	def record_holders(self, db_name: str, holders: int) -> None:
+		with self.mutex:
+			stats = self._stats(db_name)
+			stats.holders = holders
+			stats.max_holders = max(stats.max_holders, holders)
+
+	def query(self, db_name: str | None = None) -> dict:
+		"""
+		Get the metrics of one database, or of all databases by their
+		normalized names if `db_name` is None.
+		"""
+		with self.mutex:
+			if db_name is not None:
+				# Querying a database without metrics does not add it
+				return self.stats.get(normalize_db_name(db_name), LockStats()).as_dict()
+			return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+	def reset(self) -> None:
+		with self.mutex:
+			self.stats = {}
+
+	def _reset_after_fork(self) -> None:
+		"""
+		The child of a fork starts with its own metrics.
+		"""
+		self.__init__()
+
+
+lock_metrics = LockMetrics()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=lock_metrics._reset_after_fork)
+
+
+def get_lock_metrics(db_name: str | None = None) -> dict:
+	"""
+	Get the lock metrics that were recorded in this process while
+	`config.lock_metrics` was enabled.
+
+	Args:
+	- `db_name`: The database to get the metrics for. If None, the metrics of
+	all databases are returned, keyed by their normalized names.
+
+	Returns:
+	- A dict with the number of `acquisitions`, the total and maximum waiting
+	time in `wait_ns` and `max_wait_ns`, the number of `polls` of the lock
+	state while waiting, the number of `timeouts` and `orphans_removed`, and
+	the current and maximum number of threads that hold the lock in this
+	process, `holders` and `max_holders`.
+	"""
+	return lock_metrics.query(db_name)
+
+
+def reset_lock_metrics() -> None:
+	"""
+	Discard all recorded lock metrics.
+	"""
+	lock_metrics.reset()
+
+
+def record_failed_acquisition(lock: AbstractLock, error: BaseException) -> None:
+	"""
+	Record the metrics of a lock that could not be acquired.
+	"""
+	lock_metrics.record_failure(lock.db_name, lock.polls, isinstance(error, LockTimeoutError))
+
+
 class LockFileMeta:
 	"""
 	Metadata representation for a lock file.
@@ -71,28 +242,53 @@ class LockFileMeta:
 		return LockFileMeta(self.ddb_dir, self.name, self.id, time_ns, self.stage, self.mode)
 
 
+def remove_if_orphaned(lock_meta: LockFileMeta) -> bool:
+	"""
+	Remove the lock file if it is older than `REMOVE_ORPHAN_LOCK_TIMEOUT`,
+	since the heartbeat of its process would have refreshed it otherwise.
+
+	Returns:
+	- True if the lock was orphaned and removed.
+	"""
+	lock_age = time.time_ns() - int(lock_meta.time_ns)
+	if lock_age <= REMOVE_ORPHAN_LOCK_TIMEOUT * 1_000_000_000:
+		return False
+	os.unlink(lock_meta.path)
+	if config.lock_metrics:
+		lock_metrics.record_orphan(lock_meta.name)
+	return True
+
+
 class FileLocksSnapshot:
 	"""
-	Represents a snapshot of the current state of file locks in the directory.
+	Represents a snapshot of the current state of file locks in the lock
+	directory of a database.
 	This snapshot assists in deciding which lock should be acquired or released next.
 
 	On init, orphaned locks are removed.
 	"""
 
-	__slots__ = ("any_has_locks", "any_write_locks", "any_has_write_locks", "locks")
+	__slots__ = ("any_has_locks", "any_write_locks", "any_has_write_locks", "any_has_upgrade_locks", "locks")
 
 	locks: list[LockFileMeta]
 	any_has_locks: bool
 	any_write_locks: bool
 	any_has_write_locks: bool
+	any_has_upgrade_locks: bool
 
 	def __init__(self, need_lock: LockFileMeta) -> None:
 		self.locks = []
 		self.any_has_locks = False
 		self.any_write_locks = False
 		self.any_has_write_locks = False
+		self.any_has_upgrade_locks = False
+
+		try:
+			file_names = os.listdir(need_lock.ddb_dir)
+		except FileNotFoundError:
+			file_names = []  # No lock was ever acquired
 
-		for file_name in os.listdir(need_lock.ddb_dir):
+		for file_name in file_names:
 			if not file_name.endswith(".lock"):
 				continue
 			name, id, time_ns, stage, mode, _ = file_name.split(".")
@@ -100,24 +296,23 @@ class FileLocksSnapshot:
 				continue
 
 			lock_meta = LockFileMeta(need_lock.ddb_dir, name, id, time_ns, stage, mode)
+			if lock_meta.path != need_lock.path and remove_if_orphaned(lock_meta):
+				continue
+			self._add(lock_meta)
 
-			# Remove orphaned locks
-			if lock_meta.path != need_lock.path:
-				lock_age = time.time_ns() - int(lock_meta.time_ns)
-				if lock_age > REMOVE_ORPHAN_LOCK_TIMEOUT * 1_000_000_000:
-					os.unlink(lock_meta.path)
-					print(f"Removed orphaned lock ({lock_meta.path})")
-					continue
-
-			self.locks.append(lock_meta)
-
-			# Update lock state flags
-			if lock_meta.stage == "has":
-				self.any_has_locks = True
-				if lock_meta.mode == "write":
-					self.any_has_write_locks = True
+	def _add(self, lock_meta: LockFileMeta) -> None:
+		"""
+		Add a lock to the snapshot, and update the lock state flags.
+		"""
+		self.locks.append(lock_meta)
+		if lock_meta.stage == "has":
+			self.any_has_locks = True
 			if lock_meta.mode == "write":
-				self.any_write_locks = True
+				self.any_has_write_locks = True
+			if lock_meta.mode == "upgrade":
+				self.any_has_upgrade_locks = True
+		if lock_meta.mode == "write":
+			self.any_write_locks = True
 
 	def exists(self, l: LockFileMeta) -> bool:
 		"""
@@ -125,95 +320,210 @@ class FileLocksSnapshot:
 		"""
 		return any(x.id == l.id and x.stage == l.stage and x.mode == l.mode for x in self.locks)
 
-	def oldest_need(self, need_lock: LockFileMeta) -> bool:
+	def oldest_need(self, need_lock: LockFileMeta, modes: tuple[str, ...] = ("read", "write", "upgrade")) -> bool:
 		"""
-		Determine if the provided 'need_lock' is the oldest among all 'need' locks in the snapshot.
+		Determine if the provided 'need_lock' is the oldest among all 'need' locks
+		of the given modes in the snapshot.
 		"""
 		# len(need_locks) is at least 1 since this function is only called if there is a need_lock
-		need_locks = [l for l in self.locks if l.stage == "need"]
+		need_locks = [l for l in self.locks if l.stage == "need" and l.mode in modes]
 		# Sort by time_ns. If multiple, the the one with the smaller id is first
 		need_locks = sorted(need_locks, key=lambda l: (int(l.time_ns), int(l.id)))
 		return need_locks[0].id == need_lock.id
 
 
+class LockRegistry:
+	"""
+	Process wide registry of all held file based locks.
+
+	A single daemon heartbeat thread, which is started on the first
+	registration, periodically refreshes the has locks that are older than
+	`ALIVE_LOCK_REFRESH_INTERVAL_NS`, so that other processes do not consider
+	them orphaned. While no lock is registered, the heartbeat thread sleeps
+	until the next registration.
+	"""
+
+	__slots__ = ("locks", "condition", "thread")
+
+	locks: set[AbstractLock]
+	condition: threading.Condition
+	thread: threading.Thread | None
+
+	def __init__(self) -> None:
+		self.locks = set()
+		self.condition = threading.Condition()
+		self.thread = None
+
+	def register(self, lock: AbstractLock) -> None:
+		"""
+		Register a lock whose has lock file was just created.
+		"""
+		with self.condition:
+			self.locks.add(lock)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._heartbeat, name="ddb-lock-heartbeat", daemon=True)
+				self.thread.start()
+			self.condition.notify()
+
+	def unregister(self, lock: AbstractLock) -> None:
+		"""
+		Unregister a lock. After this returns, the heartbeat will not touch the
+		lock's files anymore, so they can safely be removed.
+		"""
+		with self.condition:
+			self.locks.discard(lock)
+
+	def _heartbeat(self) -> None:
+		with self.condition:
+			while True:
+				if not self.locks:
+					self.condition.wait()
+					continue
+				now = time.time_ns()
+				for lock in self.locks:
+					if now - int(lock.has_lock.time_ns) < ALIVE_LOCK_REFRESH_INTERVAL_NS:
+						continue
+					# If the lock directory is not accessible, the lock cannot be kept
+					# alive. A broken daemon connection is marked as lost on failure.
+					with contextlib.suppress(OSError):
+						lock._refresh_has_lock()
+				self.condition.wait(LOCK_KEEP_ALIVE_TIMEOUT)
+
+	def _reset_after_fork(self) -> None:
+		"""
+		The child of a fork neither holds the locks of its parent nor runs the
+		heartbeat thread.
+		"""
+		self.__init__()
+
+
+lock_registry = LockRegistry()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=lock_registry._reset_after_fork)
+
+
 class AbstractLock:
 	"""
-	Abstract base class for file locks. This class doesn't lock/unlock by itself but
+	Abstract base class for locks. This class doesn't lock/unlock by itself but
 	provides a blueprint for derived classes to implement.
+
+	Threads of the same process coordinate through the `lock_table.process_locks`
+	table.
+	Between processes, the lock is implemented by the backend configured in
+	`config.lock_backend`.
+
+	Args:
+	- `db_name`: The name of the database to lock.
+	- `timeout`: The maximum duration in seconds to wait for the lock.
+	Defaults to `AQUIRE_LOCK_TIMEOUT`.
+	- `blocking`: If `False`, do not wait if the lock is not available.
 	"""
 
-	__slots__ = ("db_name", "need_lock", "has_lock", "snapshot", "mode", "is_alive" "keep_alive_thread")
+	__slots__ = (
+		"db_name",
+		"need_lock",
+		"has_lock",
+		"snapshot",
+		"mode",
+		"owner",
+		"reentrant",
+		"kernel_lock_fd",
+		"kernel_intent_fd",
+		"daemon_connection",
+		"polls",
+		"timeout",
+		"deadline",
+	)
 
 	db_name: str
 	need_lock: LockFileMeta
 	has_lock: LockFileMeta
 	snapshot: FileLocksSnapshot
 	mode: str
-	is_alive: bool
-	keep_alive_thread: threading.Thread
-
-	def __init__(self, db_name: str) -> None:
-		# Normalize db_name to avoid file naming conflicts
-		self.db_name = db_name.replace("/", "___").replace(".", "____")
+	owner: int | None  # Ident of the thread that holds this lock
+	reentrant: bool  # Whether this lock is covered by another lock of its owner
+	kernel_lock_fd: int | None
+	kernel_intent_fd: int | None
+	daemon_connection: lock_daemon_client.DaemonConnection | None
+	polls: int  # Lock state checks while waiting for the lock, recorded in the lock metrics
+	timeout: float | None
+	deadline: float  # Monotonic time until which the current acquisition may wait
+
+	def __init__(self, db_name: str, timeout: float | None = None, blocking: bool = True) -> None:
+		self.db_name = normalize_db_name(db_name)
 		time_ns = time.time_ns()
 		t_id = f"{threading.get_native_id()}"  # ID that's unique across processes and threads.
-		dir = os.path.join(config.storage_directory, ".ddb")
+		# Each database has its own lock directory, so that snapshots only list its own locks
+		dir = os.path.join(config.storage_directory, ".ddb", "locks", self.db_name)
 
 		self.need_lock = LockFileMeta(dir, self.db_name, t_id, time_ns, "need", self.mode)
 		self.has_lock = LockFileMeta(dir, self.db_name, t_id, time_ns, "has", self.mode)
 
-		self.is_alive = False
-		self.keep_alive_thread = None
-
-		# Ensure lock directory exists
-		if not os.path.isdir(dir):
-			os.makedirs(dir, exist_ok=True)
+		self.owner = None
+		self.reentrant = False
+		self.kernel_lock_fd = None
+		self.kernel_intent_fd = None
+		self.daemon_connection = None
+		self.polls = 0
+		self.timeout = timeout if blocking else 0.0
+		self.deadline = 0.0
 
-	def _keep_alive_thread(self) -> None:
+	def start_deadline(self) -> None:
 		"""
-		Keep the lock alive by updating the timestamp of the lock file.
+		Start the timeout of an acquisition or upgrade of this lock.
 		"""
+		timeout = AQUIRE_LOCK_TIMEOUT if self.timeout is None else self.timeout
+		self.deadline = time.monotonic() + timeout
 
-		current_has_lock_time_ns: int = int(self.has_lock.time_ns)
-
-		while self.is_alive:
-			time.sleep(LOCK_KEEP_ALIVE_TIMEOUT)
-			if time.time_ns() - current_has_lock_time_ns < ALIVE_LOCK_REFRESH_INTERVAL_NS:
-				continue
-
-			# Assert: The lock is older than ALIVE_LOCK_REFRESH_INTERVAL_NS ns
-			# This means the has_lock must be refreshed
-
-			new_has_lock = self.has_lock.new_with_updated_time()
-			os_touch(new_has_lock.path)
-			with contextlib.suppress(FileNotFoundError):
-				os.unlink(self.has_lock.path)  # Remove old lock file
-			self.has_lock = new_has_lock
-			current_has_lock_time_ns = int(new_has_lock.time_ns)
-
-	def _start_keep_alive_thread(self) -> None:
+	def _refresh_has_lock(self) -> None:
 		"""
-		Start a thread that keeps the lock alive by updating the timestamp of the lock file.
+		Keep the lock alive by replacing the has lock file with one that has
+		the current timestamp, or by renewing the lease of the lock daemon.
+		Only called by the `LockRegistry` heartbeat.
 		"""
-
-		if self.keep_alive_thread is not None:
-			raise RuntimeError("Keep alive thread already exists.")
-
-		self.is_alive = True
-		self.keep_alive_thread = threading.Thread(target=self._keep_alive_thread, daemon=False)
-		self.keep_alive_thread.start()
+		new_has_lock = self.has_lock.new_with_updated_time()
+		if self.daemon_connection is not None:
+			self.daemon_connection.send("renew")
+			self.has_lock = new_has_lock
+			return
+		os_touch(new_has_lock.path)
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(self.has_lock.path)  # Remove old lock file
+		self.has_lock = new_has_lock
 
 	def _lock(self) -> None:
 		"""Override this method to implement locking mechanism."""
 		raise NotImplementedError
 
-	def _unlock(self) -> None:
-		"""Remove the lock files associated with this lock."""
+	def _is_grantable(self) -> bool:
+		"""Override this method to decide if the lock can be granted, given the current snapshot."""
+		raise NotImplementedError
+
+	def _lock_cross_process(self) -> None:
+		"""
+		Acquire the lock between processes with the configured backend.
+		"""
+		if (config.storage_directory, self.db_name) not in legacy_locks_checked:
+			self._wait_for_legacy_locks()
+		if config.lock_backend == "fcntl":
+			lock_fcntl.acquire(self)
+		elif config.lock_backend == "daemon":
+			lock_daemon_client.acquire(self)
+		else:
+			self._lock_files()
+
+	def _unlock_cross_process(self) -> None:
+		"""
+		Release the lock between processes.
+		"""
+		if self.kernel_lock_fd is not None:
+			lock_fcntl.release(self)
+
+		lock_registry.unregister(self)
 
-		if self.keep_alive_thread is not None:
-			self.is_alive = False
-			self.keep_alive_thread.join()
-			self.keep_alive_thread = None
+		if self.daemon_connection is not None:
+			lock_daemon_client.release(self)
+			return
 
 		for p in ("need_lock", "has_lock"):
 			try:
@@ -221,8 +531,120 @@ class AbstractLock:
 					os.unlink(lock.path)
 			except FileNotFoundError:
 				pass
-			finally:
-				setattr(self, p, None)
+
+	def _check_held(self) -> None:
+		"""
+		Check that the lock daemon still holds the lock, by renewing its lease.
+		Locks of the other backends cannot be lost while they are held.
+
+		Raises:
+		- `LockLostError`: If the connection to the lock daemon broke.
+		"""
+		if self.daemon_connection is not None:
+			lock_daemon_client.check_held(self)
+
+	def _wait_for_legacy_locks(self) -> None:
+		"""
+		Previous versions stored the lock files of all databases directly in
+		the .ddb directory. Wait until the locks that processes running such
+		a version hold on this database are released, and remove orphaned
+		ones. This is only checked once per database and process, since
+		processes of previous versions do not see the new lock layout anyway.
+		"""
+		legacy_dir = os.path.join(config.storage_directory, ".ddb")
+		need_lock = LockFileMeta(legacy_dir, self.db_name, self.need_lock.id, self.need_lock.time_ns, "need", self.mode)
+		waiter = None
+		try:
+			while True:
+				snapshot = FileLocksSnapshot(need_lock)
+				if self.mode == "read" and not snapshot.any_write_locks:
+					break
+				if self.mode != "read" and not snapshot.locks:
+					break
+				if waiter is None:
+					waiter = waiting.make_waiter(legacy_dir, SLEEP_TIMEOUT)
+				if time.monotonic() > self.deadline:
+					raise LockTimeoutError(f"Timeout while waiting for {self.mode} lock.")
+				waiter.wait()
+				self.polls += 1
+		finally:
+			if waiter is not None:
+				waiter.close()
+		legacy_locks_checked.add((config.storage_directory, self.db_name))
+
+	def _has_foreign_waiters(self) -> bool:
+		"""
+		Check if another process waits for the lock that this lock holds.
+		"""
+		if self.kernel_lock_fd is not None:
+			return lock_fcntl.has_waiters(self)
+		if self.daemon_connection is not None:
+			return lock_daemon_client.has_waiters(self)
+		snapshot = FileLocksSnapshot(self.need_lock)
+		return any(l.stage == "need" for l in snapshot.locks)
+
+	def _lock_files(self) -> None:
+		"""
+		Acquire the lock with the lock file protocol. First, a need lock file
+		expresses the intention to acquire the lock. Then, snapshots of the lock
+		files are taken until the lock is grantable, waiting in between
+		according to `config.lock_wait_strategy`. Finally, the need lock is
+		replaced by a has lock.
+		"""
+
+		# Express intention to acquire lock
+		self._touch_need_lock()
+		self.snapshot = FileLocksSnapshot(self.need_lock)
+
+		# If this thread already holds a lock of this mode, raise an exception.
+		if self.snapshot.exists(self.has_lock):
+			os.unlink(self.need_lock.path)
+			raise RuntimeError(f"Thread already has a {self.mode} lock. Do not try to obtain a {self.mode} lock twice.")
+
+		# Try to acquire lock until conditions are met or a timeout occurs
+		waiter = None
+		try:
+			while not self._is_grantable():
+				if time.monotonic() > self.deadline:
+					raise LockTimeoutError(f"Timeout while waiting for {self.mode} lock.")
+				# The waiter starts watching before the next snapshot is taken,
+				# so that no lock change between the two is missed
+				if waiter is None:
+					waiter = waiting.make_waiter(self.need_lock.ddb_dir, SLEEP_TIMEOUT)
+				else:
+					waiter.wait()
+				self.snapshot = FileLocksSnapshot(self.need_lock)
+				self.polls += 1
+		except BaseException:
+			# Do not block others until the need lock is removed as orphaned
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self.need_lock.path)
+			raise
+		finally:
+			if waiter is not None:
+				waiter.close()
+
+		self._grant_files()
+
+	def _touch_need_lock(self) -> None:
+		try:
+			os_touch(self.need_lock.path)
+		except FileNotFoundError:
+			os.makedirs(self.need_lock.ddb_dir, exist_ok=True)
+			os_touch(self.need_lock.path)
+
+	def _grant_files(self) -> None:
+		"""
+		Replace the need lock by a has lock, once the lock is grantable.
+		"""
+		self.has_lock = self.has_lock.new_with_updated_time()
+		os_touch(self.has_lock.path)
+		os.unlink(self.need_lock.path)
+		lock_registry.register(self)
+
+	def _unlock(self) -> None:
+		"""Release the lock, and the cross-process lock if this was the last holder in this process."""
+		lock_table.process_locks.release(self)
 
 	def __enter__(self) -> None:
 		self._lock()
@@ -233,71 +655,315 @@ class AbstractLock:
 
 class ReadLock(AbstractLock):
 	"""
-	A file-based read lock.
+	A read lock.
 	Multiple threads/processes can simultaneously hold a read lock unless there's a write lock.
 	"""
 
 	mode = "read"
 
 	def _lock(self) -> None:
-		# Express intention to acquire read lock
-		os.makedirs(os.path.dirname(self.need_lock.path), exist_ok=True)
-		os_touch(self.need_lock.path)
-		self.snapshot = FileLocksSnapshot(self.need_lock)
+		lock_table.process_locks.acquire(self)
 
-		# If this thread already holds a read lock, raise an exception.
-		if self.snapshot.exists(self.has_lock):
-			os.unlink(self.need_lock.path)
-			raise RuntimeError("Thread already has a read lock. Do not try to obtain a read lock twice.")
-
-		start_time = time.time()
-
-		# Try to acquire lock until conditions are met or a timeout occurs
-		while True:
-			if not self.snapshot.any_write_locks or (
-				not self.snapshot.any_has_write_locks and self.snapshot.oldest_need(self.need_lock)
-			):
-				self.has_lock = self.has_lock.new_with_updated_time()
-				os_touch(self.has_lock.path)
-				os.unlink(self.need_lock.path)
-				self._start_keep_alive_thread()
-				return
-			time.sleep(SLEEP_TIMEOUT)
-			if time.time() - start_time > AQUIRE_LOCK_TIMEOUT:
-				raise RuntimeError("Timeout while waiting for read lock.")
-			self.snapshot = FileLocksSnapshot(self.need_lock)
+	def _is_grantable(self) -> bool:
+		return not self.snapshot.any_write_locks or (
+			not self.snapshot.any_has_write_locks and self.snapshot.oldest_need(self.need_lock)
+		)
 
 
 class WriteLock(AbstractLock):
 	"""
-	A file-based write lock.
+	A write lock.
 	Only one thread/process can hold a write lock, blocking others from acquiring either read or write locks.
 	"""
 
 	mode = "write"
 
 	def _lock(self) -> None:
-		# Express intention to acquire write lock
-		os.makedirs(os.path.dirname(self.need_lock.path), exist_ok=True)
-		os_touch(self.need_lock.path)
-		self.snapshot = FileLocksSnapshot(self.need_lock)
+		lock_table.process_locks.acquire(self)
 
-		# If this thread already holds a write lock, raise an exception.
-		if self.snapshot.exists(self.has_lock):
-			os.unlink(self.need_lock.path)
-			raise RuntimeError("Thread already has a write lock. Do not try to obtain a write lock twice.")
+	def _is_grantable(self) -> bool:
+		return not self.snapshot.any_has_locks and self.snapshot.oldest_need(self.need_lock)
 
-		start_time = time.time()
 
-		# Try to acquire lock until conditions are met or a timeout occurs
-		while True:
-			if not self.snapshot.any_has_locks and self.snapshot.oldest_need(self.need_lock):
-				self.has_lock = self.has_lock.new_with_updated_time()
-				os_touch(self.has_lock.path)
-				os.unlink(self.need_lock.path)
-				self._start_keep_alive_thread()
-				return
-			time.sleep(SLEEP_TIMEOUT)
-			if time.time() - start_time > AQUIRE_LOCK_TIMEOUT:
-				raise RuntimeError("Timeout while waiting for write lock.")
+class UpgradeableLock(AbstractLock):
+	"""
+	A read lock that can be upgraded to a write lock.
+	Only one thread/process can hold an upgradeable or write lock, but other
+	threads/processes can hold read locks at the same time until the lock is
+	upgraded. Since no other thread/process can write in the meantime, the
+	data that was read before the upgrade is still up to date afterwards.
+	"""
+
+	def __init__(self, db_name: str, timeout: float | None = None, blocking: bool = True) -> None:
+		self.mode = "upgrade"
+		super().__init__(db_name, timeout, blocking)
+
+	def _lock(self) -> None:
+		lock_table.process_locks.acquire(self)
+
+	def _upgrade(self) -> None:
+		"""
+		Upgrade to a write lock, once all other readers released their locks.
+		New readers wait until the write lock is released.
+		"""
+		lock_table.process_locks.upgrade(self)
+
+	def _is_grantable(self) -> bool:
+		return (
+			not self.snapshot.any_has_write_locks
+			and not self.snapshot.any_has_upgrade_locks
+			and self.snapshot.oldest_need(self.need_lock, ("write", "upgrade"))
+		)
+
+	def _is_upgradable(self) -> bool:
+		"""
+		The upgrade write lock is grantable if this lock is the only has lock,
+		and no reader that is older than the write need lock and all other
+		exclusive need locks may still be granted. Other exclusive locks are
+		not waited for, since they wait until this lock is released.
+		"""
+		oldest = (int(self.need_lock.time_ns), int(self.need_lock.id))
+		for l in self.snapshot.locks:
+			if l.stage == "has" and not (l.id == self.has_lock.id and l.mode == "upgrade"):
+				return False
+			if l.stage == "need" and l.mode != "read" and l.id != self.need_lock.id:
+				oldest = min(oldest, (int(l.time_ns), int(l.id)))
+		return not any(
+			l.stage == "need" and l.mode == "read" and (int(l.time_ns), int(l.id)) < oldest for l in self.snapshot.locks
+		)
+
+	def _upgrade_cross_process(self) -> None:
+		"""
+		Upgrade the cross-process lock with the configured backend.
+		"""
+		if self.kernel_lock_fd is not None:
+			lock_fcntl.upgrade(self)
+		elif self.daemon_connection is not None:
+			lock_daemon_client.upgrade(self)
+		else:
+			self._upgrade_files()
+		self.mode = "write"
+
+	def _upgrade_files(self) -> None:
+		"""
+		Express the intention to write with a write need lock, which keeps new
+		readers out, and replace the has lock by a write has lock once all
+		other readers are gone.
+		"""
+		need_lock = self.need_lock
+		self.need_lock = LockFileMeta(need_lock.ddb_dir, self.db_name, need_lock.id, f"{time.time_ns()}", "need", "write")
+		self._touch_need_lock()
+		waiter = None
+		try:
 			self.snapshot = FileLocksSnapshot(self.need_lock)
+			while not self._is_upgradable():
+				if time.monotonic() > self.deadline:
+					raise LockTimeoutError("Timeout while waiting for write lock.")
+				if waiter is None:
+					waiter = waiting.make_waiter(self.need_lock.ddb_dir, SLEEP_TIMEOUT)
+				else:
+					waiter.wait()
+				self.snapshot = FileLocksSnapshot(self.need_lock)
+				self.polls += 1
+		except BaseException:
+			os.unlink(self.need_lock.path)
+			self.need_lock = need_lock
+			raise
+		finally:
+			if waiter is not None:
+				waiter.close()
+
+		has_lock = LockFileMeta(need_lock.ddb_dir, self.db_name, need_lock.id, f"{time.time_ns()}", "has", "write")
+		# The write has lock exists before the upgradeable has lock is removed,
+		# so that other processes never see the lock as free
+		with lock_registry.condition:
+			os_touch(has_lock.path)
+			os.unlink(self.need_lock.path)
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self.has_lock.path)
+			self.has_lock = has_lock
+
+
+class MultiWriteLock:
+	"""
+	Write locks for many databases, which are acquired together.
+
+	The locks are ordered by their normalized database names. In the current
+	process, they are reserved in that order. Between processes, the kernel
+	and daemon backends acquire them in that order as well, so that
+	overlapping multi locks cannot deadlock. The lock file backend uses
+	`lock_files_together`.
+
+	If `upgradeable` is True, upgradeable locks are acquired instead. Since
+	upgrading only waits for readers, they can be upgraded in any order.
+	The `timeout` and `blocking` arguments apply to all locks together.
+	"""
+
+	__slots__ = ("locks", "locks_by_db_name")
+
+	locks: list[WriteLock | UpgradeableLock]
+	locks_by_db_name: dict[str, WriteLock | UpgradeableLock]
+
+	def __init__(
+		self,
+		db_names: list[str],
+		upgradeable: bool = False,
+		timeout: float | None = None,
+		blocking: bool = True,
+	) -> None:
+		lock_type = UpgradeableLock if upgradeable else WriteLock
+		locks, self.locks_by_db_name = {}, {}
+		for db_name in db_names:
+			lock = lock_type(db_name, timeout, blocking)
+			self.locks_by_db_name[db_name] = locks.setdefault(lock.db_name, lock)
+		self.locks = [locks[name] for name in sorted(locks)]
+
+	def _lock(self) -> None:
+		start_ns = time.monotonic_ns() if config.lock_metrics else None
+		reserved: list[tuple[WriteLock | UpgradeableLock, lock_table.ProcessLock]] = []
+		for lock in self.locks:
+			lock.polls = 0
+			lock.start_deadline()
+		try:
+			for lock in self.locks:
+				reserved.append((lock, lock_table.process_locks.reserve(lock, lock.deadline)))
+			self._lock_cross_process()
+		except BaseException as e:
+			for lock, entry in reserved:
+				lock_table.process_locks.cancel(lock, entry)
+			if start_ns is not None:
+				for lock in self.locks:
+					record_failed_acquisition(lock, e)
+			raise
+		for lock, entry in reserved:
+			lock_table.process_locks.grant(lock, entry)
+		if start_ns is not None:
+			wait_ns = time.monotonic_ns() - start_ns
+			for lock in self.locks:
+				lock_metrics.record_acquire(lock.db_name, wait_ns, lock.polls)
+
+	def _lock_cross_process(self) -> None:
+		"""
+		Acquire the cross-process locks, once all locks were reserved in this
+		process. If one of them cannot be acquired, the others are released.
+		"""
+		if config.lock_backend not in ("fcntl", "daemon"):
+			lock_files_together(self.locks)
+			return
+		for i, lock in enumerate(self.locks):
+			try:
+				lock._lock_cross_process()
+			except BaseException:
+				for acquired in self.locks[:i]:
+					acquired._unlock_cross_process()
+				raise
+
+	def _upgrade(self) -> None:
+		for lock in self.locks:
+			lock._upgrade()
+
+	def _check_held(self) -> None:
+		for lock in self.locks:
+			lock._check_held()
+
+	def _unlock(self) -> None:
+		unlock_all(reversed(self.locks))
+
+	def __enter__(self) -> None:
+		self._lock()
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:  # noqa: ANN001
+		self._unlock()
+
+
+def lock_files_together(locks: list[AbstractLock]) -> None:
+	"""
+	Acquire many locks with the lock file protocol at once.
+
+	All need locks are created in one pass with the same timestamp, so that
+	they are either all older or all younger than the need locks of any other
+	multi lock. Then, the locks are only granted together, once all of them
+	are grantable. Since a multi lock never holds some of its locks while
+	waiting for others, and the oldest waiting lock is always granted
+	eventually, overlapping multi locks cannot deadlock.
+
+	Raises:
+	- `LockTimeoutError`: If the locks could not be acquired before the
+	earliest deadline of the locks.
+	"""
+	if not locks:
+		return
+	mode = locks[0].mode
+	deadline = min(lock.deadline for lock in locks)
+	touch_need_locks(locks)
+
+	waiter = None
+	try:
+		# Check the lock that blocked the previous pass first
+		blocking = 0
+		while (blocking := find_blocking_lock(locks, blocking, waiter is not None)) is not None:
+			if time.monotonic() > deadline:
+				raise LockTimeoutError(f"Timeout while waiting for {mode} locks.")
+			if waiter is None:
+				waiter = waiting.make_waiter(None, SLEEP_TIMEOUT)
+			waiter.wait()
+	except BaseException:
+		for lock in locks:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(lock.need_lock.path)
+		raise
+	finally:
+		if waiter is not None:
+			waiter.close()
+
+	for lock in locks:
+		lock._grant_files()
+
+
+def touch_need_locks(locks: list[AbstractLock]) -> None:
+	"""
+	Create the need lock files of all locks with the same timestamp, once
+	the locks that processes of previous versions hold on them are released.
+	"""
+	for lock in locks:
+		if (config.storage_directory, lock.db_name) not in legacy_locks_checked:
+			lock._wait_for_legacy_locks()
+
+	time_ns = f"{time.time_ns()}"
+	for lock in locks:
+		need = lock.need_lock
+		lock.need_lock = LockFileMeta(need.ddb_dir, need.name, need.id, time_ns, need.stage, need.mode)
+		lock._touch_need_lock()
+
+
+def find_blocking_lock(locks: list[AbstractLock], first: int, count_polls: bool) -> int | None:
+	"""
+	Take a new snapshot for each lock, starting with the lock at the index
+	`first`, until a lock is not grantable.
+
+	Returns:
+	- The index of the lock that is not grantable, or None if all are.
+	"""
+	for i in [first] + [i for i in range(len(locks)) if i != first]:
+		locks[i].snapshot = FileLocksSnapshot(locks[i].need_lock)
+		locks[i].polls += count_polls
+		if not locks[i]._is_grantable():
+			return i
+	return None
+
+
+def unlock_all(locks: Iterable[AbstractLock]) -> None:
+	"""
+	Release all locks, even if releasing one of them raises.
+
+	Raises:
+	- `LockLostError`: If any of the locks was lost, after all were released.
+	"""
+	lost = None
+	for lock in locks:
+		try:
+			lock._unlock()
+		except LockLostError as e:
+			lost = e
+	if lost is not None:
+		raise lost
@@ -77,7 +77,8 @@ def at(*path, key: str = None, where: Callable[[Any, Any], bool] = None) -> DDBM
 	Args:
 	- `path`: The path to the file or folder. Can be a string, a
 	comma-separated list of strings, or a list.
-	- `key`: The key to select from the file.
+	- `key`: The key to select from the file. Nested keys can be selected
+	with a path of keys joined with dots, e.g. `"user.posts.123"`.
 	- `where`: A function that takes a key and value and returns `True` if the
 	key should be selected.
 
@@ -166,13 +167,155 @@ class DDBMethodChooser:
 			raise RuntimeError("DDB.at().delete() cannot be used with the where or key parameters")
 		io_safe.delete(self.path)
 
-	def read(self, as_type: Type[T] = None) -> dict | T | None:
+	def build_index(self, timeout: float | None = None, blocking: bool = True) -> None:
+		"""
+		Index all keys of the selected file at once, so that partial reads and
+		writes of any key do not have to search the file first. This is done
+		automatically whenever the whole file is written.
+
+		Args:
+		- `timeout`: Seconds to wait for the write lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock.
+
+		Raises:
+		- `FileNotFoundError`: If the file does not exist.
+		- `LockTimeoutError`: If the lock could not be acquired in time.
+		"""
+		if self.where is not None or self.key is not None:
+			raise RuntimeError("DDB.at().build_index() cannot be used with the where or key parameters")
+		io_safe.build_index(self.path, timeout, blocking)
+
+	def create_value_index(self, field: str, timeout: float | None = None, blocking: bool = True) -> None:
+		"""
+		Declare a value index on a field of the values of the selected file,
+		e.g. `DDB.at("users").create_value_index("age")`. It is kept up to date
+		by all writes, and used by `query` to only read the matching values.
+
+		Args:
+		- `field`: The field of the values to index.
+		- `timeout`: Seconds to wait for the write lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock.
+
+		Raises:
+		- `FileNotFoundError`: If the file does not exist.
+		- `LockTimeoutError`: If the lock could not be acquired in time.
+		"""
+		if not self.op_type.file_normal:
+			raise RuntimeError("DDB.at().create_value_index() can only be used with a single file")
+		io_safe.create_value_index(self.path, field, timeout, blocking)
+
+	def delete_value_index(self, field: str, timeout: float | None = None, blocking: bool = True) -> None:
+		"""
+		Remove the value index on a field of the values of the selected file.
+
+		Args:
+		- `field`: The field of the values that is indexed.
+		- `timeout`: Seconds to wait for the write lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock.
+
+		Raises:
+		- `LockTimeoutError`: If the lock could not be acquired in time.
+		"""
+		if not self.op_type.file_normal:
+			raise RuntimeError("DDB.at().delete_value_index() can only be used with a single file")
+		io_safe.delete_value_index(self.path, field, timeout, blocking)
+
+	def query(
+		self,
+		conditions: dict[str, bool | int | float | str] | None = None,
+		/,
+		*,
+		timeout: float | None = None,
+		blocking: bool = True,
+		**field_conditions: bool | int | float | str,
+	) -> dict | None:
+		"""
+		Read the items of the selected file whose values fulfill all conditions.
+		A condition is a field of the values, optionally with one of the suffixes
+		`__gt`, `__gte`, `__lt` or `__lte`, and a bool, number or string, e.g.
+		`DDB.at("users").query(age__gte=30, job="Manager")`.
+
+		If all fields have a value index, see `create_value_index`, only the
+		matching values are read. Otherwise, the whole file is read.
+
+		Args:
+		- `conditions`: The conditions as a dict, e.g. `{"age__gte": 30}`. Fields
+		named `timeout` or `blocking` can only be queried this way, since keyword
+		arguments with these names are the lock options.
+		- `timeout`: Seconds to wait for the read lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock.
+		- `field_conditions`: The conditions as keyword arguments, in addition to
+		`conditions`.
+
+		Raises:
+		- `ValueError`: If a condition is not a bool, number or string.
+		- `LockTimeoutError`: If the lock could not be acquired in time.
+
+		Returns:
+		- The matching items in sorted order of their keys, or None if the file
+		does not exist.
+		"""
+		if not self.op_type.file_normal:
+			raise RuntimeError("DDB.at().query() can only be used with a single file")
+		return io_safe.query(self.path, {**(conditions or {}), **field_conditions}, timeout, blocking)
+
+	def range(
+		self,
+		start: str | None = None,
+		end: str | None = None,
+		prefix: str | None = None,
+		timeout: float | None = None,
+		blocking: bool = True,
+	) -> dict | None:
+		"""
+		Read the items of the selected file whose keys are in a range, e.g.
+		`DDB.at("events").range(start="2024-01", end="2024-02")`, or start with
+		a prefix, e.g. `DDB.at("events").range(prefix="user:42:")`.
+
+		If the file was written with DictDataBase, its keys are sorted, so only
+		the items around the range are read, see `build_index`. Otherwise, the
+		whole file is read.
+
+		Args:
+		- `start`: The smallest key, if any.
+		- `end`: The key after the range, which is excluded, if any.
+		- `prefix`: The prefix of the keys, instead of `start` and `end`.
+		- `timeout`: Seconds to wait for the read lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock.
+
+		Raises:
+		- `TypeError`: If a prefix and a start or end are given.
+		- `LockTimeoutError`: If the lock could not be acquired in time.
+
+		Returns:
+		- The matching items in sorted order, or None if the file does not exist.
+		"""
+		if not self.op_type.file_normal:
+			raise RuntimeError("DDB.at().range() can only be used with a single file")
+		if prefix is not None:
+			if start is not None or end is not None:
+				raise TypeError("Cannot specify both prefix and start or end")
+			start, end = prefix, utils.prefix_end(prefix)
+		return io_safe.read_range(self.path, start, end, timeout, blocking)
+
+	def read(self, as_type: Type[T] = None, timeout: float | None = None, blocking: bool = True) -> dict | T | None:
 		"""
 		Reads a file or folder depending on previous `.at(...)` selection.
 
 		Args:
 		- `as_type`: If provided, return the value as the given type.
 		Eg. as_type=str will return str(value).
+		- `timeout`: Seconds to wait for each read lock. Defaults to
+		`locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for a lock.
+
+		Raises:
+		- `LockTimeoutError`: If a lock could not be acquired in time.
 		"""
 
 		def type_cast(value):
@@ -183,13 +326,13 @@ class DDBMethodChooser:
 		data = {}
 
 		if self.op_type.file_normal:
-			data = io_safe.read(self.path)
+			data = io_safe.read(self.path, timeout, blocking)
 
 		elif self.op_type.file_key:
-			data = io_safe.partial_read(self.path, self.key)
+			data = io_safe.partial_read(self.path, self.key, timeout, blocking)
 
 		elif self.op_type.file_where:
-			file_content = io_safe.read(self.path)
+			file_content = io_safe.read(self.path, timeout, blocking)
 			if file_content is None:
 				return None
 			for k, v in file_content.items():
@@ -198,18 +341,22 @@ class DDBMethodChooser:
 
 		elif self.op_type.dir_normal:
 			pattern_paths = utils.find_all(self.path)
-			data = {n.split("/")[-1]: io_safe.read(n) for n in pattern_paths}
+			data = {n.split("/")[-1]: io_safe.read(n, timeout, blocking) for n in pattern_paths}
 
 		elif self.op_type.dir_where:
 			for db_name in utils.find_all(self.path):
-				k, v = db_name.split("/")[-1], io_safe.read(db_name)
+				k, v = db_name.split("/")[-1], io_safe.read(db_name, timeout, blocking)
 				if self.where(k, type_cast(v)):
 					data[k] = v
 
 		return type_cast(data)
 
 	def session(
-		self, as_type: Type[T] = None
+		self,
+		as_type: Type[T] = None,
+		upgradeable: bool = False,
+		timeout: float | None = None,
+		blocking: bool = True,
 	) -> SessionFileFull[T] | SessionFileKey[T] | SessionFileWhere[T] | SessionDirFull[T] | SessionDirWhere[T]:
 		"""
 		Opens a session to the selected file(s) or folder, depending on previous
@@ -220,21 +367,29 @@ class DDBMethodChooser:
 		Args:
 		- `as_type`: If provided, cast the value to the given type.
 		Eg. as_type=str will return str(value).
+		- `upgradeable`: If `True`, other threads and processes can still read
+		the file(s) or folder until `session.write()` is called. Only then,
+		the session waits for exclusive access. No one else can write in the
+		meantime, so the data of the session stays up to date.
+		- `timeout`: Seconds to wait for the lock(s), and again for the upgrade.
+		Defaults to `locking.AQUIRE_LOCK_TIMEOUT`.
+		- `blocking`: If `False`, raise instead of waiting for the lock(s).
 
 		Raises:
 		- `FileNotFoundError`: If the file does not exist.
 		- `KeyError`: If a key is specified and it does not exist.
+		- `LockTimeoutError`: If the lock(s) could not be acquired in time.
 
 		Returns:
 		- Tuple of (session_object, data)
 		"""
 		if self.op_type.file_normal:
-			return SessionFileFull(self.path, as_type)
+			return SessionFileFull(self.path, as_type, upgradeable, timeout, blocking)
 		if self.op_type.file_key:
-			return SessionFileKey(self.path, self.key, as_type)
+			return SessionFileKey(self.path, self.key, as_type, upgradeable, timeout, blocking)
 		if self.op_type.file_where:
-			return SessionFileWhere(self.path, self.where, as_type)
+			return SessionFileWhere(self.path, self.where, as_type, upgradeable, timeout, blocking)
 		if self.op_type.dir_normal:
-			return SessionDirFull(self.path, as_type)
+			return SessionDirFull(self.path, as_type, upgradeable, timeout, blocking)
 		if self.op_type.dir_where:
-			return SessionDirWhere(self.path, self.where, as_type)
+			return SessionDirWhere(self.path, self.where, as_type, upgradeable, timeout, blocking)
@@ -17,11 +17,17 @@ class SessionBase:
 	in_session: bool
 	db_name: str
 	as_type: T
+	upgradeable: bool
+	timeout: float | None
+	blocking: bool
 
-	def __init__(self, db_name: str, as_type):
+	def __init__(self, db_name: str, as_type, upgradeable: bool = False, timeout: float | None = None, blocking: bool = True):
 		self.in_session = False
 		self.db_name = db_name
 		self.as_type = as_type
+		self.upgradeable = upgradeable
+		self.timeout = timeout
+		self.blocking = blocking
 
 	def __enter__(self):
 		self.in_session = True
@@ -29,17 +35,19 @@ class SessionBase:
 
 	def __exit__(self, type, value, tb):
 		write_lock = getattr(self, "write_lock", None)
-		if write_lock is not None:
-			if isinstance(write_lock, list):
-				for lock in write_lock:
-					lock._unlock()
-			else:
-				write_lock._unlock()
 		self.write_lock, self.in_session = None, False
+		if write_lock is not None:
+			locking.unlock_all(write_lock if isinstance(write_lock, list) else [write_lock])
 
 	def write(self):
 		if not self.in_session:
 			raise PermissionError("Only call write() inside a with statement.")
+		write_lock = self.write_lock if isinstance(self.write_lock, list) else [self.write_lock]
+		for lock in write_lock:
+			if self.upgradeable:
+				lock._upgrade()
+			# Do not write if the lock daemon released the lock meanwhile
+			lock._check_held()
 
 
 @contextmanager
@@ -51,12 +59,12 @@ def safe_context(super, self, *, db_names_to_lock=None):
 	super.__enter__()
 	try:
 		if isinstance(db_names_to_lock, str):
-			self.write_lock = locking.WriteLock(self.db_name)
+			lock_type = locking.UpgradeableLock if self.upgradeable else locking.WriteLock
+			self.write_lock = lock_type(self.db_name, self.timeout, self.blocking)
 			self.write_lock._lock()
 		elif isinstance(db_names_to_lock, list):
-			self.write_lock = [locking.WriteLock(x) for x in self.db_name]
-			for lock in self.write_lock:
-				lock._lock()
+			self.write_lock = locking.MultiWriteLock(self.db_name, self.upgradeable, self.timeout, self.blocking)
+			self.write_lock._lock()
 		yield
 	except BaseException as e:
 		super.__exit__(type(e), e, e.__traceback__)
@@ -96,8 +104,8 @@ class SessionFileKey(SessionBase, Generic[T]):
 	the key-value are written.
 	"""
 
-	def __init__(self, db_name: str, key: str, as_type: T):
-		super().__init__(db_name, as_type)
+	def __init__(self, db_name: str, key: str, as_type: T, upgradeable: bool = False, timeout: float | None = None, blocking: bool = True):
+		super().__init__(db_name, as_type, upgradeable, timeout, blocking)
 		self.key = key
 
 	def __enter__(self) -> Tuple[SessionFileKey, JSONSerializable | T]:
@@ -121,8 +129,8 @@ class SessionFileWhere(SessionBase, Generic[T]):
 	SessionFileFull.
 	"""
 
-	def __init__(self, db_name: str, where: Callable[[Any, Any], bool], as_type: T):
-		super().__init__(db_name, as_type)
+	def __init__(self, db_name: str, where: Callable[[Any, Any], bool], as_type: T, upgradeable: bool = False, timeout: float | None = None, blocking: bool = True):
+		super().__init__(db_name, as_type, upgradeable, timeout, blocking)
 		self.where = where
 
 	def __enter__(self) -> Tuple[SessionFileWhere, JSONSerializable | T]:
@@ -154,8 +162,8 @@ class SessionDirFull(SessionBase, Generic[T]):
 	Fully reads and writes all files.
 	"""
 
-	def __init__(self, db_name: str, as_type: T):
-		super().__init__(utils.find_all(db_name), as_type)
+	def __init__(self, db_name: str, as_type: T, upgradeable: bool = False, timeout: float | None = None, blocking: bool = True):
+		super().__init__(utils.find_all(db_name), as_type, upgradeable, timeout, blocking)
 
 	def __enter__(self) -> Tuple[SessionDirFull, JSONSerializable | T]:
 		with safe_context(super(), self, db_names_to_lock=self.db_name):
@@ -177,16 +185,15 @@ class SessionDirWhere(SessionBase, Generic[T]):
 	Fully reads all files, but only writes the selected files.
 	"""
 
-	def __init__(self, db_name: str, where: Callable[[Any, Any], bool], as_type: T):
-		super().__init__(utils.find_all(db_name), as_type)
+	def __init__(self, db_name: str, where: Callable[[Any, Any], bool], as_type: T, upgradeable: bool = False, timeout: float | None = None, blocking: bool = True):
+		super().__init__(utils.find_all(db_name), as_type, upgradeable, timeout, blocking)
 		self.where = where
 
 	def __enter__(self) -> Tuple[SessionDirWhere, JSONSerializable | T]:
-		with safe_context(super(), self):
+		with safe_context(super(), self, db_names_to_lock=self.db_name):
 			selected_db_names, write_lock = [], []
 			for db_name in self.db_name:
-				lock = locking.WriteLock(db_name)
-				lock._lock()
+				lock = self.write_lock.locks_by_db_name[db_name]
 				k, v = db_name.split("/")[-1], io_unsafe.read(db_name)
 				if self.where(k, v):
 					self.data_handle[k] = v
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import importlib.util
+from typing import List, Tuple
+
+import orjson
+
+from . import byte_codes
+
+# Design decisions:
+# - For big files, the structure of the JSON bytes is found with NumPy array
+#   operations over all bytes at once, instead of Python loops over them. Without
+#   NumPy, or for smaller bytes, the pure Python functions in utils are used.
+#   Keys are searched for in chunks of bounded size, so that a memory-mapped
+#   file is never copied at once.
+# - NumPy is an optional dependency, and only imported when it is first used,
+#   since importing it takes longer than importing everything else.
+# - Only the positions of brackets, braces and commas outside of strings and
+#   the nesting depth after each of them are kept, which is all that is needed
+#   to find the keys and values of the outermost object.
+
+# Minimum size of JSON bytes to find their structure with NumPy, below which
+# the pure Python functions are about as fast (bytes)
+STRUCTURAL_INDEX_MIN_SIZE = 1024 * 1024
+
+# A key is searched for with NumPy if it occurs at least once per this many
+# bytes, since each occurrence is handled separately in pure Python (bytes)
+KEY_SEARCH_MIN_FREQUENCY = 50
+
+WHITESPACE = b" \t\n\r"
+
+has_numpy = importlib.util.find_spec("numpy") is not None
+numpy = None  # The NumPy module, once it was imported
+
+
+def is_enabled(size: int) -> bool:
+	"""
+	Returns True if JSON bytes of the given size should be indexed with NumPy.
+	"""
+	return has_numpy and size >= STRUCTURAL_INDEX_MIN_SIZE
+
+
+class StructuralIndex:
+	"""
+	The brackets, braces and commas of JSON bytes that are not in a string, and
+	the nesting depth after each of them, found in one vectorized pass.
+	"""
+
+	__slots__ = ("json_bytes", "quotes", "positions", "depths")
+
+	json_bytes: bytes
+	quotes: numpy.ndarray  # Positions of the quotes that are not escaped
+	positions: numpy.ndarray  # Positions of the brackets, braces and commas outside of strings
+	depths: numpy.ndarray  # Nesting depth after each of them
+
+	def __init__(self, json_bytes: bytes) -> None:
+		global numpy
+		if numpy is None:
+			import numpy
+		self.json_bytes = json_bytes
+		array = numpy.frombuffer(json_bytes, dtype=numpy.uint8)
+
+		# A quote is escaped if an odd number of backslashes is right before it
+		is_quote = array == byte_codes.QUOTE
+		if b"\\" in json_bytes:
+			is_backslash = array == byte_codes.BACKSLASH
+			maybe_escaped = numpy.flatnonzero(is_quote[1:] & is_backslash[:-1]) + 1
+			backslashes = numpy.flatnonzero(is_backslash)
+			is_run_start = numpy.concatenate(([True], numpy.diff(backslashes) != 1))
+			run_starts = backslashes[is_run_start][numpy.cumsum(is_run_start) - 1]
+			run_lengths = maybe_escaped - run_starts[numpy.searchsorted(backslashes, maybe_escaped - 1)]
+			is_quote[maybe_escaped[run_lengths % 2 == 1]] = False
+		self.quotes = numpy.flatnonzero(is_quote)
+
+		# A byte is in a string if an odd number of quotes is up to it. The
+		# count overflows, but keeps its parity.
+		in_string = numpy.cumsum(is_quote, dtype=numpy.uint8) & 1
+		# Braces and brackets only differ by 0x20, so both are found at once
+		curly = (array | 0x20) - byte_codes.OPEN_CURLY
+		is_open, is_close = curly == 0, curly == byte_codes.CLOSE_CURLY - byte_codes.OPEN_CURLY
+		is_structure = (is_open | is_close | (array == byte_codes.COMMA)) & (in_string == 0)
+		self.positions = numpy.flatnonzero(is_structure)
+		deltas = is_open[self.positions].astype(numpy.int32) - is_close[self.positions]
+		self.depths = numpy.cumsum(deltas, dtype=numpy.int32)
+
+	def find_outermost_key(self, key: str, nesting: int = 0) -> Tuple[int, int]:
+		"""
+		Vectorized `utils.find_outermost_key_in_json_bytes`.
+		"""
+		key_bytes = f'"{key}":'.encode()
+		# Every occurrence starts with a quote that is not escaped
+		array = numpy.frombuffer(self.json_bytes, dtype=numpy.uint8)
+		occurrences = self.quotes[self.quotes <= len(array) - len(key_bytes)]
+		for i, byte in enumerate(key_bytes[1:], 1):
+			occurrences = occurrences[array[occurrences + i] == byte]
+		if len(occurrences) == 0:
+			return (-1, -1)
+		# Only curly braces count, like in the pure Python function, so that the
+		# bytes may start within an array
+		structure = array[self.positions]
+		deltas = (structure == byte_codes.OPEN_CURLY).astype(numpy.int32) - (structure == byte_codes.CLOSE_CURLY)
+		curly_depths = numpy.concatenate(([0], numpy.cumsum(deltas, dtype=numpy.int32)))
+		outermost = occurrences[curly_depths[numpy.searchsorted(self.positions, occurrences)] + nesting == 1]
+		if len(outermost) == 0:
+			return (-1, -1)
+		return (int(outermost[0]), int(outermost[0]) + len(key_bytes))
+
+	def count_nesting(self) -> int:
+		"""
+		Vectorized `utils.count_nesting_in_bytes` over all bytes.
+		"""
+		structure = numpy.frombuffer(self.json_bytes, dtype=numpy.uint8)[self.positions]
+		opening = numpy.count_nonzero(structure == byte_codes.OPEN_CURLY)
+		return int(opening - numpy.count_nonzero(structure == byte_codes.CLOSE_CURLY))
+
+	def top_level_values(self) -> List[Tuple[str, int, int, int]]:
+		"""
+		Vectorized `utils.find_top_level_values`.
+		"""
+		json_bytes, start = self.json_bytes, 0
+		while start < len(json_bytes) and json_bytes[start] in WHITESPACE:
+			start += 1
+		if start == len(json_bytes) or json_bytes[start] != byte_codes.OPEN_CURLY:
+			return []
+		# The outermost object ends at the first closing brace at depth 0
+		closing = numpy.flatnonzero(self.depths == 0)
+		if len(closing) == 0:
+			raise TypeError("Invalid JSON")
+		end_index = int(closing[0])
+		positions, depths = self.positions[: end_index + 1], self.depths[: end_index + 1]
+		array = numpy.frombuffer(json_bytes, dtype=numpy.uint8)
+
+		# Each value is between the opening brace or a comma at depth 1 and the
+		# next one or the closing brace. Its key is the first string after it.
+		is_separator = (depths == 1) & (array[positions] == byte_codes.COMMA)
+		is_separator[0] = is_separator[-1] = True
+		separators = positions[is_separator]
+		key_indices = numpy.searchsorted(self.quotes, separators[:-1])
+		if len(key_indices) == 0 or key_indices[0] >= len(self.quotes) or self.quotes[key_indices[0]] > separators[-1]:
+			return []
+		key_starts = self.quotes[key_indices]
+		key_ends = self.quotes[key_indices + 1] + 1
+
+		# The value starts after the colon and a space, and ends at the separator
+		value_starts = key_ends + 1
+		value_starts += array[value_starts] == byte_codes.SPACE
+		value_ends = separators[1:]
+
+		# All keys are copied at once, with their closing quotes as separators
+		key_lengths = key_ends - key_starts - 1
+		key_offsets = numpy.cumsum(key_lengths)
+		key_bytes = array[
+			numpy.arange(key_offsets[-1]) + numpy.repeat(key_starts + 1 - (key_offsets - key_lengths), key_lengths)
+		]
+		key_bytes[key_offsets - 1] = 0
+		keys = key_bytes.tobytes().decode().split("\x00")[:-1]
+		if any("\\" in key for key in keys):
+			keys = [orjson.loads(f'"{key}"') if "\\" in key else key for key in keys]
+
+		values = list(zip(keys, key_starts.tolist(), value_starts.tolist(), value_ends.tolist()))
+		# Other whitespace around the colon and the value is rare
+		is_whitespace = numpy.zeros(256, dtype=bool)
+		is_whitespace[list(WHITESPACE)] = True
+		irregular = numpy.flatnonzero(
+			(array[key_ends] != byte_codes.COLON)
+			| is_whitespace[array[value_starts]]
+			| is_whitespace[array[value_ends - 1]]
+		)
+		for i in irregular.tolist():
+			key, key_start, value_start, value_end = values[i]
+			value_start = json_bytes.index(b":", key_start + key_lengths[i]) + 1
+			while json_bytes[value_start] in WHITESPACE:
+				value_start += 1
+			while json_bytes[value_end - 1] in WHITESPACE:
+				value_end -= 1
+			values[i] = (key, key_start, value_start, value_end)
+		return values
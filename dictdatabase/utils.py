@@ -2,9 +2,13 @@ from __future__ import annotations
 
 import glob
 import os
-from typing import Tuple
+import re
+import sys
+from typing import List, Tuple
 
-from . import byte_codes, config
+import orjson
+
+from . import byte_codes, config, structural_index
 
 
 def file_info(db_name: str) -> Tuple[str, bool, str, bool]:
@@ -35,6 +39,24 @@ def file_exists(db_name: str) -> bool:
 	return os.path.exists(j) or os.path.exists(d)
 
 
+def file_stamp(db_name: str) -> Tuple[int, int, int] | None:
+	"""
+	Returns the inode, size and mtime of the database file, or None if it does
+	not exist.
+
+	Args:
+	- `db_name`: The name of the database
+	"""
+	base = f"{config.storage_directory}/{db_name}"
+	for path in (f"{base}.json", f"{base}.ddb"):
+		try:
+			st = os.stat(path)
+		except FileNotFoundError:
+			continue
+		return st.st_ino, st.st_size, st.st_mtime_ns
+	return None
+
+
 def find_all(file_name: str) -> list[str]:
 	"""
 	Returns a list of all the database names that match the given glob file_name.
@@ -51,79 +73,174 @@ def find_all(file_name: str) -> list[str]:
 	return files_all
 
 
+# A string, with any escaped characters in it
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# All bytes up to and including the next bracket or brace that is not in a string
+NEXT_BRACKET = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*[\[\]{}]', re.DOTALL)
+# The end of a number, bool or null
+PRIMITIVE_END = re.compile(rb"[,\]}\n]")
+
+
 def seek_index_through_value_bytes(json_bytes: bytes, index: int) -> int:
 	"""
 	Finds the index of the next comma or closing bracket/brace after the value
 	of a key-value pair in a bytes object containing valid JSON when decoded.
 
+	Instead of iterating over each byte, the value is skipped with regular
+	expressions, that match all bytes up to the next bracket or brace outside
+	of strings at once.
+
 	Args:
-	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `json_bytes`: A bytes object containing valid JSON when decoded, or a
+	memory-mapped file of it, see `io_bytes.mapped`
 	- `index`: The start index in json_bytes
 
 	Returns:
 	- The end index of the value.
 	"""
 
-	# TODO: Try to implement this using bytes.find() instead of a loop
-	# This make count_nesting a lot faster
-
 	# See https://www.json.org/json-en.html for the JSON syntax
 
-	list_depth, dict_depth, i, len_json_bytes = 0, 0, index, len(json_bytes)
+	while index < len(json_bytes) and json_bytes[index] in b" \t\r":
+		index += 1
+	if index == len(json_bytes):
+		raise TypeError("Invalid JSON")
+
+	if json_bytes[index] == byte_codes.QUOTE:
+		if (match := STRING.match(json_bytes, index)) is None:
+			raise TypeError("Invalid JSON")
+		return match.end()
+
+	if json_bytes[index] in (byte_codes.OPEN_CURLY, byte_codes.OPEN_SQUARE):
+		depth = 0
+		while (match := NEXT_BRACKET.match(json_bytes, index)) is not None:
+			index = match.end()
+			depth += 1 if json_bytes[index - 1] in (byte_codes.OPEN_CURLY, byte_codes.OPEN_SQUARE) else -1
+			if depth == 0:
+				return index
+		raise TypeError("Invalid JSON")
+
+	if (match := PRIMITIVE_END.search(json_bytes, index)) is None:
+		raise TypeError("Invalid JSON")
+	return match.start()
+
+
+def seek_index_through_string_bytes(json_bytes: bytes, index: int) -> int:
+	"""
+	Returns the index after the closing quote of the string whose opening quote
+	is at `index`.
+
+	Args:
+	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `index`: The index of the opening quote in json_bytes
+	"""
+	while True:
+		index = json_bytes.find(byte_codes.QUOTE, index + 1)
+		if index == -1:
+			raise TypeError("Invalid JSON")
+		j = index - 1
+		while json_bytes[j] == byte_codes.BACKSLASH:
+			j -= 1
+		# If the number of backslashes is even, the quote is not escaped
+		if (index - 1 - j) % 2 == 0:
+			return index + 1
+
+
+def find_top_level_values(json_bytes: bytes, indent_with: str | None = None) -> List[Tuple[str, int, int, int]]:
+	"""
+	Find all key-value pairs of the outermost object in a single pass.
+
+	If the bytes were serialized with the indentation `indent_with`, every key
+	of the outermost object starts a line with exactly one indentation, because
+	JSON strings cannot contain newlines. Then the keys are found by searching
+	for those lines, without walking through the values.
 
-	while i < len_json_bytes:
-		current = json_bytes[i]
-		# If backslash, skip the next character
-		if current == byte_codes.BACKSLASH:
+	Args:
+	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `indent_with`: The indentation the bytes were serialized with, if known.
+
+	Returns:
+	- A list of tuples of the key, the key start index (at its opening quote),
+	and the value start (inclusive) and end (exclusive) index. The list is empty
+	if the outermost value is not an object.
+	"""
+
+	def decode_key(key_bytes: bytes) -> str:
+		if byte_codes.BACKSLASH in key_bytes:
+			return orjson.loads(key_bytes)
+		return key_bytes[1:-1].decode()
+
+	def skip_whitespace(i: int) -> int:
+		while json_bytes[i] in b" \t\n\r":
 			i += 1
+		return i
+
+	start = skip_whitespace(0) if json_bytes else 0
+	if start == len(json_bytes) or json_bytes[start] != byte_codes.OPEN_CURLY:
+		return []
+
+	if indent_with:
+		line_start = f"\n{indent_with}".encode()
+		pattern = re.compile(re.escape(line_start) + rb'("(?:[^"\\\n]|\\.)*"):[ \t]*')
+		matches = list(pattern.finditer(json_bytes))
+		# The value ends before the comma, or before the newline of the closing brace
+		value_ends = [m.start() - 1 for m in matches[1:]] + [json_bytes.rfind(b"\n")]
+		return [(decode_key(m.group(1)), m.start(1), m.end(), end) for m, end in zip(matches, value_ends)]
+
+	if structural_index.is_enabled(len(json_bytes)):
+		return structural_index.StructuralIndex(json_bytes).top_level_values()
+
+	values = []
+	i = skip_whitespace(start + 1)
+	while json_bytes[i] == byte_codes.QUOTE:
+		key_end = seek_index_through_string_bytes(json_bytes, i)
+		value_start = skip_whitespace(skip_whitespace(key_end) + 1)
+		value_end = seek_index_through_value_bytes(json_bytes, value_start)
+		values.append((decode_key(json_bytes[i:key_end]), i, value_start, value_end))
+		i = skip_whitespace(value_end)
+		if json_bytes[i] == byte_codes.COMMA:
+			i = skip_whitespace(i + 1)
+	return values
+
+
+# All bytes except quotes, curly braces and null bytes, which cannot occur in
+# valid JSON and mark the occurrences of a key
+NOT_STRUCTURE = bytes(c for c in range(256) if c not in b'"{}\x00')
+
+# Number of bytes the search for the outermost key first scans at once, doubled
+# after each scan that did not find it, up to the maximum (bytes)
+KEY_SEARCH_CHUNK_SIZE = 64 * 1024
+KEY_SEARCH_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def curly_braces_outside_of_strings(json_bytes: bytes, key: bytes = b"", in_string: bool = False) -> Tuple[bytes, bool]:
+	"""
+	Returns the curly braces that are not in a string, in their order, and
+	whether the bytes end within a string. If a key is given, each occurrence
+	of it is returned as a null byte between them.
 
-		# Assert: the current character is not escaped with a backslash
-
-		elif current == byte_codes.QUOTE:
-			while True:
-				i = json_bytes.find(byte_codes.QUOTE, i + 1)
-				if i == -1:
-					raise TypeError("Invalid JSON")
-
-				j = i - 1
-				backslash_count = 0
-				while j >= 0 and json_bytes[j] == byte_codes.BACKSLASH:
-					backslash_count += 1
-					j -= 1
-				if backslash_count % 2 == 0:
-					# If the number of backslashes is even, the quote is not escaped
-					break
-				# Else, the quote is escaped, and the loop continues
-
-			# Exit point where string ends and nesting is zero
-			if list_depth == 0 and dict_depth == 0:
-				return i + 1
-
-		# Invariant: Not in_str, not escaped
-
-		# Handle opening brackets
-		elif current == byte_codes.OPEN_SQUARE:
-			list_depth += 1
-		elif current == byte_codes.OPEN_CURLY:
-			dict_depth += 1
-		# Handle closing brackets
-		elif current == byte_codes.CLOSE_SQUARE:
-			list_depth -= 1
-			if list_depth == 0 and dict_depth <= 0:
-				return i + 1 + dict_depth  # dict_depth is -1 in case: {"a": {}}
-		elif current == byte_codes.CLOSE_CURLY:
-			dict_depth -= 1
-			if dict_depth <= 0 and list_depth == 0:
-				return i + 1 + dict_depth  # dict_depth is -1 in case: {"a": {}}
-		elif list_depth == 0:
-			if dict_depth == -1:
-				return i
-			if dict_depth == 0 and current in [byte_codes.COMMA, byte_codes.NEWLINE]:
-				# Handle commas and newline as exit points
-				return i
-		i += 1
-
-	raise TypeError("Invalid JSON")
+	Args:
+	- `json_bytes`: A part of a bytes object containing valid JSON when decoded,
+	that does not start or end within an escape sequence.
+	- `key`: A key with its quotes and colon, which can only occur outside of strings.
+	- `in_string`: Whether `json_bytes` start within a string.
+	"""
+	if key:
+		json_bytes = json_bytes.replace(key, b"\x00")
+	if b"\\" in json_bytes:
+		# Remove escaped backslashes first, then all remaining quotes are unescaped
+		json_bytes = json_bytes.replace(b"\\\\", b"").replace(b'\\"', b"")
+	structure = json_bytes.translate(None, NOT_STRUCTURE)
+	if in_string:
+		structure = b'"' + structure
+	# Removing two adjacent quotes does not change whether a brace is in a
+	# string, and removes all strings without braces. The remaining braces
+	# between quotes are in strings.
+	structure = structure.replace(b'""', b"")
+	ends_in_string = structure.count(b'"') % 2 == 1
+	if b'"' in structure:
+		structure = b"".join(structure.split(b'"')[::2])
+	return structure, ends_in_string
 
 
 def count_nesting_in_bytes(json_bytes: bytes, start: int, end: int) -> int:
@@ -131,28 +248,46 @@ def count_nesting_in_bytes(json_bytes: bytes, start: int, end: int) -> int:
 	Returns the number of nesting levels.
 	Considered bytes are from `start` inclusive to `end` exclusive.
 
-	The nesting is counted by the number of opening and closing brackets/braces
-	that are not in a string or escaped with a backslash.
+	The nesting is counted by the number of opening and closing braces that are
+	not in a string. `start` and `end` must not be within a string. At most
+	`KEY_SEARCH_MAX_CHUNK_SIZE` bytes are copied at once.
 
 	Args:
-	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `json_bytes`: A bytes object containing valid JSON when decoded, or a
+	memory-mapped file of it, see `io_bytes.mapped`
 	"""
-	i, nesting = start, 0
-	# Find the number of opening curly braces
-	while (i := json_bytes.find(byte_codes.OPEN_CURLY, i, end)) != -1:
-		if i == 0 or json_bytes[i - 1] != byte_codes.BACKSLASH:
-			nesting += 1
-		i += 1
-	i = start
-	# Find the number of closing curly braces
-	while (i := json_bytes.find(byte_codes.CLOSE_CURLY, i, end)) != -1:
-		if i == 0 or json_bytes[i - 1] != byte_codes.BACKSLASH:
-			nesting -= 1
-		i += 1
+	nesting, in_string = 0, False
+	while start < end:
+		chunk_end = min(start + KEY_SEARCH_MAX_CHUNK_SIZE, end)
+		# Do not split an escape sequence between two chunks
+		while chunk_end < end and json_bytes[chunk_end - 1] == byte_codes.BACKSLASH:
+			chunk_end += 1
+		structure, in_string = curly_braces_outside_of_strings(json_bytes[start:chunk_end], in_string=in_string)
+		nesting += structure.count(b"{") - structure.count(b"}")
+		start = chunk_end
 	return nesting
 
 
-def find_outermost_key_in_json_bytes(json_bytes: bytes, key: str) -> Tuple[int, int]:
+def prefix_end(prefix: str) -> str | None:
+	"""
+	Returns the smallest string that is greater than all strings that start
+	with the prefix, or None if there is none.
+	"""
+	while prefix:
+		if (code := ord(prefix[-1]) + 1) <= sys.maxunicode:
+			# Surrogates cannot be encoded, and no key contains them
+			return prefix[:-1] + chr(0xE000 if 0xD800 <= code < 0xE000 else code)
+		prefix = prefix[:-1]
+	return None
+
+
+def find_outermost_key_in_json_bytes(
+	json_bytes: bytes,
+	key: str,
+	nesting: int = 0,
+	start: int = 0,
+	end: int | None = None,
+) -> Tuple[int, int]:
 	"""
 	Returns the index of the key that is at the outermost nesting level. If the
 	key is not found, return -1. If the key you are looking for is `some_key`,
@@ -161,9 +296,14 @@ def find_outermost_key_in_json_bytes(json_bytes: bytes, key: str) -> Tuple[int,
 	it is not found.
 
 	Args:
-	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `json_bytes`: A bytes object containing valid JSON when decoded, or a
+	memory-mapped file of it, see `io_bytes.mapped`
 	- `key`: The key of an key-value pair in `json_bytes` to search for,
 	represented as bytes.
+	- `nesting`: The nesting level at `start`, e.g. 1 if it is between two
+	values of the outermost object.
+	- `start`: The index to search from, which must not be within a string.
+	- `end`: The index to search up to, or None to search to the end.
 
 	Returns:
 	- A tuple of the key start (inclusive) and end (exclusive) index,
@@ -173,39 +313,73 @@ def find_outermost_key_in_json_bytes(json_bytes: bytes, key: str) -> Tuple[int,
 	# TODO: Very strict. the key must have a colon directly after it
 	# For example {"a": 1} will work, but {"a" : 1} will not work!
 
-	key = f'"{key}":'.encode()
-
-	if (curr_i := json_bytes.find(key, 0)) == -1:
-		return (-1, -1)
-
-	# Assert: Key was found and curr_i is the index of the first character of the key
-
-	# Keep track of all found keys and their nesting level
-	key_nest = [(curr_i, count_nesting_in_bytes(json_bytes, 0, curr_i))]
-
-	# As long as more keys are found, keep track of them and their nesting level
-	while (next_i := json_bytes.find(key, curr_i + len(key))) != -1:
-		nesting = count_nesting_in_bytes(json_bytes, curr_i + len(key), next_i)
-		key_nest.append((next_i, nesting))
-		curr_i = next_i
-
-	# Assert: all keys have been found, and their nesting relative to each other is
-	# stored in key_nest, whose length is at least 1.
+	# In valid JSON, `"key":` cannot occur in a string, so every occurrence is
+	# a key at some nesting level. The bytes are scanned once from `start`, in
+	# chunks that end after an occurrence, until one is at the outermost level.
+	key_bytes = f'"{key}":'.encode()
+	end = len(json_bytes) if end is None else end
+	i, level, chunk_size, is_frequent = start, nesting, KEY_SEARCH_CHUNK_SIZE, False
+	while (key_start := json_bytes.find(key_bytes, i, end)) != -1:
+		if key_start - i > KEY_SEARCH_MAX_CHUNK_SIZE:
+			# Do not copy all bytes up to a distant occurrence at once
+			level += count_nesting_in_bytes(json_bytes, i, key_start)
+			i = key_start
+		chunk_end = max(key_start, json_bytes.rfind(key_bytes, key_start, min(i + chunk_size, end))) + len(key_bytes)
+		chunk = json_bytes[i:chunk_end]
+		if is_frequent and structural_index.is_enabled(len(chunk)):
+			# Find the nesting of all occurrences in the chunk at once
+			index = structural_index.StructuralIndex(chunk)
+			found_start, found_end = index.find_outermost_key(key, level)
+			if found_start != -1:
+				return (i + found_start, i + found_end)
+			level += index.count_nesting()
+		else:
+			structure, _ = curly_braces_outside_of_strings(chunk, key_bytes)
+			*between_keys, _ = structure.split(b"\x00")
+			for between in between_keys:
+				level += between.count(b"{") - between.count(b"}")
+				if level == 1:
+					return (key_start, key_start + len(key_bytes))
+				key_start = json_bytes.find(key_bytes, key_start + len(key_bytes))
+			# Each occurrence is handled in Python, so if there are many, the NumPy
+			# structural index is faster, see `structural_index.KEY_SEARCH_MIN_FREQUENCY`
+			is_frequent = len(between_keys) * structural_index.KEY_SEARCH_MIN_FREQUENCY >= len(chunk)
+		i = chunk_end
+		chunk_size = KEY_SEARCH_MAX_CHUNK_SIZE if is_frequent else min(chunk_size * 2, KEY_SEARCH_MAX_CHUNK_SIZE)
+	return (-1, -1)
+
+
+def find_key_path_in_json_bytes(json_bytes: bytes, key_path: List[str]) -> Tuple[int, int]:
+	"""
+	Returns the index of the last key of a path of keys through nested objects,
+	like `find_outermost_key_in_json_bytes` does for a single key. Each key is
+	only searched for within the value of the previous one.
 
-	# Early exit if there is only one key
-	if len(key_nest) == 1:
-		index, level = key_nest[0]
-		return (index, index + len(key)) if level == 1 else (-1, -1)
+	Args:
+	- `json_bytes`: A bytes object containing valid JSON when decoded, or a
+	memory-mapped file of it, see `io_bytes.mapped`
+	- `key_path`: The keys from the outermost object to the searched key.
 
-	# Relative to total nesting
-	for i in range(1, len(key_nest)):
-		key_nest[i] = (key_nest[i][0], key_nest[i - 1][1] + key_nest[i][1])
+	Returns:
+	- A tuple of the key start (inclusive) and end (exclusive) index,
+	or `(-1, -1)` if the key is not found.
+	"""
 
-	# Filter out all keys that are not at the outermost nesting level
-	indices_at_index_one = [i for i, level in key_nest if level == 1]
-	if len(indices_at_index_one) != 1:
-		return (-1, -1)
-	return (indices_at_index_one[0], indices_at_index_one[0] + len(key))
+	span_start, span_end = 0, len(json_bytes)
+	for i, key in enumerate(key_path):
+		# The whole bytes are not copied, since they can be a mapped file
+		span = json_bytes if i == 0 else json_bytes[span_start:span_end]
+		key_start, key_end = find_outermost_key_in_json_bytes(span, key)
+		if key_end == -1:
+			return (-1, -1)
+		key_start, key_end = key_start + span_start, key_end + span_start
+		if i == len(key_path) - 1:
+			return (key_start, key_end)
+		span_start = key_end + (1 if json_bytes[key_end] == byte_codes.SPACE else 0)
+		if json_bytes[span_start] != byte_codes.OPEN_CURLY:
+			return (-1, -1)
+		span_end = seek_index_through_value_bytes(json_bytes, span_start)
+	return (-1, -1)
 
 
 def detect_indentation_in_json_bytes(json_bytes: bytes, index: int) -> Tuple[int, str]:
@@ -214,7 +388,8 @@ def detect_indentation_in_json_bytes(json_bytes: bytes, index: int) -> Tuple[int
 	level and whitespace used.
 
 	Args:
-	- `json_bytes`: A bytes object containing valid JSON when decoded
+	- `json_bytes`: A bytes object containing valid JSON when decoded, or a
+	memory-mapped file of it, see `io_bytes.mapped`
 	- `index`: The index behind which the indentation is to be determined
 
 	Returns:
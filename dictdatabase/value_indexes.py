@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import bisect
+import operator
+import os
+import threading
+from typing import Any, Dict, List, Tuple
+
+import orjson
+
+from . import config, indexing
+
+# Design decisions:
+# - A value index maps every key of the outermost object to the value of a
+#   field of its value, or None if that is not a bool, number or string. So it
+#   also knows which keys are in the outermost object.
+# - All value indexes of a database are stored in one file next to its .index
+#   file, together with the stamp of the database file they are valid for. If
+#   the database file was changed otherwise, they are rebuilt after the next
+#   query that can get a write lock without waiting, see `io_safe.query`.
+# - Partial writes append the changed field values to the file, so that they
+#   do not write the field values of all keys again. The appended changes are
+#   compacted into the file once replaying them would cost about as much as
+#   loading it, like the entries appended to the index file.
+
+# Appended changes are compacted into the file once there are more than this
+# minimum, and more than this fraction of the number of keys
+VALUE_INDEX_APPEND_MIN_COMPACTION = 16
+VALUE_INDEX_APPEND_MAX_FRACTION = 1 / 64
+
+# Query operators, used as suffix of the field, e.g. age__gte=30
+OPERATORS = {"eq": operator.eq, "gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+
+def value_index_path(db_name: str) -> str:
+	"""
+	Returns the path of the value index file of a database.
+	"""
+	db_name = db_name.replace("/", "___")
+	return os.path.join(config.storage_directory, ".ddb", f"{db_name}.value_index")
+
+
+def value_group(value: object) -> str | None:
+	"""
+	Returns the group of values that can be compared with the value, or None
+	if it cannot be indexed.
+	"""
+	if isinstance(value, bool):
+		return "bool"
+	if isinstance(value, (int, float)):
+		return "number"
+	if isinstance(value, str):
+		return "str"
+	return None
+
+
+def field_value(value: object, field: str) -> bool | int | float | str | None:
+	"""
+	Returns the indexable value of a field of a value, or None.
+	"""
+	if not isinstance(value, dict):
+		return None
+	field_val = value.get(field)
+	return field_val if value_group(field_val) is not None else None
+
+
+def parse_conditions(conditions: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+	"""
+	Parse query conditions like `age__gte=30` into tuples of the field, the
+	operator and the operand. Without operator suffix, the field must be equal.
+
+	Raises:
+	- `ValueError`: If an operand cannot be indexed.
+	"""
+	parsed = []
+	for condition, operand in conditions.items():
+		field, query_operator = condition, "eq"
+		if "__" in condition and condition.rsplit("__", 1)[1] in OPERATORS:
+			field, query_operator = condition.rsplit("__", 1)
+		if value_group(operand) is None:
+			raise ValueError(f"Cannot query {condition} with {operand!r}, only bools, numbers and strings")
+		parsed.append((field, query_operator, operand))
+	return parsed
+
+
+def matches(value: object, conditions: List[Tuple[str, str, Any]]) -> bool:
+	"""
+	Returns True if the value fulfills all parsed conditions.
+	"""
+	if not isinstance(value, dict):
+		return False
+	for field, query_operator, operand in conditions:
+		field_val = value.get(field)
+		if value_group(field_val) != value_group(operand) or not OPERATORS[query_operator](field_val, operand):
+			return False
+	return True
+
+
+class ValueIndex(indexing.CachedFile):
+	"""
+	The value indexes of the fields of the values of a database, that were
+	declared with `DDB.at(...).create_value_index(field)`.
+
+	The file stores one json value per line. The first line is an object with:
+	- data_stamp: The inode, size and mtime of the database file the value
+	indexes are valid for, or null.
+	- fields: For each field, an object of all keys of the outermost object of
+	the database and their indexable field values.
+
+	Each following line is a change appended by a partial write, as an array of
+	the key, an object of its changed field values, and the new data_stamp.
+	"""
+
+	__slots__ = ("data_stamp", "fields", "appended", "sorted_values")
+
+	data_stamp: tuple[int, int, int] | None  # Inode, size and mtime of the database file the indexes are valid for
+	fields: dict[str, dict[str, Any]]  # Field values by key, for each field
+	appended: int  # Number of changes appended to the file
+	sorted_values: dict[tuple[str, str], tuple[list, list[str]]]  # Sorted values and their keys, by field and group
+
+	def __init__(self, db_name: str) -> None:
+		self.path = value_index_path(db_name)
+		self.lock = threading.RLock()
+		self._load()
+
+	def _load(self) -> None:
+		self.data_stamp, self.fields, self.appended, self.sorted_values = None, {}, 0, {}
+		if (file_bytes := self._read()) is None:
+			return
+		snapshot, *changes = file_bytes.split(b"\n")
+		try:
+			content = orjson.loads(snapshot)
+		except orjson.JSONDecodeError:
+			# The file is corrupt, so it is rebuilt on the next query
+			return
+		data_stamp, self.fields = content["data_stamp"], content["fields"]
+		for change in changes:
+			try:
+				key, field_values, data_stamp = orjson.loads(change)
+			except ValueError:
+				# The last change is still being appended, or the line is empty
+				break
+			for field, value in field_values.items():
+				if field in self.fields:
+					self.fields[field][key] = value
+			self.appended += 1
+		self.data_stamp = tuple(data_stamp) if data_stamp else None
+
+	def _save(self) -> None:
+		self.sorted_values, self.appended = {}, 0
+		if not self.fields:
+			try:
+				os.remove(self.path)
+			except FileNotFoundError:
+				pass
+			self.stamp = None
+			return
+		self._replace(orjson.dumps({"data_stamp": self.data_stamp, "fields": self.fields}) + b"\n")
+
+	def _append(self, key: str | None, field_values: dict[str, Any]) -> None:
+		"""
+		Append a change of the field values of a key and the data stamp to the
+		file, or save the whole file if the changes should be compacted.
+		"""
+		self.sorted_values = {}
+		key_count = len(next(iter(self.fields.values())))
+		if self.stamp is None or self.appended >= max(
+			VALUE_INDEX_APPEND_MIN_COMPACTION, key_count * VALUE_INDEX_APPEND_MAX_FRACTION
+		):
+			self._save()
+			return
+		try:
+			f = open(self.path, "ab")
+		except FileNotFoundError:
+			self._save()
+			return
+		with f:
+			# Only append to the file that was loaded or written by this object
+			if appendable := indexing.file_stamp(os.fstat(f.fileno())) == self.stamp:
+				f.write(orjson.dumps([key, field_values, self.data_stamp]) + b"\n")
+				f.flush()
+				self.stamp = indexing.file_stamp(os.fstat(f.fileno()))
+		if not appendable:
+			self._save()
+			return
+		self.appended += 1
+
+	def is_valid(self, data_stamp: tuple[int, int, int] | None) -> bool:
+		return data_stamp is not None and self.data_stamp == data_stamp
+
+	def needs_rebuild(self, data_stamp: tuple[int, int, int] | None) -> bool:
+		"""
+		Returns True if value indexes are declared, but they are not valid for
+		the database file with the given stamp.
+		"""
+		return bool(self.fields) and data_stamp is not None and not self.is_valid(data_stamp)
+
+	def build(self, data: dict, data_stamp: tuple[int, int, int] | None, fields: list[str] | None = None) -> None:
+		"""
+		Rebuild the value indexes of the declared and the given fields.
+
+		Args:
+		- `data`: The whole content of the database.
+		- `data_stamp`: The stamp of the database file `data` was read from or written to.
+		"""
+		with self.lock:
+			# Another process may have declared or removed fields meanwhile
+			self.refresh()
+			for field in {*self.fields, *(fields or [])}:
+				self.fields[field] = {k: field_value(v, field) for k, v in data.items()}
+			self.data_stamp = data_stamp
+			self._save()
+
+	def remove(self, field: str) -> None:
+		with self.lock:
+			self.refresh()
+			if self.fields.pop(field, None) is not None:
+				self._save()
+
+	def update(self, key: str, value: object, data_stamp: tuple[int, int, int] | None) -> None:
+		"""
+		Update the field values of a key after its value was partially written.
+		The key can also be a path of keys joined with dots, see
+		`io_unsafe.find_key_in_json_bytes`.
+
+		Args:
+		- `data_stamp`: The stamp of the database file after the write, or None
+		if the indexes were not valid before the write.
+		"""
+		with self.lock:
+			if not self.fields:
+				return
+			keys, changed_key, changes = next(iter(self.fields.values())), None, {}
+			if key in keys:
+				changed_key, changes = key, {field: field_value(value, field) for field in self.fields}
+			elif "." in key and (key_path := key.split("."))[0] in keys:
+				# A nested value that contains the field value is not indexed anyway
+				if len(key_path) == 2 and key_path[1] in self.fields:
+					changed_key, changes = key_path[0], {key_path[1]: value if value_group(value) is not None else None}
+			for field, field_val in changes.items():
+				self.fields[field][changed_key] = field_val
+			self.data_stamp = data_stamp
+			self._append(changed_key, changes)
+
+	def query(self, conditions: List[Tuple[str, str, Any]]) -> list[str] | None:
+		"""
+		Returns the keys of the values that fulfill all parsed conditions, in
+		sorted order, or None if a field is not indexed.
+		"""
+		with self.lock:
+			if any(field not in self.fields for field, _, _ in conditions):
+				return None
+			selected = None
+			for field, query_operator, operand in conditions:
+				values, keys = self._sorted_values(field, value_group(operand))
+				lo, hi = 0, len(values)
+				if query_operator in ("eq", "gte"):
+					lo = bisect.bisect_left(values, operand)
+				elif query_operator == "gt":
+					lo = bisect.bisect_right(values, operand)
+				if query_operator in ("eq", "lte"):
+					hi = bisect.bisect_right(values, operand)
+				elif query_operator == "lt":
+					hi = bisect.bisect_left(values, operand)
+				found = set(keys[lo:hi])
+				selected = found if selected is None else selected & found
+			return sorted(selected)
+
+	def _sorted_values(self, field: str, group: str) -> tuple[list, list[str]]:
+		if (cached := self.sorted_values.get((field, group))) is None:
+			items = sorted((v, k) for k, v in self.fields[field].items() if value_group(v) == group)
+			cached = self.sorted_values[(field, group)] = [v for v, _ in items], [k for _, k in items]
+		return cached
+
+
+value_index_cache = indexing.IndexerCache(ValueIndex)
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=value_index_cache._reset_after_fork)
+
+
+def get_value_index(db_name: str) -> ValueIndex:
+	"""
+	Returns the cached ValueIndex of a database, or loads it.
+	"""
+	return value_index_cache.get(db_name)
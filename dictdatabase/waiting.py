@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import random
+import select
+import sys
+import time
+
+from . import config
+
+# Design decisions:
+# - A waiter is only created once a lock is contended, so uncontended lock
+#   acquisitions never pay for an inotify instance.
+# - inotify is used via ctypes, so that no extra dependency is required.
+
+# Exponential backoff bounds
+BACKOFF_MIN_TIMEOUT = 0.001 * 0.05  # (ms)
+BACKOFF_MAX_TIMEOUT = 0.001 * 10  # (ms)
+
+# Maximum duration to block on directory events before re-checking the locks,
+# so that orphaned locks and timeouts are still detected without events
+INOTIFY_MAX_TIMEOUT = 0.001 * 100  # (ms)
+
+# See: https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = getattr(os, "O_NONBLOCK", 0)
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+
+class PollWaiter:
+	"""
+	Sleep a fixed duration between two checks of the lock state.
+	"""
+
+	__slots__ = ("timeout",)
+
+	def __init__(self, timeout: float) -> None:
+		self.timeout = timeout
+
+	def wait(self) -> None:
+		time.sleep(self.timeout)
+
+	def close(self) -> None:
+		pass
+
+
+class BackoffWaiter:
+	"""
+	Sleep an exponentially growing duration between two checks of the lock
+	state, with jitter, so that many waiters do not check at the same time.
+	"""
+
+	__slots__ = ("timeout",)
+
+	def __init__(self) -> None:
+		self.timeout = BACKOFF_MIN_TIMEOUT
+
+	def wait(self) -> None:
+		time.sleep(self.timeout / 2 + random.uniform(0, self.timeout / 2))
+		self.timeout = min(self.timeout * 2, BACKOFF_MAX_TIMEOUT)
+
+	def close(self) -> None:
+		pass
+
+
+class InotifyWaiter:
+	"""
+	Block until an entry of the watched directory is created, deleted or
+	renamed, or at most `INOTIFY_MAX_TIMEOUT` seconds.
+
+	Raises:
+	- `OSError`: If the inotify instance or the watch cannot be created.
+	"""
+
+	__slots__ = ("fd",)
+
+	def __init__(self, directory: str) -> None:
+		if libc is None:
+			raise OSError("inotify is not available")
+		self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd == -1:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+		if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) == -1:
+			errno = ctypes.get_errno()
+			os.close(self.fd)
+			raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+	def wait(self) -> None:
+		readable, _, _ = select.select([self.fd], [], [], INOTIFY_MAX_TIMEOUT)
+		if not readable:
+			return
+		# Drain all pending events, only the wakeup matters
+		try:
+			while os.read(self.fd, 4096):
+				pass
+		except BlockingIOError:
+			pass
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+
+def load_libc() -> ctypes.CDLL | None:
+	if not sys.platform.startswith("linux"):
+		return None
+	try:
+		lib = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		lib.inotify_init1.argtypes = [ctypes.c_int]
+		lib.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+	except (OSError, AttributeError):
+		return None
+	return lib
+
+
+libc = load_libc()
+
+
+def make_waiter(directory: str | None, poll_timeout: float) -> PollWaiter | BackoffWaiter | InotifyWaiter:
+	"""
+	Create a waiter according to `config.lock_wait_strategy`:
+	- `"poll"`: Sleep `poll_timeout` seconds between checks.
+	- `"backoff"`: Exponential backoff with jitter.
+	- `"inotify"`: Block on changes in `directory`. Falls back to exponential
+	backoff if inotify is not available or no directory is given.
+
+	Args:
+	- `directory`: The directory in which the lock files are created.
+	- `poll_timeout`: The sleep duration of the `"poll"` strategy.
+	"""
+	if config.lock_wait_strategy == "inotify" and directory is not None:
+		try:
+			return InotifyWaiter(directory)
+		except OSError:
+			return BackoffWaiter()
+	if config.lock_wait_strategy in ("inotify", "backoff"):
+		return BackoffWaiter()
+	return PollWaiter(poll_timeout)
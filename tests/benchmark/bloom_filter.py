@@ -0,0 +1,31 @@
+import os
+import shutil
+import time
+
+import dictdatabase as DDB
+from dictdatabase import bloom_filters
+
+DDB.config.storage_directory = "./.benchmark_bloom_filter"
+
+
+def missing_key_lookups(count):
+	t1 = time.monotonic()
+	for i in range(count):
+		assert not DDB.at("users", key=f"missing{i}").exists()
+	return (time.monotonic() - t1) / count
+
+
+try:
+	for key_count in [10_000, 100_000]:
+		t1 = time.monotonic()
+		DDB.at("users").create({f"u{i}": {"name": f"User {i}"} for i in range(key_count)}, force_overwrite=True)
+		print(f"⏱️  {key_count} keys: full write {time.monotonic() - t1:.3f}s")
+		with_filter = missing_key_lookups(1000)
+		os.remove(bloom_filters.bloom_filter_path("users"))
+		without_filter = missing_key_lookups(20)
+		print(
+			f"⏱️  {key_count} keys: missing key lookup {with_filter * 1000:.3f}ms with Bloom filter,"
+			f" {without_filter * 1000:.3f}ms without"
+		)
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,32 @@
+import os
+import shutil
+import time
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = "./.benchmark_compressed_partial"
+DDB.config.use_compression = True
+
+
+try:
+	data = {f"user{i:06}": {"name": f"name {i}", "tags": ["a", "b"], "age": i % 90} for i in range(200_000)}
+	t1 = time.monotonic()
+	DDB.at("users").create(data)
+	size = os.path.getsize(f"{DDB.config.storage_directory}/users.ddb")
+	print(f"⏱️  create {len(data)} keys, {size / 1e6:.1f}MB compressed: {time.monotonic() - t1:.2f}s")
+	DDB.at("users").build_index()
+
+	for key in ["user000100", "user100000", "user199900"]:
+		t1 = time.monotonic()
+		for _ in range(10):
+			assert DDB.at("users", key=key).read() == data[key]
+		print(f"⏱️  partial read {key}: {(time.monotonic() - t1) / 10 * 1000:.1f}ms")
+
+		t1 = time.monotonic()
+		for i in range(10):
+			with DDB.at("users", key=key).session() as (session, value):
+				value["age"] = i
+				session.write()
+		print(f"⏱️  partial write {key}: {(time.monotonic() - t1) / 10 * 1000:.1f}ms")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
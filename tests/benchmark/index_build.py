@@ -0,0 +1,35 @@
+import os
+import random
+import shutil
+import time
+
+import dictdatabase as DDB
+from dictdatabase import indexing
+
+DDB.config.storage_directory = "./.benchmark_index_build"
+
+
+def cold_partial_reads(keys, build):
+	os.remove(indexing.index_path("users"))
+	indexing.indexer_cache.clear()
+	t1 = time.monotonic()
+	if build:
+		DDB.at("users").build_index()
+	for key in keys:
+		DDB.at("users", key=key).read()
+	return time.monotonic() - t1
+
+
+try:
+	for key_count in [1_000, 10_000]:
+		t1 = time.monotonic()
+		DDB.at("users").create(
+			{f"u{i}": {"name": f"User {i}", "age": i % 100} for i in range(key_count)}, force_overwrite=True
+		)
+		print(f"⏱️  {key_count} keys: full write with index {time.monotonic() - t1:.3f}s")
+		keys = random.sample([f"u{i}" for i in range(key_count)], k=1_000)
+		lazy = cold_partial_reads(keys, build=False)
+		built = cold_partial_reads(keys, build=True)
+		print(f"⏱️  {key_count} keys: read 1000 keys lazily indexed {lazy:.3f}s, after build_index {built:.3f}s")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,28 @@
+import shutil
+import time
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = "./.benchmark_index_validation"
+
+
+def partial_reads(value_size, iterations):
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		DDB.at("values", key="v").read()
+	return (time.monotonic() - t1) / iterations * 1_000_000
+
+
+try:
+	for value_size in [100, 10_000, 1_000_000]:
+		DDB.at("values").create({"v": "x" * value_size, "other": 1}, force_overwrite=True)
+		iterations = max(20, min(1_000, 100_000_000 // value_size))
+		for index_validation in ["sha256", "blake2b", "crc32", "trust"]:
+			DDB.config.index_validation = index_validation
+			# Index the value with the hash of the current mode
+			with DDB.at("values", key="v").session() as (session, value):
+				session.write()
+			t = partial_reads(value_size, iterations)
+			print(f"⏱️  {value_size}B value, {index_validation}: {t:.1f}µs/read")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
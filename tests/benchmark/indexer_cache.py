@@ -0,0 +1,31 @@
+import random
+import shutil
+import time
+
+import dictdatabase as DDB
+from dictdatabase import indexing
+
+DDB.config.storage_directory = "./.benchmark_indexer_cache"
+
+
+def partial_reads(keys, clear_cache):
+	t1 = time.monotonic()
+	for key in keys:
+		if clear_cache:
+			indexing.indexer_cache.clear()
+		DDB.at("users", key=key).read()
+	return (time.monotonic() - t1) / len(keys) * 1_000_000
+
+
+try:
+	for key_count in [100, 10_000, 100_000]:
+		DDB.at("users").create({f"u{i}": {"name": f"User {i}", "age": i % 100} for i in range(key_count)}, force_overwrite=True)
+		keys = random.choices([f"u{i}" for i in range(key_count)], k=1_000)
+		# Index all keys that are read
+		for key in set(keys):
+			DDB.at("users", key=key).read()
+		uncached = partial_reads(keys, clear_cache=True)
+		cached = partial_reads(keys, clear_cache=False)
+		print(f"⏱️  {key_count} keys: reload index {uncached:.1f}µs/read, cached index {cached:.1f}µs/read")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
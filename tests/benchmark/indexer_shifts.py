@@ -0,0 +1,80 @@
+import random
+import shutil
+import time
+
+import orjson
+
+import dictdatabase as DDB
+from dictdatabase import indexing
+
+DDB.config.storage_directory = "./.benchmark_indexer_shifts"
+
+
+def make_entries(key_count):
+	return {f"key{i:06}": [i * 100 + 10, i * 100 + 90, 1, "\t", "0" * 64] for i in range(key_count)}
+
+
+def previous_write(index_path, key, delta):
+	# The previous Indexer loaded the json index, shifted every entry and rewrote it
+	with open(index_path, "rb") as f:
+		data = orjson.loads(f.read())
+	old_value_end = data[key][1]
+	for entry in data.values():
+		if entry[0] > old_value_end:
+			entry[0] += delta
+			entry[1] += delta
+	data[key][1] = old_value_end + delta
+	with open(index_path, "wb") as f:
+		f.write(orjson.dumps(data))
+
+
+def write(indexer, key, delta):
+	start, end, indent_level, indent_with, value_hash = indexer.get(key)
+	indexer.write(key, start, end + delta, indent_level, indent_with, value_hash, end)
+
+
+def benchmark(key_count, iterations):
+	data = make_entries(key_count)
+	indexer = indexing.Indexer(f"users{key_count}")
+	indexer._rebuild({k: list(v) for k, v in data.items()})
+	indexer.compact()
+	index_path = f"{indexer.path}.json"
+	with open(index_path, "wb") as f:
+		f.write(orjson.dumps(data))
+	keys = random.choices(list(data), k=iterations)
+
+	t1 = time.monotonic()
+	for key in keys:
+		previous_write(index_path, key, 3)
+	previous = (time.monotonic() - t1) / iterations * 1_000_000
+
+	# Like partial reads and writes, each write loads the index file
+	t1 = time.monotonic()
+	for key in keys:
+		write(indexing.Indexer(f"users{key_count}"), key, 3)
+	mapped = (time.monotonic() - t1) / iterations * 1_000_000
+
+	# Both shifted the entries the same way
+	with open(index_path, "rb") as f:
+		expected = orjson.loads(f.read())
+	reloaded = indexing.Indexer(f"users{key_count}")
+	assert all(reloaded.get(k)[:2] == v[:2] for k, v in expected.items())
+
+	# A long-lived indexer that loaded the file into memory
+	reloaded._load_mapping()
+	t1 = time.monotonic()
+	for key in keys:
+		write(reloaded, key, 3)
+	in_memory = (time.monotonic() - t1) / iterations * 1_000_000
+
+	print(
+		f"⏱️  {key_count} keys: previous json {previous:.0f}µs/write, "
+		f"binary mapped {mapped:.1f}µs/write, binary in memory {in_memory:.1f}µs/write"
+	)
+
+
+try:
+	for key_count, iterations in [(100, 2_000), (1_000, 2_000), (10_000, 500), (100_000, 50)]:
+		benchmark(key_count, iterations)
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
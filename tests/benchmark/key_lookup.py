@@ -0,0 +1,48 @@
+import os
+import shutil
+import time
+
+import orjson
+
+import dictdatabase as DDB
+from dictdatabase import utils
+
+DDB.config.storage_directory = "./.benchmark_key_lookup"
+
+
+def make_data(records, nested_occurrences):
+	# The searched key occurs nested_occurrences times within each record, and
+	# once at the end of the outermost object
+	data = {}
+	for i in range(records):
+		value = {"key": i, "text": "braces {in} strings", "list": [1, {"key": "x"}]}
+		for _ in range(nested_occurrences - 2):
+			value = {"key": value}
+		data[f"record{i}"] = value
+	data["key"] = "found"
+	return data
+
+
+try:
+	for records, nested_occurrences in [(100_000, 2), (20_000, 10), (2_000, 100)]:
+		json_bytes = orjson.dumps(make_data(records, nested_occurrences))
+
+		t1 = time.monotonic()
+		for _ in range(10):
+			key_start, key_end = utils.find_outermost_key_in_json_bytes(json_bytes, "key")
+		assert json_bytes[key_start:key_end] == b'"key":'
+		ms = (time.monotonic() - t1) / 10 * 1000
+		mb = len(json_bytes) / 1e6
+		print(f"⏱️  {mb:.1f}MB, {records * nested_occurrences} nested occurrences: find outermost key {ms:.1f}ms")
+
+		# Written by others, so there is no index and the whole file is searched
+		DDB.at("key_lookup").delete()
+		os.makedirs(DDB.config.storage_directory, exist_ok=True)
+		with open(f"{DDB.config.storage_directory}/key_lookup.json", "wb") as f:
+			f.write(json_bytes)
+		t1 = time.monotonic()
+		assert DDB.at("key_lookup", key="key").read() == "found"
+		ms = (time.monotonic() - t1) * 1000
+		print(f"⏱️  {mb:.1f}MB, {records * nested_occurrences} nested occurrences: partial read {ms:.1f}ms")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,40 @@
+import random
+import shutil
+import time
+
+import dictdatabase as DDB
+from dictdatabase import indexing
+
+DDB.config.storage_directory = "./.benchmark_key_sample"
+
+
+def full_write_and_reads(key_count, keys, interval):
+	indexing.INDEX_SAMPLE_INTERVAL = interval
+	t1 = time.monotonic()
+	DDB.at("users").create(
+		{f"u{i}": {"name": f"User {i}", "age": i % 100} for i in range(key_count)}, force_overwrite=True
+	)
+	t2 = time.monotonic()
+	for key in keys:
+		DDB.at("users", key=key).read()
+	return t2 - t1, time.monotonic() - t2
+
+
+try:
+	for key_count in [10_000, 100_000]:
+		keys = random.sample([f"u{i}" for i in range(key_count)], k=1_000)
+		for interval in [1, 16, 64]:
+			write, reads = full_write_and_reads(key_count, keys, interval)
+			print(
+				f"⏱️  {key_count} keys, every {interval}. key indexed: full write {write:.3f}s, read 1000 keys {reads:.3f}s"
+			)
+		# Without a valid sample, the whole file is searched for each key
+		write, reads = full_write_and_reads(key_count, keys[:100], 16)
+		with open(f"{DDB.config.storage_directory}/users.json", "ab") as f:
+			f.write(b" ")
+		t1 = time.monotonic()
+		for key in keys[100:200]:
+			DDB.at("users", key=key).read()
+		print(f"⏱️  {key_count} keys, changed by others: read 100 keys {time.monotonic() - t1:.3f}s")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,57 @@
+import shutil
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import dictdatabase as DDB
+from dictdatabase import locking
+
+STORAGE_DIRECTORY = "./.benchmark_lock_handoff"
+
+
+def contend(strategy, backend, iterations, release_ns_file):
+	"""
+	Repeatedly acquire a write lock. The release time of the previous holder
+	is stored in a file, so the next holder can compute the handoff latency.
+	"""
+	DDB.config.storage_directory = STORAGE_DIRECTORY
+	DDB.config.lock_wait_strategy = strategy
+	DDB.config.lock_backend = backend
+	latencies = []
+	for _ in range(iterations):
+		with locking.WriteLock("db"):
+			acquired_ns = time.time_ns()
+			with open(release_ns_file, "r+") as f:
+				released_ns = int(f.read() or 0)
+				if released_ns:
+					latencies.append(acquired_ns - released_ns)
+				f.seek(0)
+				f.truncate()
+				f.write(str(time.time_ns()))
+	return latencies
+
+
+def percentile(values, p):
+	return sorted(values)[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def benchmark(strategy, backend, processes, iterations):
+	release_ns_file = f"{STORAGE_DIRECTORY}/release_ns"
+	Path(release_ns_file).write_text("")
+	with Pool(processes) as pool:
+		results = pool.starmap(contend, [(strategy, backend, iterations, release_ns_file)] * processes)
+	# Latencies within the same process are not handoffs, but they are a small minority
+	latencies = [l / 1_000 for r in results for l in r]
+	p50, p90, p99 = (percentile(latencies, p) for p in (50, 90, 99))
+	print(f"⏱️  {strategy=:8} {backend=:6} {processes=:2}: p50 {p50:7.0f}µs, p90 {p90:7.0f}µs, p99 {p99:7.0f}µs")
+
+
+if __name__ == "__main__":
+	Path(STORAGE_DIRECTORY).mkdir(exist_ok=True, parents=True)
+	try:
+		for processes in [2, 8, 16]:
+			for backend in ["file", "fcntl", "daemon"]:
+				for strategy in ["poll", "backoff", "inotify"]:
+					benchmark(strategy, backend, processes, 200)
+	finally:
+		shutil.rmtree(STORAGE_DIRECTORY)
@@ -0,0 +1,27 @@
+import shutil
+import time
+
+import dictdatabase as DDB
+from dictdatabase import locking
+
+DDB.config.storage_directory = "./.benchmark_lock_metrics"
+
+
+def lock_cycles(iterations):
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		with locking.WriteLock("db"):
+			pass
+	return iterations / (time.monotonic() - t1)
+
+
+try:
+	for lock_backend in ["file", "fcntl"]:
+		DDB.config.lock_backend = lock_backend
+		for lock_metrics in [False, True]:
+			DDB.config.lock_metrics = lock_metrics
+			cycles = lock_cycles(5_000)
+			print(f"⏱️  {lock_backend} backend, metrics {lock_metrics}: {cycles:.0f} lock cycles/s")
+	print(locking.get_lock_metrics("db"))
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
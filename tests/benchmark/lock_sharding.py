@@ -0,0 +1,41 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+import dictdatabase as DDB
+from dictdatabase import locking
+
+DDB.config.storage_directory = "./.benchmark_lock_sharding"
+
+
+def lock_cycles(iterations):
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		with locking.WriteLock("users_dir/0"):
+			pass
+	return iterations / (time.monotonic() - t1)
+
+
+def flat_layout_scan(iterations):
+	# Every snapshot of the previous flat layout listed all locks and indexes
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		os.listdir(f"{DDB.config.storage_directory}/.ddb")
+	return (time.monotonic() - t1) / iterations * 1_000_000
+
+
+try:
+	for db_count in [10, 1_000, 10_000]:
+		Path(f"{DDB.config.storage_directory}/.ddb").mkdir(exist_ok=True, parents=True)
+		# Each database has an index file and a lock directory
+		for i in range(db_count):
+			Path(f"{DDB.config.storage_directory}/.ddb/users_dir___{i}.index").touch()
+			with locking.ReadLock(f"users_dir/{i}"):
+				pass
+		cycles = lock_cycles(2_000)
+		scan = flat_layout_scan(200)
+		print(f"⏱️  {db_count} databases: {cycles:.0f} lock cycles/s, flat layout listdir: {scan:.0f}µs")
+		shutil.rmtree(DDB.config.storage_directory)
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,30 @@
+import shutil
+import time
+from pathlib import Path
+
+import dictdatabase as DDB
+from dictdatabase import locking
+
+DDB.config.storage_directory = "./.benchmark_locking_backends"
+path = Path(DDB.config.storage_directory)
+path.mkdir(exist_ok=True, parents=True)
+
+
+def lock_cycles(lock_class, iterations):
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		l = lock_class("db")
+		l._lock()
+		l._unlock()
+	t2 = time.monotonic()
+	return iterations / (t2 - t1)
+
+
+try:
+	for backend in ["file", "fcntl", "daemon"]:
+		DDB.config.lock_backend = backend
+		for lock_class in [locking.ReadLock, locking.WriteLock]:
+			cycles = lock_cycles(lock_class, 25_000)
+			print(f"⏱️  {cycles:.0f} lock cycles/s for {lock_class.__name__} with {backend = }")
+finally:
+	shutil.rmtree(DDB.config.storage_directory)
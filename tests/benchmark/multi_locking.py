@@ -0,0 +1,44 @@
+import os
+import shutil
+import time
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = ".ddb_bench_multi_locking"
+ITERATIONS = 20
+
+
+def print_timing(label: str, seconds: float) -> None:
+	print(f"{label}: {seconds / ITERATIONS * 1000:.3f} ms per session")
+
+
+def benchmark_dir_session(num_files: int) -> None:
+	for i in range(num_files):
+		DDB.at("folder", i).create({"counter": 0}, force_overwrite=True)
+
+	t1 = time.monotonic()
+	for _ in range(ITERATIONS):
+		with DDB.at("folder/*").session() as (session, files):
+			for v in files.values():
+				v["counter"] += 1
+			session.write()
+	print_timing(f"SessionDirFull ({num_files} files)", time.monotonic() - t1)
+
+	t1 = time.monotonic()
+	for _ in range(ITERATIONS):
+		with DDB.at("folder/*", where=lambda k, v: int(k) % 10 == 0).session() as (session, files):
+			for v in files.values():
+				v["counter"] += 1
+			session.write()
+	print_timing(f"SessionDirWhere ({num_files} files)", time.monotonic() - t1)
+
+
+if __name__ == "__main__":
+	for lock_backend in ("file", "fcntl"):
+		DDB.config.lock_backend = lock_backend
+		print(f"Lock backend: {lock_backend}")
+		for num_files in (10, 100, 1000):
+			shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
+			os.makedirs(DDB.config.storage_directory)
+			benchmark_dir_session(num_files)
+		shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
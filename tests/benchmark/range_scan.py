@@ -0,0 +1,34 @@
+import shutil
+import time
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = "./.benchmark_range_scan"
+
+
+try:
+	events = {
+		f"2024-{month:02}-{day:02}T{second:05}": {"user": f"user:{second % 100}", "value": second}
+		for month in range(1, 13)
+		for day in range(1, 29)
+		for second in range(0, 86400, 200)
+	}
+	DDB.at("events").create(events, force_overwrite=True)
+	print(f"⏱️  {len(events)} events")
+
+	t1 = time.monotonic()
+	for _ in range(10):
+		selected = DDB.at("events", where=lambda k, v: "2024-06-10" <= k < "2024-06-11").read()
+	print(f"⏱️  where: {(time.monotonic() - t1) / 10 * 1000:.1f}ms for {len(selected)} events")
+
+	t1 = time.monotonic()
+	for _ in range(10):
+		selected = DDB.at("events").range(start="2024-06-10", end="2024-06-11")
+	print(f"⏱️  range: {(time.monotonic() - t1) / 10 * 1000:.1f}ms for {len(selected)} events")
+
+	t1 = time.monotonic()
+	for _ in range(10):
+		selected = DDB.at("events").range(prefix="2024-06")
+	print(f"⏱️  prefix: {(time.monotonic() - t1) / 10 * 1000:.1f}ms for {len(selected)} events")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,45 @@
+import time
+
+import orjson
+
+from dictdatabase import utils
+
+
+def nested(depth):
+	value = {"leaf": [1, "x"]}
+	for i in range(depth):
+		value = {"child": value, "index": i} if i % 2 else [value, i]
+	return value
+
+
+values = {
+	"user with 300 posts": {
+		"name": "Ben",
+		"posts": [
+			{"id": i, "title": f"Post {i}", "tags": ["a", "b"], "likes": list(range(20)), "text": "lorem ipsum " * 10}
+			for i in range(300)
+		],
+	},
+	"string with many escapes": 'say "hi" \\ and \\"bye\\" ' * 10_000,
+	"deep nesting": nested(250),
+	"long array of numbers": list(range(100_000)),
+	"long array of strings": [f"item {i}" for i in range(50_000)],
+}
+
+
+for name, value in values.items():
+	for indent in [False, True]:
+		json_bytes = orjson.dumps({"value": value, "after": 1}, option=orjson.OPT_INDENT_2 if indent else 0)
+		start = json_bytes.index(b'"value":') + len(b'"value":') + indent
+
+		iterations = 20
+		t1 = time.monotonic()
+		for _ in range(iterations):
+			end = utils.seek_index_through_value_bytes(json_bytes, start)
+		seek_ms = (time.monotonic() - t1) / iterations * 1000
+
+		t1 = time.monotonic()
+		for _ in range(iterations):
+			assert orjson.loads(json_bytes[start:end]) == value
+		loads_ms = (time.monotonic() - t1) / iterations * 1000
+		print(f"⏱️  {name}{', indented' if indent else ''}: seek {seek_ms:.2f}ms, orjson.loads {loads_ms:.2f}ms")
@@ -0,0 +1,38 @@
+import os
+import shutil
+import time
+
+import orjson
+
+import dictdatabase as DDB
+from dictdatabase import structural_index, utils
+
+DDB.config.storage_directory = "./.benchmark_structural_index"
+
+
+numpy_installed = structural_index.has_numpy
+try:
+	data = {
+		f"user{i:07}": {"name": f"name {i}", "tags": ["a", "b{c}"], "profile": {"age": i % 90, "bio": 'say "hi"'}}
+		for i in range(500_000)
+	}
+	json_bytes = orjson.dumps(data)
+	os.makedirs(DDB.config.storage_directory, exist_ok=True)
+	with open(f"{DDB.config.storage_directory}/users.json", "wb") as f:
+		f.write(json_bytes)
+	print(f"⏱️  {len(json_bytes) / 1e6:.1f}MB, {len(data)} keys")
+
+	for name, has_numpy in [("numpy", numpy_installed), ("python", False)]:
+		structural_index.has_numpy = has_numpy
+
+		t1 = time.monotonic()
+		DDB.at("users").build_index()
+		print(f"⏱️  {name}: build index {time.monotonic() - t1:.2f}s")
+
+		t1 = time.monotonic()
+		key_start, _ = utils.find_outermost_key_in_json_bytes(json_bytes, "profile")
+		assert key_start == -1
+		print(f"⏱️  {name}: search key that is only nested {(time.monotonic() - t1) * 1000:.0f}ms")
+finally:
+	structural_index.has_numpy = numpy_installed
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
@@ -0,0 +1,37 @@
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import orjson
+
+import dictdatabase as DDB
+from dictdatabase import io_bytes
+
+DDB.config.storage_directory = "./.benchmark_threaded_reads"
+Path(DDB.config.storage_directory).mkdir(exist_ok=True, parents=True)
+
+
+def read_loop(read, iterations):
+	for _ in range(iterations):
+		read()
+
+
+def benchmark(label, read, threads, iterations):
+	t1 = time.monotonic()
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		for _ in range(threads):
+			pool.submit(read_loop, read, iterations)
+	t2 = time.monotonic()
+	print(f"⏱️  {threads * iterations / (t2 - t1):.0f} reads/s for {label} with {threads} threads")
+
+
+try:
+	DDB.at("hot").create({f"key{i}": {"value": i, "text": "x" * 100} for i in range(1000)})
+	for threads in [1, 4, 16]:
+		benchmark("orjson.loads", lambda: orjson.loads(io_bytes.read("hot")), threads, 500)
+		for backend in ["file", "fcntl"]:
+			DDB.config.lock_backend = backend
+			benchmark(f"DDB.at().read() with {backend = }", lambda: DDB.at("hot").read(), threads, 500)
+finally:
+	shutil.rmtree(DDB.config.storage_directory)
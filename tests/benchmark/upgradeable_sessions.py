@@ -0,0 +1,38 @@
+import random
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = "./.benchmark_upgradeable_sessions"
+
+
+def read_modify_write(iterations, upgradeable):
+	for _ in range(iterations):
+		with DDB.at("db").session(upgradeable=upgradeable) as (session, d):
+			time.sleep(0.0005)  # Decide if a write is needed
+			# Most calls do not write
+			if random.random() < 0.1:
+				d["counter"] += 1
+				session.write()
+
+
+def read(iterations):
+	for _ in range(iterations):
+		DDB.at("db", key="counter").read()
+
+
+try:
+	for upgradeable in [False, True]:
+		DDB.at("db").create({"counter": 0}, force_overwrite=True)
+		t1 = time.monotonic()
+		with ThreadPoolExecutor(max_workers=8) as pool:
+			futures = [pool.submit(read_modify_write, 200, upgradeable) for _ in range(2)]
+			futures += [pool.submit(read, 500) for _ in range(6)]
+			for f in futures:
+				f.result()
+		ops = 2 * 200 + 6 * 500
+		print(f"⏱️  upgradeable={upgradeable}: {ops / (time.monotonic() - t1):.0f} ops/s")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
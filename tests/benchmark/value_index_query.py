@@ -0,0 +1,44 @@
+import shutil
+import time
+
+import dictdatabase as DDB
+
+DDB.config.storage_directory = "./.benchmark_value_index_query"
+
+
+def measure(fn, iterations=20):
+	t1 = time.monotonic()
+	for _ in range(iterations):
+		result = fn()
+	return (time.monotonic() - t1) / iterations * 1000, result
+
+
+try:
+	for key_count in [1_000, 10_000, 100_000]:
+		DDB.at("users").create(
+			{f"u{i}": {"name": f"User {i}", "age": i % 100, "bio": "x" * 200} for i in range(key_count)},
+			force_overwrite=True,
+		)
+		DDB.at("users").delete_value_index("age")
+		DDB.at("users").delete_value_index("name")
+		for field, operand in [("age", 42), ("name", "User 7")]:
+			where, expected = measure(lambda: DDB.at("users", where=lambda k, v: v[field] == operand).read())
+			unindexed, result = measure(lambda: DDB.at("users").query(**{field: operand}))
+			assert result == expected
+			DDB.at("users").create_value_index(field)
+			indexed, result = measure(lambda: DDB.at("users").query(**{field: operand}))
+			assert result == expected
+			print(
+				f"⏱️  {key_count} keys, {len(expected)} matches: where {where:.1f}ms, "
+				f"query without value index {unindexed:.1f}ms, with value index {indexed:.1f}ms"
+			)
+
+		def partial_write():
+			with DDB.at("users", key=f"u{key_count - 1}").session() as (session, user):
+				user["age"] += 1
+				session.write()
+
+		partial, _ = measure(partial_write, iterations=200)
+		print(f"⏱️  {key_count} keys: partial write with 2 value indexes {partial:.2f}ms")
+finally:
+	shutil.rmtree(DDB.config.storage_directory, ignore_errors=True)
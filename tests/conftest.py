@@ -31,3 +31,24 @@ def use_orjson(request):
 def indent(request):
 	DDB.config.indent = request.param
 	return request.param
+
+
+@pytest.fixture(params=["file", "fcntl", "daemon"])
+def lock_backend(request):
+	DDB.config.lock_backend = request.param
+	yield request.param
+	DDB.config.lock_backend = "file"
+
+
+@pytest.fixture(params=["poll", "backoff", "inotify"])
+def lock_wait_strategy(request):
+	DDB.config.lock_wait_strategy = request.param
+	yield request.param
+	DDB.config.lock_wait_strategy = "poll"
+
+
+@pytest.fixture(params=["sha256", "blake2b", "crc32", "trust"])
+def index_validation(request):
+	DDB.config.index_validation = request.param
+	yield request.param
+	DDB.config.index_validation = "sha256"
@@ -0,0 +1,86 @@
+import os
+import zlib
+
+import dictdatabase as DDB
+from dictdatabase import block_compression, io_bytes, utils
+
+
+def test_read_spans(name_of_test, monkeypatch):
+	monkeypatch.setattr(block_compression, "BLOCK_SIZE", 7)
+	DDB.config.use_compression = True
+	data = bytes(range(100))
+	io_bytes.write(name_of_test, data)
+	spans = [(0, 100), (3, 5), (5, 30), (None, 7), (93, None), (50, 50), (90, 200), (-5, None), (20, 10)]
+	assert io_bytes.read_spans(name_of_test, spans) == [data[start:end] for start, end in spans]
+	assert io_bytes.read(name_of_test, start=12, end=40) == data[12:40]
+	with open(utils.file_info(name_of_test)[2], "rb") as f:
+		table = block_compression.read_table(f)
+	assert table.sizes == [7] * 14 + [2]
+
+
+def test_write_from_index(name_of_test, monkeypatch):
+	monkeypatch.setattr(block_compression, "BLOCK_SIZE", 7)
+	DDB.config.use_compression = True
+	ddb_path = utils.file_info(name_of_test)[2]
+	io_bytes.write(name_of_test, bytes(range(50)))
+	with open(ddb_path, "rb") as f:
+		file_bytes = f.read()
+		table = block_compression.read_table(f)
+
+	# The blocks before the one containing the start are not written again
+	io_bytes.write(name_of_test, b"abc", start=23)
+	assert io_bytes.read(name_of_test) == bytes(range(23)) + b"abc"
+	with open(ddb_path, "rb") as f:
+		assert f.read(table.compressed_offsets[3]) == file_bytes[: table.compressed_offsets[3]]
+		assert block_compression.read_table(f).sizes == [7, 7, 7, 5]
+
+	io_bytes.write(name_of_test, b"xyz" * 10, start=21)
+	assert io_bytes.read(name_of_test) == bytes(range(21)) + b"xyz" * 10
+	io_bytes.write(name_of_test, b"", start=0)
+	assert io_bytes.read(name_of_test) == b""
+
+
+def test_single_zlib_stream(name_of_test):
+	# Compressed files written by previous versions are read and converted
+	DDB.config.use_compression = True
+	os.makedirs(DDB.config.storage_directory, exist_ok=True)
+	ddb_path = utils.file_info(name_of_test)[2]
+	with open(ddb_path, "wb") as f:
+		f.write(zlib.compress(b'{"a": 1, "b": 2}'))
+	assert io_bytes.read(name_of_test, start=6, end=7) == b"1"
+	assert DDB.at(name_of_test, key="b").read() == 2
+	io_bytes.write(name_of_test, b'3, "b": 4}', start=6)
+	with open(ddb_path, "rb") as f:
+		assert block_compression.read_table(f) is not None
+	assert DDB.at(name_of_test).read() == {"a": 3, "b": 4}
+
+	# Writing after the end pads with null bytes, like the blocks and .json files
+	with open(ddb_path, "wb") as f:
+		f.write(zlib.compress(b"0123"))
+	io_bytes.write(name_of_test, b"ab", start=6)
+	assert io_bytes.read(name_of_test) == b"0123\x00\x00ab"
+
+
+def test_partial_read_and_write(name_of_test, monkeypatch, use_orjson, indent):
+	monkeypatch.setattr(block_compression, "BLOCK_SIZE", 256)
+	DDB.config.use_compression = True
+	data = {f"key{i:03}": {"i": i, "text": "lorem ipsum"} for i in range(200)}
+	DDB.at(name_of_test).create(data, force_overwrite=True)
+	DDB.at(name_of_test).build_index()
+
+	decompressed = []
+	decompress = zlib.decompress
+	monkeypatch.setattr(zlib, "decompress", lambda b: decompressed.append(b) or decompress(b))
+	assert DDB.at(name_of_test, key="key150").read() == data["key150"]
+	assert 0 < len(decompressed) <= 2
+
+	with DDB.at(name_of_test, key="key150").session() as (session, value):
+		value["text"] = "changed"
+		session.write()
+	with DDB.at(name_of_test, key="key199").session() as (session, value):
+		value["i"] = -1
+		session.write()
+	data["key150"]["text"] = "changed"
+	data["key199"]["i"] = -1
+	assert DDB.at(name_of_test).read() == data
+	assert DDB.at(name_of_test, key="key151").read() == data["key151"]
@@ -0,0 +1,65 @@
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import bloom_filters, indexing, io_bytes, utils
+
+
+def test_bloom_filter(use_compression, indent, monkeypatch):
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	data = {f"key{i}": {"nested": i} for i in range(100)}
+	DDB.at("test_bloom_filter").create(data, force_overwrite=True)
+
+	def read(db_name, *, start=None, end=None):
+		raise AssertionError("The database file must not be read")
+
+	with monkeypatch.context() as m:
+		m.setattr(io_bytes, "read", read)
+		assert DDB.at("test_bloom_filter", key="missing").read() is None
+		assert DDB.at("test_bloom_filter", key="missing.nested").read() is None
+		assert not DDB.at("test_bloom_filter", key="missing").exists()
+		with pytest.raises(KeyError):
+			with DDB.at("test_bloom_filter", key="missing").session():
+				pass
+
+	# Present keys and paths are still found
+	assert DDB.at("test_bloom_filter", key="key5").read() == {"nested": 5}
+	assert DDB.at("test_bloom_filter", key="key6.nested").read() == 6
+	assert DDB.at("test_bloom_filter", key="key7").exists()
+
+	# Partial writes keep the Bloom filter valid
+	with DDB.at("test_bloom_filter", key="key5").session() as (session, key5):
+		key5["nested"] = "changed"
+		session.write()
+	assert bloom_filters.get_bloom_filter("test_bloom_filter").is_valid(utils.file_stamp("test_bloom_filter"))
+
+	# Changes by others make it invalid
+	DDB.at("test_bloom_filter").delete()
+	with open(f"{DDB.config.storage_directory}/test_bloom_filter.json", "wb") as f:
+		f.write(b'{"missing": 1}')
+	assert DDB.at("test_bloom_filter", key="missing").read() == 1
+	assert DDB.at("test_bloom_filter", key="key5").read() is None
+
+
+def test_bloom_filter_small_files(monkeypatch):
+	DDB.at("test_bloom_filter_small").create({"a": 1}, force_overwrite=True)
+	assert not bloom_filters.get_bloom_filter("test_bloom_filter_small").bits
+
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	DDB.at("test_bloom_filter_small").create({"a": 1}, force_overwrite=True)
+	monkeypatch.undo()
+	# A full write that does not build the Bloom filter makes it invalid
+	DDB.at("test_bloom_filter_small").create({"b": 2}, force_overwrite=True)
+	assert DDB.at("test_bloom_filter_small", key="b").read() == 2
+
+	DDB.at("test_bloom_filter_small").build_index()
+	bloom_filter = bloom_filters.get_bloom_filter("test_bloom_filter_small")
+	assert bloom_filter.is_valid(utils.file_stamp("test_bloom_filter_small"))
+	assert bloom_filter.might_contain("b")
+	assert not bloom_filter.might_contain("a")
+
+
+def test_bloom_filter_false_positives():
+	bloom_filter = bloom_filters.get_bloom_filter("test_bloom_filter_false_positives")
+	bloom_filter.build([f"present{i}" for i in range(1000)], (1, 1, 1))
+	assert all(bloom_filter.might_contain(f"present{i}") for i in range(1000))
+	assert sum(bloom_filter.might_contain(f"missing{i}") for i in range(10000)) < 300
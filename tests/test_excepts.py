@@ -61,8 +61,7 @@ def test_utils_invalid_json_except():
 		utils.seek_index_through_value_bytes(b"{This is not { JSON", 0)
 
 
-def test_bytes_write_except():
-	# It is not allowed to specify a start index when compression is used.
-	with pytest.raises(RuntimeError):
-		DDB.config.use_compression = True
+def test_bytes_write_except(use_compression):
+	# Writing from a start index requires the bytes before it
+	with pytest.raises(FileNotFoundError):
 		io_bytes.write("any", b"any", start=1)
@@ -1,4 +1,12 @@
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
 import dictdatabase as DDB
+from dictdatabase import indexing, io_bytes, io_unsafe, locking
 
 
 def test_indexer(use_compression, use_orjson, indent):
@@ -14,3 +22,256 @@ def test_indexer(use_compression, use_orjson, indent):
 
 	# Check that the index entry for key "a" has been updated
 	assert DDB.at("test_indexer").read() == {"a": {"e": 5}, "b": 2}
+
+
+def test_indexer_shifts_entries_after_changed_value():
+	indexer = indexing.Indexer("test_indexer_shifts")
+	# Model of the index with eagerly shifted offsets
+	model = {}
+	offset = 0
+	for i in range(100):
+		key = f"k{i:03}"
+		model[key] = [offset + 2, offset + 12, 1, "\t", f"{i:08x}"]
+		indexer.write(key, *model[key], offset + 12)
+		offset += 20
+
+	for i in range(300):
+		key = f"k{random.randrange(100):03}"
+		start, end = model[key][:2]
+		new_end = max(start + 1, end + random.randint(-5, 5))
+		for entry in model.values():
+			if entry[0] > end:
+				entry[0] += new_end - end
+				entry[1] += new_end - end
+		model[key] = [start, new_end, 1, "\t", f"{i:064x}"]
+		indexer.write(key, start, new_end, 1, "\t", f"{i:064x}", end)
+		assert indexer.get(key) == model[key]
+
+	assert {k: indexer.get(k) for k in model} == model
+	assert indexer.get("missing") is None
+
+	# Freshly loaded indexers use the mapped file, and update it in place
+	indexer.compact()
+	for i in range(100):
+		key = f"k{random.randrange(100):03}"
+		start, end = model[key][:2]
+		new_end = max(start + 1, end + random.randint(-5, 5))
+		for entry in model.values():
+			if entry[0] > end:
+				entry[0] += new_end - end
+				entry[1] += new_end - end
+		model[key] = [start, new_end, 1, "\t", f"{i:08x}"]
+		mapped = indexing.Indexer("test_indexer_shifts")
+		assert mapped.mapping is not None
+		mapped.write(key, start, new_end, 1, "\t", f"{i:08x}", end)
+		assert mapped.mapping is not None
+	indexer = indexing.Indexer("test_indexer_shifts")
+	assert {k: indexer.get(k) for k in model} == model
+	assert indexer.get("k") is None and indexer.get("k9999") is None
+	# Appended entries were compacted, and replaying the rest yields the same entries
+	assert indexer.appended <= indexing.INDEX_APPEND_MIN_COMPACTION
+	reloaded = indexing.Indexer("test_indexer_shifts")
+	assert {k: reloaded.get(k) for k in model} == model
+	reloaded.compact()
+	assert reloaded.appended == 0
+	assert {k: indexing.Indexer("test_indexer_shifts").get(k) for k in model} == model
+
+
+def test_indexer_binary_file_updates():
+	indexer = indexing.Indexer("test_indexer_binary")
+	indexer.write("a", 5, 10, 1, "  ", "ab" * 32, 10)
+	indexer.write("b", 15, 20, 1, "  ", "cd" * 32, 20)
+	assert indexer.appended == 1
+	indexer.compact()
+	size = os.path.getsize(indexer.path)
+
+	# Existing entries are updated in place, which also shifts the others
+	indexer.write("a", 5, 12, 1, "  ", "ef" * 32, 10)
+	assert os.path.getsize(indexer.path) == size
+	assert indexing.Indexer("test_indexer_binary").get("b") == [17, 22, 1, "  ", "cd" * 32]
+	assert indexing.Indexer("test_indexer_binary").get("a") == [5, 12, 1, "  ", "ef" * 32]
+
+	# New entries are appended, and incomplete appended entries are ignored
+	indexer.write("c", 0, 2, 0, "", "01234567", 2)
+	assert os.path.getsize(indexer.path) > size
+	with open(indexer.path, "ab") as f:
+		f.write(b"\x01\x02")
+	reloaded = indexing.Indexer("test_indexer_binary")
+	assert reloaded.appended == 1
+	assert [reloaded.get(k) for k in "abc"] == [indexer.get(k) for k in "abc"]
+
+
+def test_indexer_migrates_json_index():
+	path = os.path.join(DDB.config.storage_directory, ".ddb", "test_indexer_json.index")
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "wb") as f:
+		f.write(b'{"a": [3, 8, 1, "\\t", "0123"], "b": [12, 15, 1, "\\t", "4567"]}')
+	indexer = indexing.Indexer("test_indexer_json")
+	assert indexer.get("b") == [12, 15, 1, "\t", "4567"]
+	with open(path, "rb") as f:
+		assert f.read(4) == indexing.INDEX_MAGIC
+	assert indexing.Indexer("test_indexer_json").get("a") == [3, 8, 1, "\t", "0123"]
+
+
+def test_indexer_entries_after_new_key_are_shifted(use_compression):
+	DDB.at("test_indexer_new_key").create({"a": 1, "b": [1], "c": 3}, force_overwrite=True)
+	assert DDB.at("test_indexer_new_key", key="c").read() == 3
+	# "b" is not indexed yet, but changing its length shifts the entry of "c"
+	with DDB.at("test_indexer_new_key", key="b").session() as (session, b):
+		b.extend(range(100))
+		session.write()
+	indexer = indexing.Indexer("test_indexer_new_key")
+	start, end = indexer.get("c")[:2]
+	assert io_bytes.read("test_indexer_new_key")[start:end] == b"3"
+
+
+def test_indexer_cache():
+	indexer = indexing.get_indexer("test_indexer_cache")
+	indexer.write("a", 5, 10, 1, "\t", "ab" * 32, 10)
+	indexer.write("b", 15, 20, 1, "\t", "cd" * 32, 20)
+	assert indexing.get_indexer("test_indexer_cache") is indexer
+
+	# Changes of the index file by others are loaded
+	other = indexing.Indexer("test_indexer_cache")
+	other.write("a", 5, 13, 1, "\t", "ef" * 32, 10)
+	other.write("c", 30, 33, 1, "\t", "01" * 32, 33)
+	cached = indexing.get_indexer("test_indexer_cache")
+	assert cached is indexer
+	assert cached.get("b") == [18, 23, 1, "\t", "cd" * 32]
+	assert cached.get("c") == [30, 33, 1, "\t", "01" * 32]
+
+	# Least recently used indexers are evicted
+	for i in range(indexing.INDEXER_CACHE_SIZE):
+		indexing.get_indexer(f"test_indexer_cache_{i}")
+	assert indexing.get_indexer("test_indexer_cache") is not indexer
+	assert len(indexing.indexer_cache.indexers) == indexing.INDEXER_CACHE_SIZE
+
+
+def test_index_validation(index_validation, use_compression):
+	DDB.at("test_index_validation").create(force_overwrite=True, data={"a": {"e": 4}, "b": [1, 2]})
+	assert DDB.at("test_index_validation", key="b").read() == [1, 2]
+	for i in range(5):
+		with DDB.at("test_index_validation", key="a").session() as (session, d):
+			d["e"] = "x" * i
+			session.write()
+		assert DDB.at("test_index_validation", key="a").read() == {"e": "x" * i}
+		assert DDB.at("test_index_validation", key="b").read() == [1, 2]
+	assert DDB.at("test_index_validation").read() == {"a": {"e": "xxxx"}, "b": [1, 2]}
+
+
+def test_index_validation_trust(monkeypatch):
+	DDB.config.index_validation = "trust"
+	try:
+		DDB.at("test_index_trust").create(force_overwrite=True, data={"a": 1, "b": 2})
+		assert DDB.at("test_index_trust", key="a").read() == 1
+		with DDB.at("test_index_trust", key="b").session() as (session, b):
+			session.write()
+
+		hashed = []
+		original_hash_value_bytes = io_unsafe.hash_value_bytes
+
+		def hash_value_bytes(value_bytes):
+			hashed.append(value_bytes)
+			return original_hash_value_bytes(value_bytes)
+
+		monkeypatch.setattr(io_unsafe, "hash_value_bytes", hash_value_bytes)
+		# The database file was only changed by partial writes, so hits are trusted
+		assert DDB.at("test_index_trust", key="a").read() == 1
+		assert DDB.at("test_index_trust", key="b").read() == 2
+		assert hashed == []
+
+		# A full write indexes all keys again, which are trusted
+		monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+		DDB.at("test_index_trust").create(force_overwrite=True, data={"a": 3, "b": 2})
+		hashed.clear()
+		assert DDB.at("test_index_trust", key="a").read() == 3
+		assert hashed == []
+
+		# Changes by others invalidate the trust, so the values are hashed again
+		with open(f"{DDB.config.storage_directory}/test_index_trust.json", "wb") as f:
+			f.write(b'{"a": 4, "b": 20}')
+		assert DDB.at("test_index_trust", key="a").read() == 4
+		assert DDB.at("test_index_trust", key="b").read() == 20
+		assert hashed != []
+	finally:
+		DDB.config.index_validation = "sha256"
+
+
+def test_build_index(use_compression, use_orjson, indent, monkeypatch):
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	monkeypatch.setattr(indexing, "INDEX_SAMPLE_INTERVAL", 2)
+	data = {"a": {"b": [1, {"c": 2}]}, "d": 'e\\"', "f": 1.5, "g": None, "h": {}}
+	DDB.at("test_build_index").create(data, force_overwrite=True)
+	indexer = indexing.get_indexer("test_build_index")
+	# The full write already indexed a sample of the keys, because it is big enough
+	assert [key for key in data if indexer.get(key) is not None] == ["a", "f", "h"]
+	for key in ["a", "f", "h"]:
+		start, end = indexer.get(key)[:2]
+		assert json.loads(io_bytes.read("test_build_index", start=start, end=end)) == data[key]
+	for key in data:
+		assert DDB.at("test_build_index", key=key).read() == data[key]
+
+	os.remove(indexing.index_path("test_build_index"))
+	indexing.indexer_cache.clear()
+	DDB.at("test_build_index").build_index()
+	assert len(indexing.get_indexer("test_build_index")) == len(data)
+	with DDB.at("test_build_index", key="f").session() as (session, f):
+		session.write()
+	assert DDB.at("test_build_index").read() == data
+
+
+def test_key_sample(use_compression, indent, monkeypatch):
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	monkeypatch.setattr(indexing, "INDEX_SAMPLE_INTERVAL", 4)
+	data = {f"k{i:02}": {"i": i, "k01": [i]} for i in range(20)}
+	DDB.at("test_key_sample").create(data, force_overwrite=True)
+
+	reads = []
+	original_read = io_bytes.read
+
+	def read(db_name, *, start=None, end=None):
+		reads.append((start, end))
+		return original_read(db_name, start=start, end=end)
+
+	monkeypatch.setattr(io_bytes, "read", read)
+	# Keys that are not indexed are only searched for between the indexed keys around them
+	assert DDB.at("test_key_sample", key="k01").read() == data["k01"]
+	assert DDB.at("test_key_sample", key="k19").read() == data["k19"]
+	with DDB.at("test_key_sample", key="k06").session() as (session, k06):
+		k06["i"] = "changed"
+		session.write()
+	assert DDB.at("test_key_sample", key="k07").read() == data["k07"]
+	if not use_compression:
+		assert (None, None) not in reads
+	assert DDB.at("test_key_sample", key="k06").read() == {"i": "changed", "k01": [6]}
+
+	# Missing keys and keys of a changed file are searched for in the whole file
+	assert DDB.at("test_key_sample", key="k99").read() is None
+	assert DDB.at("test_key_sample", key="k06.k01").read() == [6]
+	with DDB.at("test_key_sample", key="k05").session() as (session, k05):
+		k05["i"] = []
+		session.write()
+	assert DDB.at("test_key_sample", key="k06.k01").read() == [6]
+	assert DDB.at("test_key_sample", key="k07").read() == data["k07"]
+	data["k05"]["i"], data["k06"], data["k10"] = [], {"i": "changed", "k01": [6]}, "x" * 100
+	with open(f"{DDB.config.storage_directory}/test_key_sample.json", "w") as f:
+		f.write(json.dumps(data, sort_keys=True))
+	if use_compression:
+		os.remove(f"{DDB.config.storage_directory}/test_key_sample.ddb")
+	assert DDB.at("test_key_sample", key="k09").read() == data["k09"]
+	assert DDB.at("test_key_sample", key="k11").read() == data["k11"]
+	assert DDB.at("test_key_sample").read() == data
+
+
+def test_build_index_errors():
+	with pytest.raises(FileNotFoundError):
+		DDB.at("test_build_index_errors").build_index()
+	with pytest.raises(RuntimeError):
+		DDB.at("test_build_index_errors", key="a").build_index()
+
+	# Readers update the index in place, so it is only rebuilt exclusively
+	DDB.at("test_build_index_errors").create({"a": 1}, force_overwrite=True)
+	with locking.ReadLock("test_build_index_errors"):
+		with ThreadPoolExecutor(1) as pool:
+			with pytest.raises(locking.LockTimeoutError):
+				pool.submit(DDB.at("test_build_index_errors").build_index, blocking=False).result()
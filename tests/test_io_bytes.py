@@ -4,11 +4,6 @@ from dictdatabase import io_bytes
 
 
 def test_write_bytes(name_of_test, use_compression):
-	# No partial writing to compressed file allowed
-	if use_compression:
-		with pytest.raises(RuntimeError):
-			io_bytes.write(name_of_test, b"test", start=5)
-		return
 	# Write shorter content at index
 	io_bytes.write(name_of_test, b"0123456789")
 	io_bytes.write(name_of_test, b"abc", start=2)
@@ -45,3 +40,16 @@ def test_read_bytes(name_of_test, use_compression):
 	else:
 		with pytest.raises(OSError):
 			io_bytes.read(name_of_test, start=-5, end=3)
+
+
+def test_mapped(name_of_test, use_compression):
+	io_bytes.write(name_of_test, b"0123456789")
+	with io_bytes.mapped(name_of_test) as mapping:
+		assert mapping[2:5] == b"234"
+		assert mapping.find(b"5") == 5
+	io_bytes.write(name_of_test, b"")
+	with io_bytes.mapped(name_of_test) as mapping:
+		assert mapping == b""
+	with pytest.raises(FileNotFoundError):
+		with io_bytes.mapped("nonexistent"):
+			pass
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from multiprocessing import Process
+
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import lock_daemon, lock_daemon_client, locking
+
+
+@pytest.fixture
+def daemon():
+	prev = lock_daemon.DAEMON_IDLE_TIMEOUT
+	lock_daemon.DAEMON_IDLE_TIMEOUT = 0.2
+	t = threading.Thread(target=lock_daemon.serve, args=(DDB.config.storage_directory,))
+	t.start()
+	while not os.path.exists(lock_daemon.socket_path(DDB.config.storage_directory)):
+		time.sleep(0.001)
+	yield t
+	t.join(timeout=5.0)
+	lock_daemon.DAEMON_IDLE_TIMEOUT = prev
+
+
+def acquire(mode, lease=60.0, name="db"):
+	connection = lock_daemon_client.DaemonConnection(DDB.config.storage_directory)
+	connection.send(f"acquire {mode} {lease} {name}")
+	return connection
+
+
+def test_daemon_grants_in_fifo_order(daemon):
+	writer = acquire("write")
+	assert writer.receive(1.0) == "granted"
+	queued = [acquire(mode) for mode in ["read", "read", "write", "read"]]
+	assert [c.receive(0.05) for c in queued] == [None] * 4
+	# Receiving with a timeout keeps the sockets blocking for the heartbeat
+	assert all(c.sock.gettimeout() is None for c in [writer, *queued])
+
+	writer.close()
+	# Both readers are granted, but the last reader waits behind the writer
+	assert [c.receive(0.05) for c in queued] == ["granted", "granted", None, None]
+	queued[0].close()
+	queued[1].close()
+	assert queued[2].receive(1.0) == "granted"
+	queued[2].close()
+	assert queued[3].receive(1.0) == "granted"
+
+	# Other locks are independent
+	other = acquire("write", name="other")
+	assert other.receive(1.0) == "granted"
+	other.close()
+	queued[3].close()
+
+
+def test_daemon_upgrade(daemon):
+	upgrader = acquire("upgrade")
+	assert upgrader.receive(1.0) == "granted"
+	reader = acquire("read")
+	assert reader.receive(1.0) == "granted"
+	other = acquire("upgrade")
+	assert other.receive(0.05) is None
+
+	upgrader.send("upgrade")
+	assert upgrader.receive(0.05) is None
+	# Aborting keeps the upgradeable lock
+	upgrader.send("abort")
+	assert upgrader.receive(1.0) == "aborted"
+	upgrader.send("upgrade")
+	# New readers wait for the upgrade
+	new_reader = acquire("read")
+	assert new_reader.receive(0.05) is None
+	reader.close()
+	assert upgrader.receive(1.0) == "upgraded"
+
+	upgrader.close()
+	assert new_reader.receive(1.0) == "granted"
+	new_reader.close()
+	assert other.receive(1.0) == "granted"
+	other.close()
+
+
+def test_daemon_expires_leases(daemon):
+	holder = acquire("write", lease=0.1)
+	assert holder.receive(1.0) == "granted"
+	waiter = acquire("write")
+	assert waiter.receive(0.05) is None
+	assert waiter.receive(1.0) == "granted"
+	with pytest.raises(ConnectionError):
+		holder.receive(1.0)
+	waiter.close()
+
+
+def test_daemon_rejects_invalid_requests(daemon):
+	holder = acquire("write")
+	assert holder.receive(1.0) == "granted"
+	client = lock_daemon_client.DaemonConnection(DDB.config.storage_directory)
+	for request in ["garbage", "acquire write", "acquire write -1 db", "upgrade", "abort", "try read nan db"]:
+		client.send(request)
+		assert client.receive(1.0).startswith("error ")
+	# Requests that do not fit the held lock are rejected as well
+	for request in ["upgrade", "acquire read 60.0 db"]:
+		holder.send(request)
+		assert holder.receive(1.0).startswith("error ")
+
+	# The daemon still runs, and the held lock still excludes others
+	waiter = acquire("write")
+	assert waiter.receive(0.1) is None
+	assert daemon.is_alive()
+	holder.close()
+	assert waiter.receive(1.0) == "granted"
+	waiter.close()
+
+	# Clients that send too long requests are disconnected
+	client.sock.sendall(b"x" * (lock_daemon.MAX_REQUEST_LENGTH + 1))
+	with pytest.raises(ConnectionError):
+		client.receive(1.0)
+	client.close()
+
+
+def test_lost_daemon_locks_raise(daemon, monkeypatch):
+	monkeypatch.setattr(locking, "REMOVE_ORPHAN_LOCK_TIMEOUT", 0.1)
+	DDB.config.lock_backend = "daemon"
+	try:
+		DDB.at("db").create({"a": 1})
+		# The daemon releases the lock when its lease expires
+		with pytest.raises(locking.LockLostError):
+			with DDB.at("db").session() as (session, db):
+				time.sleep(0.3)
+				db["a"] = 2
+				session.write()
+		assert DDB.at("db").read() == {"a": 1}
+
+		lock = locking.WriteLock("db")
+		lock._lock()
+		time.sleep(0.3)
+		with pytest.raises(locking.LockLostError):
+			lock._unlock()
+		with locking.WriteLock("db"):
+			pass
+
+		# Full writes and deletes check the lock before changing the file
+		acquire = lock_daemon_client.acquire
+
+		def acquire_and_expire(lock):
+			acquire(lock)
+			time.sleep(0.3)
+
+		monkeypatch.setattr(lock_daemon_client, "acquire", acquire_and_expire)
+		with pytest.raises(locking.LockLostError):
+			DDB.at("db").create({"a": 3}, force_overwrite=True)
+		with pytest.raises(locking.LockLostError):
+			DDB.at("db").delete()
+		monkeypatch.setattr(lock_daemon_client, "acquire", acquire)
+		assert DDB.at("db").read() == {"a": 1}
+	finally:
+		DDB.config.lock_backend = "file"
+
+
+def test_daemon_exits_when_idle(daemon):
+	with locking.WriteLock("db"):
+		pass
+	daemon.join(timeout=5.0)
+	assert not daemon.is_alive()
+	assert not os.path.exists(lock_daemon.socket_path(DDB.config.storage_directory))
+
+
+def hold_lock_and_crash(storage_directory):
+	DDB.config.storage_directory = storage_directory
+	DDB.config.lock_backend = "daemon"
+	locking.WriteLock("db")._lock()
+	os._exit(1)
+
+
+def test_daemon_releases_locks_of_dead_processes():
+	p = Process(target=hold_lock_and_crash, args=(DDB.config.storage_directory,))
+	p.start()
+	p.join()
+	DDB.config.lock_backend = "daemon"
+	try:
+		t1 = time.monotonic()
+		with locking.WriteLock("db"):
+			pass
+		assert time.monotonic() - t1 < 1.0
+	finally:
+		DDB.config.lock_backend = "file"
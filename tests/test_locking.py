@@ -1,9 +1,13 @@
+import os
+import random
 import threading
 import time
+from multiprocessing import Pool
 
 import pytest
 
-from dictdatabase import locking
+import dictdatabase as DDB
+from dictdatabase import lock_table, locking
 
 
 def test_lock_release():
@@ -37,7 +41,7 @@ def test_double_lock_exception(use_compression):
 	name = "test_double_lock_exception"
 	with pytest.raises(RuntimeError):
 		with locking.ReadLock(name):
-			with locking.ReadLock(name):
+			with locking.WriteLock(name):
 				pass
 
 	ls = locking.FileLocksSnapshot(locking.ReadLock(name).need_lock)
@@ -114,3 +118,457 @@ def test_lock_keep_alive():
 		time.sleep(1.0)
 
 	locking.AQUIRE_LOCK_TIMEOUT, locking.LOCK_KEEP_ALIVE_TIMEOUT, locking.REMOVE_ORPHAN_LOCK_TIMEOUT = prev
+
+
+def test_kernel_lock_semantics(lock_backend):
+	name = "test_kernel_lock_semantics"
+	events = []
+
+	def read_in_thread():
+		with locking.ReadLock(name):
+			events.append("read")
+
+	def write_in_thread():
+		with locking.WriteLock(name):
+			events.append("write")
+
+	# Readers share the lock
+	with locking.ReadLock(name):
+		t = threading.Thread(target=read_in_thread)
+		t.start()
+		t.join(timeout=5.0)
+		assert events == ["read"]
+
+	# Writers exclude readers
+	with locking.WriteLock(name):
+		t = threading.Thread(target=read_in_thread)
+		t.start()
+		time.sleep(0.1)
+		assert events == ["read"]
+	t.join(timeout=5.0)
+	assert events == ["read", "read"]
+
+	# Readers exclude writers
+	with locking.ReadLock(name):
+		t = threading.Thread(target=write_in_thread)
+		t.start()
+		time.sleep(0.1)
+		assert events == ["read", "read"]
+	t.join(timeout=5.0)
+	assert events == ["read", "read", "write"]
+
+
+def test_kernel_double_lock_exception(lock_backend):
+	name = "test_kernel_double_lock_exception"
+	with pytest.raises(RuntimeError):
+		with locking.WriteLock(name):
+			with locking.WriteLock(name):
+				pass
+	# The lock was released after the exception
+	with locking.WriteLock(name):
+		pass
+
+
+def test_lock_heartbeat_refreshes_has_lock():
+	prev = locking.LOCK_KEEP_ALIVE_TIMEOUT, locking.ALIVE_LOCK_REFRESH_INTERVAL_NS
+	locking.LOCK_KEEP_ALIVE_TIMEOUT = 0.01
+	locking.ALIVE_LOCK_REFRESH_INTERVAL_NS = 50_000_000
+
+	lock = locking.ReadLock("test_lock_heartbeat_refreshes_has_lock")
+	with lock:
+		first_time_ns = lock.has_lock.time_ns
+		time.sleep(0.3)
+		assert lock.has_lock.time_ns != first_time_ns
+		ls = locking.FileLocksSnapshot(lock.need_lock)
+		assert [l.stage for l in ls.locks] == ["has"]
+	assert lock not in locking.lock_registry.locks
+
+	locking.LOCK_KEEP_ALIVE_TIMEOUT, locking.ALIVE_LOCK_REFRESH_INTERVAL_NS = prev
+
+
+def test_locking_does_not_start_threads():
+	with locking.ReadLock("test_locking_does_not_start_threads"):
+		pass
+	thread_count = threading.active_count()
+	for _ in range(10):
+		with locking.ReadLock("test_locking_does_not_start_threads"):
+			assert threading.active_count() == thread_count
+		with locking.WriteLock("test_locking_does_not_start_threads"):
+			assert threading.active_count() == thread_count
+
+
+def test_threads_share_cross_process_read_lock(lock_backend):
+	name = "test_threads_share_cross_process_read_lock"
+	entered, leave = threading.Event(), threading.Event()
+
+	def read_in_thread():
+		with locking.ReadLock(name):
+			entered.set()
+			leave.wait(timeout=5.0)
+
+	lock = locking.ReadLock(name)
+	lock._lock()
+	t = threading.Thread(target=read_in_thread)
+	t.start()
+	assert entered.wait(timeout=5.0)
+
+	# The second reader joined the cross-process lock of the first one
+	entry = lock_table.process_locks.entries[(lock.need_lock.ddb_dir, lock.db_name)]
+	assert entry.holder is lock
+	assert len(entry.readers) == 2
+	if lock_backend == "file":
+		assert len(locking.FileLocksSnapshot(lock.need_lock).locks) == 1
+
+	# The cross-process lock is kept until the last reader leaves
+	lock._unlock()
+	assert entry.holder is lock
+	leave.set()
+	t.join(timeout=5.0)
+	assert entry.holder is None
+	assert lock_table.process_locks.entries == {}
+	if lock_backend == "file":
+		assert locking.FileLocksSnapshot(lock.need_lock).locks == []
+
+
+def test_shared_read_lock_drains_for_other_processes():
+	prev = lock_table.SHARED_LOCK_RECHECK_TIMEOUT
+	lock_table.SHARED_LOCK_RECHECK_TIMEOUT = 0.0
+	name = "test_shared_read_lock_drains_for_other_processes"
+	acquired = threading.Event()
+
+	def read_in_thread():
+		with locking.ReadLock(name):
+			acquired.set()
+
+	lock = locking.ReadLock(name)
+	lock._lock()
+
+	# Simulate a write lock that another process waits for
+	other = locking.LockFileMeta(lock.need_lock.ddb_dir, lock.db_name, "1", f"{time.time_ns()}", "need", "write")
+	locking.os_touch(other.path)
+
+	t = threading.Thread(target=read_in_thread)
+	t.start()
+	time.sleep(0.1)
+	assert not acquired.is_set()
+
+	lock._unlock()
+	time.sleep(0.1)
+	# The new reader queued up behind the other process
+	assert not acquired.is_set()
+	os.unlink(other.path)
+	assert acquired.wait(timeout=5.0)
+	t.join(timeout=5.0)
+
+	lock_table.SHARED_LOCK_RECHECK_TIMEOUT = prev
+
+
+def test_lock_files_are_sharded_per_database():
+	lock = locking.WriteLock("test/sharded.db")
+	with lock:
+		lock_dir = os.path.join(DDB.config.storage_directory, ".ddb", "locks", "test___sharded____db")
+		assert lock.has_lock.ddb_dir == lock_dir
+		assert os.listdir(lock_dir) == [os.path.basename(lock.has_lock.path)]
+		# Other databases have their own lock directory
+		with locking.WriteLock("test/other"):
+			assert len(os.listdir(lock_dir)) == 1
+
+
+def test_wait_for_legacy_locks():
+	name = "test_wait_for_legacy_locks"
+	legacy_dir = os.path.join(DDB.config.storage_directory, ".ddb")
+	os.makedirs(legacy_dir, exist_ok=True)
+	# A lock that a process of a previous version holds in the flat layout
+	legacy = locking.LockFileMeta(legacy_dir, name, "1", f"{time.time_ns()}", "has", "write")
+	locking.os_touch(legacy.path)
+	threading.Timer(0.2, lambda: os.unlink(legacy.path)).start()
+
+	t1 = time.monotonic()
+	with locking.ReadLock(name):
+		assert time.monotonic() - t1 >= 0.2
+	assert (DDB.config.storage_directory, name) in locking.legacy_locks_checked
+
+
+def test_multi_write_lock(lock_backend):
+	names = ["test_multi/b", "test_multi/a", "test_multi/c", "test_multi/a"]
+	lock = locking.MultiWriteLock(names)
+	assert [l.db_name for l in lock.locks] == ["test_multi___a", "test_multi___b", "test_multi___c"]
+	with lock:
+		for l in lock.locks:
+			assert l.owner == threading.get_ident()
+		with pytest.raises(RuntimeError):
+			with locking.WriteLock("test_multi/b"):
+				pass
+	assert lock_table.process_locks.entries == {}
+
+
+def test_multi_write_lock_is_granted_together():
+	lock = locking.MultiWriteLock(["test_together/a", "test_together/b"])
+	a, b = lock.locks
+	# Simulate a lock that another process holds on b
+	other = locking.LockFileMeta(b.need_lock.ddb_dir, b.db_name, "1", f"{time.time_ns()}", "has", "write")
+	os.makedirs(other.ddb_dir, exist_ok=True)
+	locking.os_touch(other.path)
+
+	t = threading.Thread(target=lock._lock)
+	t.start()
+	time.sleep(0.1)
+	# a is not held while waiting for b
+	assert [l.stage for l in locking.FileLocksSnapshot(a.need_lock).locks] == ["need"]
+	os.unlink(other.path)
+	t.join(timeout=5.0)
+	assert [l.stage for l in locking.FileLocksSnapshot(a.need_lock).locks] == ["has"]
+	assert [l.stage for l in locking.FileLocksSnapshot(b.need_lock).locks] == ["has"]
+	lock._unlock()
+	assert lock_table.process_locks.entries == {}
+
+
+def lock_overlapping(storage_directory, lock_backend, seed):
+	DDB.config.storage_directory = storage_directory
+	DDB.config.lock_backend = lock_backend
+	names = [f"test_overlapping/{i}" for i in range(5)]
+	random.seed(seed)
+	for _ in range(20):
+		with locking.MultiWriteLock(random.sample(names, 3)):
+			pass
+	return True
+
+
+def test_overlapping_multi_write_locks_do_not_deadlock(lock_backend):
+	prev = locking.AQUIRE_LOCK_TIMEOUT
+	locking.AQUIRE_LOCK_TIMEOUT = 10.0
+	with Pool(processes=4) as pool:
+		args = [(DDB.config.storage_directory, lock_backend, seed) for seed in range(4)]
+		assert pool.starmap(lock_overlapping, args) == [True] * 4
+	locking.AQUIRE_LOCK_TIMEOUT = prev
+
+
+@pytest.fixture
+def lock_metrics():
+	DDB.config.lock_metrics = True
+	locking.reset_lock_metrics()
+	yield
+	DDB.config.lock_metrics = False
+	locking.reset_lock_metrics()
+
+
+def test_lock_metrics_are_disabled_by_default():
+	locking.reset_lock_metrics()
+	with locking.WriteLock("test_metrics_disabled"):
+		pass
+	assert locking.get_lock_metrics() == {}
+
+
+def test_lock_metrics_query_does_not_add_databases(lock_metrics):
+	assert locking.get_lock_metrics("test_metrics_typo")["acquisitions"] == 0
+	assert locking.get_lock_metrics() == {}
+
+
+def test_lock_metrics(lock_backend, lock_metrics):
+	held, release = threading.Event(), threading.Event()
+
+	def hold():
+		with locking.WriteLock("test/metrics"):
+			held.set()
+			release.wait()
+
+	def read():
+		with locking.ReadLock("test/metrics"):
+			pass
+
+	t = threading.Thread(target=hold)
+	t.start()
+	held.wait()
+	assert locking.get_lock_metrics("test/metrics")["holders"] == 1
+	reader = threading.Thread(target=read)
+	reader.start()
+	time.sleep(0.05)
+	release.set()
+	t.join()
+	reader.join()
+
+	stats = locking.get_lock_metrics()["test___metrics"]
+	assert stats == locking.get_lock_metrics("test/metrics")
+	assert stats["acquisitions"] == 2
+	assert stats["max_wait_ns"] >= 50_000_000
+	assert stats["wait_ns"] >= stats["max_wait_ns"]
+	assert stats["holders"] == 0
+	assert stats["max_holders"] == 1
+	assert stats["timeouts"] == 0
+
+
+def test_lock_metrics_count_timeouts_and_orphans(lock_metrics):
+	lock = locking.WriteLock("test_metrics_timeout")
+	other = locking.LockFileMeta(lock.need_lock.ddb_dir, lock.db_name, "1", f"{time.time_ns()}", "has", "write")
+	orphan = locking.LockFileMeta(lock.need_lock.ddb_dir, lock.db_name, "2", "1", "need", "write")
+	os.makedirs(other.ddb_dir, exist_ok=True)
+	locking.os_touch(other.path)
+	locking.os_touch(orphan.path)
+
+	prev = locking.AQUIRE_LOCK_TIMEOUT
+	locking.AQUIRE_LOCK_TIMEOUT = 0.05
+	try:
+		with pytest.raises(RuntimeError):
+			lock._lock()
+	finally:
+		locking.AQUIRE_LOCK_TIMEOUT = prev
+		os.unlink(other.path)
+
+	stats = locking.get_lock_metrics("test_metrics_timeout")
+	assert stats["timeouts"] == 1
+	assert stats["acquisitions"] == 0
+	assert stats["orphans_removed"] == 1
+	assert stats["polls"] > 0
+
+
+def test_reentrant_read_lock(lock_backend):
+	name = "test_reentrant_read_lock"
+	for outer in [locking.ReadLock, locking.WriteLock, locking.UpgradeableLock]:
+		with outer(name), locking.ReadLock(name):
+			with locking.ReadLock(name):
+				pass
+			entry = lock_table.process_locks.entries[(locking.ReadLock(name).need_lock.ddb_dir, "test_reentrant_read_lock")]
+			assert entry.is_held_by(threading.get_ident())
+		assert lock_table.process_locks.entries == {}
+	with locking.WriteLock(name):
+		pass
+
+
+def hold_read_lock(storage_directory, lock_backend, name, duration):
+	DDB.config.storage_directory = storage_directory
+	DDB.config.lock_backend = lock_backend
+	with locking.ReadLock(name):
+		time.sleep(duration)
+	return time.monotonic()
+
+
+def test_upgradeable_lock_admits_readers(lock_backend):
+	name = "test_upgradeable_lock_admits_readers"
+	with locking.UpgradeableLock(name):
+		# Readers of this and other processes are admitted
+		t = threading.Thread(target=hold_read_lock, args=(DDB.config.storage_directory, lock_backend, name, 0))
+		t.start()
+		t.join(timeout=5.0)
+		assert not t.is_alive()
+		with Pool(processes=1) as pool:
+			assert pool.apply(hold_read_lock, (DDB.config.storage_directory, lock_backend, name, 0)) > 0
+
+		# Writers and other upgradeable locks are not
+		events = []
+
+		def exclusive(lock_type):
+			with lock_type(name):
+				events.append(lock_type)
+
+		threads = [threading.Thread(target=exclusive, args=(l,)) for l in [locking.WriteLock, locking.UpgradeableLock]]
+		for t in threads:
+			t.start()
+		time.sleep(0.1)
+		assert events == []
+	for t in threads:
+		t.join(timeout=5.0)
+	assert sorted(events, key=lambda l: l.__name__) == [locking.UpgradeableLock, locking.WriteLock]
+
+
+def test_upgrade_waits_for_readers(lock_backend):
+	name = "test_upgrade_waits_for_readers"
+	lock = locking.UpgradeableLock(name)
+	with lock:
+		with Pool(processes=1) as pool:
+			reader = pool.apply_async(hold_read_lock, (DDB.config.storage_directory, lock_backend, name, 0.3))
+			time.sleep(0.15)
+			lock._upgrade()
+			upgraded = time.monotonic()
+			assert lock.mode == "write"
+			assert upgraded >= reader.get()
+			# Upgrading again does nothing
+			lock._upgrade()
+
+		# Now the lock is exclusive
+		t = threading.Thread(target=hold_read_lock, args=(DDB.config.storage_directory, lock_backend, name, 0))
+		t.start()
+		time.sleep(0.1)
+		assert t.is_alive()
+	t.join(timeout=5.0)
+	assert not t.is_alive()
+	assert lock_table.process_locks.entries == {}
+
+
+def test_upgrade_waits_for_readers_of_same_process(lock_backend):
+	name = "test_upgrade_waits_for_readers_of_same_process"
+	lock = locking.UpgradeableLock(name)
+	with lock:
+		t = threading.Thread(target=hold_read_lock, args=(DDB.config.storage_directory, lock_backend, name, 0.2))
+		t.start()
+		time.sleep(0.05)
+		lock._upgrade()
+		assert not t.is_alive()
+	t.join()
+
+
+def test_lock_timeout_and_non_blocking(lock_backend):
+	name = "test_lock_timeout_and_non_blocking"
+	with Pool(processes=1) as pool:
+		reader = pool.apply_async(hold_read_lock, (DDB.config.storage_directory, lock_backend, name, 0.6))
+		time.sleep(0.2)
+
+		t1 = time.monotonic()
+		with pytest.raises(locking.LockTimeoutError):
+			locking.WriteLock(name, blocking=False)._lock()
+		assert time.monotonic() - t1 < 0.05
+
+		t1 = time.monotonic()
+		with pytest.raises(locking.LockTimeoutError):
+			locking.WriteLock(name, timeout=0.1)._lock()
+		assert 0.1 <= time.monotonic() - t1 < 0.3
+
+		# Readers are still admitted without waiting
+		with locking.ReadLock(name, blocking=False):
+			pass
+		reader.get()
+
+	lock = locking.WriteLock(name, blocking=False)
+	with lock:
+		pass
+	assert lock_table.process_locks.entries == {}
+	# No need locks of the failed attempts are left behind
+	if os.path.isdir(lock.need_lock.ddb_dir):
+		assert [f for f in os.listdir(lock.need_lock.ddb_dir) if f.endswith(".lock")] == []
+
+
+def test_lock_timeout_in_process(lock_backend):
+	name = "test_lock_timeout_in_process"
+	errors = []
+
+	def write_in_thread(**kwargs):
+		try:
+			with locking.WriteLock(name, **kwargs):
+				pass
+		except locking.LockTimeoutError as e:
+			errors.append(e)
+
+	with locking.ReadLock(name):
+		for kwargs in [{"blocking": False}, {"timeout": 0.05}]:
+			t = threading.Thread(target=write_in_thread, kwargs=kwargs)
+			t.start()
+			t.join(timeout=5.0)
+	assert len(errors) == 2
+	assert isinstance(errors[0], RuntimeError)
+	assert lock_table.process_locks.entries == {}
+
+
+def test_upgrade_timeout(lock_backend):
+	name = "test_upgrade_timeout"
+	lock = locking.UpgradeableLock(name, timeout=0.1)
+	with lock:
+		with Pool(processes=1) as pool:
+			reader = pool.apply_async(hold_read_lock, (DDB.config.storage_directory, lock_backend, name, 0.5))
+			time.sleep(0.15)
+			with pytest.raises(locking.LockTimeoutError):
+				lock._upgrade()
+			# The lock is still upgradeable
+			assert lock.mode == "upgrade"
+			reader.get()
+		lock._upgrade()
+		assert lock.mode == "write"
+	assert lock_table.process_locks.entries == {}
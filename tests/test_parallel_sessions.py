@@ -5,15 +5,16 @@ from path_dict import pd
 import dictdatabase as DDB
 
 
-def increment_counters(n, tables, cfg):
+def increment_counters(n, tables, cfg, upgradeable=False):
 	DDB.config.storage_directory = cfg.storage_directory
 	DDB.config.use_compression = cfg.use_compression
 	DDB.config.use_orjson = cfg.use_orjson
+	DDB.config.lock_backend = cfg.lock_backend
 
 	for _ in range(n):
 		for t in range(tables):
 			# Perform a counter increment
-			with DDB.at(f"test_stress_parallel{t}").session(as_type=pd) as (session, d):
+			with DDB.at(f"test_stress_parallel{t}").session(as_type=pd, upgradeable=upgradeable) as (session, d):
 				d["counter"] = lambda x: (x or 0) + 1
 				session.write()
 	return True
@@ -23,6 +24,7 @@ def read_counters(n, tables, cfg):
 	DDB.config.storage_directory = cfg.storage_directory
 	DDB.config.use_compression = cfg.use_compression
 	DDB.config.use_orjson = cfg.use_orjson
+	DDB.config.lock_backend = cfg.lock_backend
 	for _ in range(n):
 		for t in range(tables):
 			DDB.at(f"test_stress_parallel{t}").read()
@@ -54,6 +56,24 @@ def test_stress_multiprocessing(use_compression, use_orjson):
 		assert db["counter"] == threads * per_thread
 
 
+def test_stress_multiprocessing_upgradeable(lock_backend):
+	per_thread = 15
+	processes = 3
+	DDB.at("test_stress_parallel0").create({}, force_overwrite=True)
+
+	results = []
+	pool = Pool(processes=processes * 3)
+	for _ in range(processes):
+		results.append(pool.apply_async(increment_counters, args=(per_thread, 1, DDB.config, True)))
+		results.append(pool.apply_async(increment_counters, args=(per_thread, 1, DDB.config)))
+		results.append(pool.apply_async(read_counters, args=(per_thread, 1, DDB.config)))
+	pool.close()
+	pool.join()
+
+	assert [r.get() for r in results] == [True] * processes * 3
+	assert DDB.at("test_stress_parallel0").read()["counter"] == processes * per_thread * 2
+
+
 def test_heavy_multiprocessing():
 	per_thread = 50
 	tables = 1
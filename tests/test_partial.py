@@ -1,9 +1,13 @@
 import json
+import os
+import tracemalloc
 
+import orjson
 import pytest
 from path_dict import pd
 
 import dictdatabase as DDB
+from dictdatabase import utils
 
 
 def test_subread(use_compression, use_orjson, indent):
@@ -59,6 +63,49 @@ def test_subwrite(use_compression, use_orjson, indent):
 			session.write()
 
 
+def test_key_paths(use_compression, use_orjson, indent, index_validation):
+	name = "test_key_paths"
+	j = {
+		"a": {"b": {"c": [1, 2], "d": {"b": 3}}, "e": 4},
+		"b.c": 5,
+		"f": {"b": {"c": 6}},
+	}
+	DDB.at(name).create(j, force_overwrite=True)
+
+	assert DDB.at(name, key="a.b.c").read() == [1, 2]
+	assert DDB.at(name, key="a.b.d.b").read() == 3
+	assert DDB.at(name, key="f.b.c").read() == 6
+	# Keys of the outermost object are preferred
+	assert DDB.at(name, key="b.c").read() == 5
+	assert DDB.at(name, key="a.e.f").read() is None
+	assert DDB.at(name, key="a.x").read() is None
+	assert DDB.at(name, key="a.b").read() == {"c": [1, 2], "d": {"b": 3}}
+
+	for i in range(3):
+		with DDB.at(name, key="a.b.d").session(as_type=pd) as (session, d):
+			d["x"] = "y" * i
+			session.write()
+		assert DDB.at(name, key="a.b.d.x").read() == "y" * i
+		with DDB.at(name, key="a.b.c").session() as (session, c):
+			c.append(i)
+			session.write()
+		# Entries of the containing and the nested values are updated
+		assert DDB.at(name, key="a.b").read()["c"][-1] == i
+		assert DDB.at(name, key="a.e").read() == 4
+		assert DDB.at(name, key="f.b.c").read() == 6
+
+	with DDB.at(name, key="a").session() as (session, a):
+		a["b"] = {"d": {"b": 7}}
+		session.write()
+	assert DDB.at(name, key="a.b.c").read() is None
+	assert DDB.at(name, key="a.b.d.b").read() == 7
+	assert DDB.at(name).read() == {"a": {"b": {"d": {"b": 7}}, "e": 4}, "b.c": 5, "f": {"b": {"c": 6}}}
+
+	with pytest.raises(KeyError):
+		with DDB.at(name, key="a.b.c").session() as (session, c):
+			session.write()
+
+
 def test_write_file_where(use_compression, use_orjson, indent):
 	name = "test_write_file_where"
 	j = {
@@ -98,3 +145,25 @@ def test_dir_where(use_compression, use_orjson, indent):
 		"3": {"k": 4},
 		"4": {"k": 5},
 	}
+
+
+def test_partial_read_memory(monkeypatch):
+	# Written by others, so there is no index and the whole file is searched
+	monkeypatch.setattr(utils, "KEY_SEARCH_MAX_CHUNK_SIZE", 256 * 1024)
+	data = {f"key{i}": {"key": i, "text": "x" * 100} for i in range(50_000)}
+	data["last"] = {"key": "value"}
+	DDB.at("test_partial_read_memory").delete()
+	os.makedirs(DDB.config.storage_directory, exist_ok=True)
+	with open(f"{DDB.config.storage_directory}/test_partial_read_memory.json", "wb") as f:
+		f.write(orjson.dumps(data))
+
+	tracemalloc.start()
+	try:
+		assert DDB.at("test_partial_read_memory", key="last").read() == {"key": "value"}
+		# Searched between the start of the file and the now indexed last key
+		assert DDB.at("test_partial_read_memory", key="key49999.key").read() == 49999
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	# The file has about 6MB
+	assert peak < 2 * 1024 * 1024
@@ -0,0 +1,181 @@
+import os
+import threading
+
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import io_unsafe, locking, utils, value_indexes
+
+USERS = {
+	"u1": {"name": "Ben", "age": 30, "job": "Software Engineer"},
+	"u2": {"name": "Sue", "age": 21, "job": "Architect"},
+	"u3": {"name": "Joe", "age": 50, "job": "Manager", "admin": True},
+	"u4": {"name": "Ann", "age": 30.5},
+	"u5": {"name": "Tim", "age": "unknown"},
+	"u6": ["not", "a", "dict"],
+}
+
+
+def expected(where):
+	return {k: v for k, v in USERS.items() if isinstance(v, dict) and where(v)}
+
+
+def test_query(use_compression, use_orjson, indent):
+	DDB.at("test_query").create(USERS, force_overwrite=True)
+	DDB.at("test_query").create_value_index("age")
+	DDB.at("test_query").create_value_index("name")
+
+	is_number = lambda v: isinstance(v.get("age"), (int, float))  # noqa: E731
+	assert DDB.at("test_query").query(age=30) == expected(lambda v: v.get("age") == 30)
+	assert DDB.at("test_query").query(age__gt=30) == expected(lambda v: is_number(v) and v["age"] > 30)
+	assert DDB.at("test_query").query(age__gte=30) == expected(lambda v: is_number(v) and v["age"] >= 30)
+	assert DDB.at("test_query").query(age__lt=30) == expected(lambda v: is_number(v) and v["age"] < 30)
+	assert DDB.at("test_query").query(age__lte=30.5, age__gt=21) == {"u1": USERS["u1"], "u4": USERS["u4"]}
+	assert DDB.at("test_query").query(age="unknown") == {"u5": USERS["u5"]}
+	assert DDB.at("test_query").query(name__gte="Sue") == {"u2": USERS["u2"], "u5": USERS["u5"]}
+	assert DDB.at("test_query").query(name="Joe", age=50) == {"u3": USERS["u3"]}
+	assert DDB.at("test_query").query(name="Nobody") == {}
+	assert DDB.at("test_query").query({"name": "Joe"}, age=50) == {"u3": USERS["u3"]}
+	# Without a value index, the whole file is filtered
+	assert DDB.at("test_query").query(admin=True) == {"u3": USERS["u3"]}
+	assert DDB.at("test_query").query(job="Manager", age__gte=50) == {"u3": USERS["u3"]}
+
+	with pytest.raises(ValueError):
+		DDB.at("test_query").query(age=[30])
+	with pytest.raises(RuntimeError):
+		DDB.at("test_query", key="u1").query(age=30)
+	assert DDB.at("test_query_none").query(age=30) is None
+
+
+def test_query_uses_value_indexes(monkeypatch):
+	DDB.at("test_query_index").create(USERS, force_overwrite=True)
+	DDB.at("test_query_index").create_value_index("age")
+
+	def read(db_name):
+		raise AssertionError("The whole file must not be read")
+
+	with monkeypatch.context() as m:
+		m.setattr(io_unsafe, "read", read)
+		assert DDB.at("test_query_index").query(age__gte=50) == {"u3": USERS["u3"]}
+
+		# Partial writes update the value index
+		with DDB.at("test_query_index", key="u2").session() as (session, u2):
+			u2["age"] = 60
+			session.write()
+		assert DDB.at("test_query_index").query(age__gte=50) == {"u2": {**USERS["u2"], "age": 60}, "u3": USERS["u3"]}
+		with DDB.at("test_query_index", key="u3.age").session() as (session, age):
+			session.write()
+		assert DDB.at("test_query_index").query(age__gte=50) == {"u2": {**USERS["u2"], "age": 60}, "u3": USERS["u3"]}
+
+	# Full writes rebuild the value index
+	DDB.at("test_query_index").create({"u1": {"age": 70}}, force_overwrite=True)
+	with monkeypatch.context() as m:
+		m.setattr(io_unsafe, "read", read)
+		assert DDB.at("test_query_index").query(age__gte=50) == {"u1": {"age": 70}}
+
+	# Changes by others are detected, and the value index is rebuilt
+	with open(f"{DDB.config.storage_directory}/test_query_index.json", "wb") as f:
+		f.write(b'{"u1": {"age": 80}, "u2": {"age": 10}}')
+	assert DDB.at("test_query_index").query(age__gte=50) == {"u1": {"age": 80}}
+	assert value_indexes.get_value_index("test_query_index").fields == {"age": {"u1": 80, "u2": 10}}
+
+	DDB.at("test_query_index").delete_value_index("age")
+	assert value_indexes.get_value_index("test_query_index").fields == {}
+	assert DDB.at("test_query_index").query(age__gte=50) == {"u1": {"age": 80}}
+
+	# Fields with the names of the lock options are queried with a dict
+	DDB.at("test_query_index").create({"u1": {"timeout": 5}, "u2": {"timeout": 1}}, force_overwrite=True)
+	assert DDB.at("test_query_index").query({"timeout__gt": 2}, timeout=1) == {"u1": {"timeout": 5}}
+
+
+def test_value_index_appends_partial_writes(monkeypatch):
+	monkeypatch.setattr(value_indexes, "VALUE_INDEX_APPEND_MIN_COMPACTION", 3)
+	DDB.at("test_query_append").create(USERS, force_overwrite=True)
+	DDB.at("test_query_append").create_value_index("age")
+	path = value_indexes.value_index_path("test_query_append")
+	size = os.path.getsize(path)
+
+	for age in [40, 41, 42]:
+		with DDB.at("test_query_append", key="u1").session() as (session, u1):
+			u1["age"] = age
+			session.write()
+	# Partial writes append their changes, which are replayed when loading
+	with open(path, "rb") as f:
+		assert len(f.read().splitlines()) == 4
+	assert os.path.getsize(path) > size
+	loaded = value_indexes.ValueIndex("test_query_append")
+	assert loaded.appended == 3 and loaded.fields["age"]["u1"] == 42
+	assert loaded.is_valid(utils.file_stamp("test_query_append"))
+
+	# Once there are enough appended changes, they are compacted
+	with DDB.at("test_query_append", key="u2").session() as (session, u2):
+		u2["age"] = 43
+		session.write()
+	with open(path, "rb") as f:
+		assert len(f.read().splitlines()) == 1
+	assert DDB.at("test_query_append").query(age__gte=42, age__lt=50) == {
+		"u1": {**USERS["u1"], "age": 42},
+		"u2": {**USERS["u2"], "age": 43},
+	}
+
+
+def test_value_index_declarations_are_not_lost():
+	DDB.at("test_query_declare").create(USERS, force_overwrite=True)
+	data_stamp = utils.file_stamp("test_query_declare")
+	a = value_indexes.ValueIndex("test_query_declare")
+	b = value_indexes.ValueIndex("test_query_declare")
+	a.build(USERS, data_stamp, ["age"])
+	b.build(USERS, data_stamp, ["name"])
+	assert sorted(value_indexes.ValueIndex("test_query_declare").fields) == ["age", "name"]
+	a.remove("name")
+	assert list(value_indexes.ValueIndex("test_query_declare").fields) == ["age"]
+
+
+def test_query_rebuilds_value_indexes_exclusively():
+	DDB.at("test_query_rebuild").create(USERS, force_overwrite=True)
+	DDB.at("test_query_rebuild").create_value_index("age")
+	with open(f"{DDB.config.storage_directory}/test_query_rebuild.json", "wb") as f:
+		f.write(b'{"u1": {"age": 80}, "u2": {"age": 10}}')
+	value_index = value_indexes.get_value_index("test_query_rebuild")
+
+	# While another thread or a session of this thread holds a lock, the value
+	# index is not rebuilt
+	held, release = threading.Event(), threading.Event()
+
+	def hold_read_lock():
+		with locking.ReadLock("test_query_rebuild"):
+			held.set()
+			release.wait()
+
+	reader = threading.Thread(target=hold_read_lock)
+	reader.start()
+	held.wait()
+	try:
+		assert DDB.at("test_query_rebuild").query(age__gte=50) == {"u1": {"age": 80}}
+	finally:
+		release.set()
+		reader.join()
+	assert value_index.needs_rebuild(utils.file_stamp("test_query_rebuild"))
+	with DDB.at("test_query_rebuild").session():
+		assert DDB.at("test_query_rebuild").query(age__gte=50) == {"u1": {"age": 80}}
+	assert value_index.needs_rebuild(utils.file_stamp("test_query_rebuild"))
+
+	assert DDB.at("test_query_rebuild").query(age__gte=50) == {"u1": {"age": 80}}
+	assert not value_index.needs_rebuild(utils.file_stamp("test_query_rebuild"))
+	assert value_index.fields == {"age": {"u1": 80, "u2": 10}}
+
+
+def test_query_returns_sorted_keys():
+	DDB.at("test_query_order").create({f"k{i:03}": {"age": i} for i in range(5)}, force_overwrite=True)
+	DDB.at("test_query_order").create_value_index("age")
+	with DDB.at("test_query_order").session() as (session, data):
+		data["a000"] = {"age": 10}
+		session.write()
+	expected_keys = ["a000", "k000", "k001", "k002", "k003", "k004"]
+	assert list(DDB.at("test_query_order").read()) == expected_keys
+	assert list(DDB.at("test_query_order").query(age__gte=0)) == expected_keys
+
+	# Without a value index, the items are in sorted order too
+	with open(f"{DDB.config.storage_directory}/test_query_order.json", "wb") as f:
+		f.write(b'{"b": {"age": 1}, "a": {"age": 2}}')
+	assert list(DDB.at("test_query_order").query(age__gte=0)) == ["a", "b"]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import indexing, io_unsafe, utils
+
+EVENTS = {
+	f"2024-{month:02}-{day:02}": {"day": day, "nested": {"2024-01-15": month}}
+	for month in range(1, 5)
+	for day in range(1, 29, 3)
+}
+
+
+def expected(start=None, end=None):
+	return {k: v for k, v in sorted(EVENTS.items()) if (start is None or k >= start) and (end is None or k < end)}
+
+
+def test_range(use_compression, use_orjson, indent, monkeypatch):
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	monkeypatch.setattr(indexing, "INDEX_SAMPLE_INTERVAL", 4)
+	DDB.at("test_range").create(EVENTS, force_overwrite=True)
+
+	def read(db_name):
+		raise AssertionError("The whole file must not be read")
+
+	with monkeypatch.context() as m:
+		m.setattr(io_unsafe, "read", read)
+		for start, end in [
+			("2024-01", "2024-02"),
+			("2024-02-04", "2024-02-22"),
+			("2024-01-15", "2024-01-16"),
+			("2024-03-10", None),
+			(None, "2024-01-10"),
+			("2025", None),
+			(None, "2023"),
+			(None, None),
+			("2024-02", "2024-01"),
+		]:
+			result = DDB.at("test_range").range(start=start, end=end)
+			assert result == expected(start, end)
+			assert list(result) == list(expected(start, end))
+		assert DDB.at("test_range").range(prefix="2024-03-") == expected("2024-03-", "2024-03.")
+		assert DDB.at("test_range").range(prefix="2024-04-2") == expected("2024-04-2", "2024-04-3")
+		assert DDB.at("test_range").range(prefix="2025") == {}
+
+		# Partial writes keep the index current
+		with DDB.at("test_range", key="2024-02-04").session() as (session, event):
+			event["day"] = "x" * 50
+			session.write()
+		assert DDB.at("test_range").range(prefix="2024-02-0")["2024-02-04"]["day"] == "x" * 50
+
+	# Without a current index, or if the keys are not sorted, the whole file is read
+	events = {**EVENTS, "2024-02-04": {"day": "x" * 50, "nested": {"2024-01-15": 2}}}
+	DDB.at("test_range").delete()
+	with open(f"{DDB.config.storage_directory}/test_range.json", "w") as f:
+		f.write(json.dumps(dict(reversed(events.items()))))
+	assert DDB.at("test_range").range(prefix="2024-02") == {
+		k: events[k] for k in sorted(events) if k.startswith("2024-02")
+	}
+	DDB.at("test_range").build_index()
+	assert not indexing.get_indexer("test_range").keys_sorted
+	assert list(DDB.at("test_range").range(prefix="2024-02")) == [k for k in sorted(events) if k.startswith("2024-02")]
+
+
+def test_range_errors():
+	assert DDB.at("test_range_errors").range(prefix="a") is None
+	DDB.at("test_range_errors").create({"a": 1, "b": 2})
+	assert DDB.at("test_range_errors").range(prefix="a") == {"a": 1}
+	with pytest.raises(TypeError):
+		DDB.at("test_range_errors").range(start="a", prefix="a")
+	with pytest.raises(RuntimeError):
+		DDB.at("test_range_errors", key="a").range(prefix="a")
+
+
+def test_prefix_end():
+	assert utils.prefix_end("") is None
+	assert utils.prefix_end("user:42:") == "user:42;"
+	assert utils.prefix_end("a\U0010ffff") == "b"
+	assert utils.prefix_end("\U0010ffff") is None
+	assert utils.prefix_end("a퟿") == "a"
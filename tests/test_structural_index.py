@@ -0,0 +1,75 @@
+import json
+
+import orjson
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import indexing, structural_index, utils
+
+pytest.importorskip("numpy")
+
+
+DATA = {
+	"a": 1,
+	"b": {"c": [1, {"d": "}"}], "e": 'x\\"{', "f": [1, 2]},
+	'g\\"h': [],
+	"i": {},
+	"j": "\\\\",
+	"k": [{"b": 2}, "]", "\\\\\\"],
+}
+
+
+@pytest.mark.parametrize(
+	"dump",
+	[
+		orjson.dumps,
+		lambda d: json.dumps(d).encode(),
+		lambda d: json.dumps(d, indent=2).encode(),
+		lambda d: json.dumps(d, indent="\t").encode(),
+		lambda d: b" \n" + json.dumps(d, separators=(",", " : ")).encode() + b"\n",
+	],
+)
+def test_structural_index(dump):
+	for data in [DATA, {}, {"a": {"b": {}}}]:
+		json_bytes = dump(data)
+		index = structural_index.StructuralIndex(json_bytes)
+		assert index.top_level_values() == utils.find_top_level_values(json_bytes)
+		for key in [*data, "c", "d", "missing"]:
+			assert index.find_outermost_key(key) == utils.find_outermost_key_in_json_bytes(json_bytes, key)
+	assert structural_index.StructuralIndex(b"[1, 2]").top_level_values() == []
+
+
+def test_find_outermost_key_in_array():
+	# The bytes start within an array of the outermost object
+	json_bytes = b'[{"a": 1}, {"b": {"a": 2}}], "a": 3}'
+	index = structural_index.StructuralIndex(json_bytes)
+	assert index.find_outermost_key("a", 1) == utils.find_outermost_key_in_json_bytes(json_bytes, "a", 1) == (29, 33)
+	assert index.count_nesting() == utils.count_nesting_in_bytes(json_bytes, 0, len(json_bytes)) == -1
+
+
+def test_structural_index_is_used(monkeypatch):
+	monkeypatch.setattr(structural_index, "STRUCTURAL_INDEX_MIN_SIZE", 0)
+	monkeypatch.setattr(utils, "KEY_SEARCH_CHUNK_SIZE", 1)
+	monkeypatch.setattr(indexing, "INDEX_BUILD_MIN_SIZE", 0)
+	DDB.at("test_structural_index").create({"x": DATA, **DATA}, force_overwrite=True)
+
+	def seek_index_through_value_bytes(json_bytes, index):
+		raise AssertionError("The bytes must be scanned with NumPy")
+
+	with monkeypatch.context() as m:
+		m.setattr(utils, "seek_index_through_value_bytes", seek_index_through_value_bytes)
+		DDB.at("test_structural_index").build_index()
+	assert indexing.get_indexer("test_structural_index").get("x") is not None
+
+	# After a chunk with a frequent key, the remaining occurrences are found with NumPy
+	calls = []
+	find_outermost_key = structural_index.StructuralIndex.find_outermost_key
+	monkeypatch.setattr(
+		structural_index.StructuralIndex,
+		"find_outermost_key",
+		lambda self, *args: calls.append(args) or find_outermost_key(self, *args),
+	)
+	json_bytes = orjson.dumps({**{f"k{i}": {"c": i} for i in range(100)}, "c": "found"})
+	key_start, key_end = utils.find_outermost_key_in_json_bytes(json_bytes, "c")
+	assert json_bytes[key_start : key_end + 7] == b'"c":"found"'
+	assert len(calls) == 1
@@ -5,11 +5,11 @@ from path_dict import pd
 import dictdatabase as DDB
 
 
-def increment_counters(n, tables):
+def increment_counters(n, tables, upgradeable=False):
 	for _ in range(n):
 		for t in range(tables):
 			# Perform a counter increment
-			with DDB.at(f"test_stress_threaded{t}").session(as_type=pd) as (session, d):
+			with DDB.at(f"test_stress_threaded{t}").session(as_type=pd, upgradeable=upgradeable) as (session, d):
 				d["counter"] = lambda x: (x or 0) + 1
 				session.write()
 	return True
@@ -22,7 +22,7 @@ def read_counters(n, tables):
 	return True
 
 
-def test_stress_threaded(use_compression, use_orjson):
+def test_stress_threaded(use_compression, use_orjson, lock_backend, lock_wait_strategy):
 	per_thread = 15
 	tables = 1
 	threads = 3
@@ -46,6 +46,23 @@ def test_stress_threaded(use_compression, use_orjson):
 		assert db["counter"] == threads * per_thread
 
 
+def test_stress_threaded_upgradeable(lock_backend):
+	per_thread = 15
+	threads = 3
+	DDB.at("test_stress_threaded0").create({}, force_overwrite=True)
+
+	results = []
+	with ThreadPoolExecutor(max_workers=threads * 3) as pool:
+		for _ in range(threads):
+			results.append(pool.submit(increment_counters, per_thread, 1, True))
+			results.append(pool.submit(increment_counters, per_thread, 1))
+			results.append(pool.submit(read_counters, per_thread, 1))
+	wait(results)
+
+	assert [r.result() for r in results] == [True] * threads * 3
+	assert DDB.at("test_stress_threaded0").read()["counter"] == threads * per_thread * 2
+
+
 def test_heavy_threading():
 	per_thread = 50
 	tables = 1
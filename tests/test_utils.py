@@ -1,6 +1,7 @@
 import itertools
 
 import orjson
+import pytest
 
 from dictdatabase import byte_codes, utils
 
@@ -18,6 +19,19 @@ def test_seek_index_through_value_bytes():
 	assert utils.seek_index_through_value_bytes(n, 6) == 10
 
 
+def test_seek_index_through_value_bytes_skips_ahead():
+	v = b'{"a": [{"b": "]}\\\\"}, [[]], "\\"["], "c": 1}'
+	assert utils.seek_index_through_value_bytes(v, 6) == v.index(b', "c"')
+	assert utils.seek_index_through_value_bytes(v, 5) == v.index(b', "c"')
+	assert utils.seek_index_through_value_bytes(v, v.index(b"1}")) == len(v) - 1
+	deep = b'{"a": ' + b"[{" * 200 + b'"x": 1' + b"}]" * 200 + b"\n}"
+	assert utils.seek_index_through_value_bytes(deep, 6) == len(deep) - 2
+	assert utils.seek_index_through_value_bytes(b'{\n  "a": true\n}', 8) == 13
+	for invalid in [b'{"a": "x\\"', b'{"a": [1, {"b": 2}', b'{"a": ', b'{"a": 1']:
+		with pytest.raises(TypeError):
+			utils.seek_index_through_value_bytes(invalid, 6)
+
+
 def test_seek_index_through_value_bytes_2():
 	def load_with_orjson(bytes, key):
 		return orjson.loads(bytes)[key]
@@ -86,3 +100,48 @@ def test_seek_index_through_value_bytes_2():
 		json_bytes = orjson.dumps({"a": v1, "b": v2}, option=option)
 		assert load_with_orjson(json_bytes, "a") == load_with_seeker(json_bytes, "a")
 		assert load_with_orjson(json_bytes, "b") == load_with_seeker(json_bytes, "b")
+
+
+def test_find_outermost_key_in_json_bytes():
+	def find(json_bytes, key, nesting=0):
+		key_start, key_end = utils.find_outermost_key_in_json_bytes(json_bytes, key, nesting)
+		return json_bytes[key_start:key_end] if key_start != -1 else None
+
+	assert find(b'{"a": {"b": 1}, "b": 2}', "b") == b'"b":'
+	assert find(b'{"a": {"b": 1}}', "b") is None
+	assert find(b'{"a": 1}', "b") is None
+	# Braces and escaped quotes in strings do not change the nesting
+	assert find(b'{"a": "{", "b": 2}', "b") == b'"b":'
+	assert find(b'{"a": "}", "c": {"b": 1}}', "b") is None
+	assert find(b'{"a": "\\"{\\\\", "b": 2}', "b") == b'"b":'
+	assert find(b'{"a": ["\\\\\\"}", {"b": 1}], "b": 2}', "b") == b'"b":'
+	# Nesting at the start of the bytes
+	assert find(b', "a": {"b": 1}, "b": 2, "c": 3}', "b", 1) == b'"b":'
+	assert find(b'{"b": 1}, "a": 1', "b", 1) is None
+
+	# Many nested occurrences before the outermost one, over several chunks
+	for top_level in [True, False]:
+		data = {f"k{i}": {"key": {"key": "{" * (i % 3), "x": "}"}} for i in range(10000)}
+		if top_level:
+			data["key"] = "value"
+		json_bytes = orjson.dumps(data)
+		key_start, _ = utils.find_outermost_key_in_json_bytes(json_bytes, "key")
+		assert key_start == (json_bytes.rfind(b'"key":') if top_level else -1)
+
+
+def test_count_nesting_in_bytes():
+	json_bytes = b'{"a": {"b": "}{{", "c": ["\\\\", "\\"{"]'
+	assert utils.count_nesting_in_bytes(json_bytes, 0, len(json_bytes)) == 2
+	assert utils.count_nesting_in_bytes(json_bytes, 1, len(json_bytes)) == 1
+	assert utils.count_nesting_in_bytes(json_bytes, 0, 0) == 0
+
+
+def test_count_nesting_in_chunks(monkeypatch):
+	json_bytes = b'{"a": {"b": "}{{", "c": ["\\\\", "\\"{", "x\\\\\\"}"], "d": {'
+	nesting = utils.count_nesting_in_bytes(json_bytes, 0, len(json_bytes))
+	for chunk_size in range(1, 8):
+		# Strings and escape sequences are split between chunks
+		monkeypatch.setattr(utils, "KEY_SEARCH_MAX_CHUNK_SIZE", chunk_size)
+		assert utils.count_nesting_in_bytes(json_bytes, 0, len(json_bytes)) == nesting == 3
+		key_start, _ = utils.find_outermost_key_in_json_bytes(json_bytes + b'}}, "e":1}', "e")
+		assert key_start == len(json_bytes) + 4
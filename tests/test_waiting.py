@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import dictdatabase as DDB
+from dictdatabase import locking, waiting
+
+
+def test_make_waiter(lock_wait_strategy, tmp_path):
+	waiter = waiting.make_waiter(str(tmp_path), 0.001)
+	expected = {
+		"poll": waiting.PollWaiter,
+		"backoff": waiting.BackoffWaiter,
+		"inotify": waiting.InotifyWaiter if waiting.libc is not None else waiting.BackoffWaiter,
+	}
+	assert isinstance(waiter, expected[lock_wait_strategy])
+	waiter.wait()
+	waiter.close()
+	# Without a directory, there is nothing to watch
+	assert not isinstance(waiting.make_waiter(None, 0.001), waiting.InotifyWaiter)
+
+
+def test_backoff_waiter_grows_until_max():
+	waiter = waiting.BackoffWaiter()
+	for _ in range(20):
+		waiter.wait()
+	assert waiter.timeout == waiting.BACKOFF_MAX_TIMEOUT
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+def test_inotify_waiter_wakes_up_on_change(tmp_path):
+	waiter = waiting.InotifyWaiter(str(tmp_path))
+	prev = waiting.INOTIFY_MAX_TIMEOUT
+	waiting.INOTIFY_MAX_TIMEOUT = 10.0
+
+	threading.Timer(0.05, lambda: open(os.path.join(tmp_path, "file.lock"), "w").close()).start()
+	t1 = time.monotonic()
+	waiter.wait()
+	assert time.monotonic() - t1 < 5.0
+	waiter.close()
+
+	waiting.INOTIFY_MAX_TIMEOUT = prev
+
+
+def test_contended_lock_handoff(lock_wait_strategy, lock_backend):
+	name = "test_contended_lock_handoff"
+	acquired = []
+
+	def write_in_thread():
+		with locking.WriteLock(name):
+			acquired.append(time.monotonic())
+
+	with locking.WriteLock(name):
+		t = threading.Thread(target=write_in_thread)
+		t.start()
+		time.sleep(0.1)
+		assert acquired == []
+		released = time.monotonic()
+	t.join(timeout=5.0)
+	assert len(acquired) == 1
+	assert acquired[0] - released < 1.0
+	assert DDB.config.lock_wait_strategy == lock_wait_strategy
@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 from path_dict import pd
 
@@ -59,3 +61,58 @@ def test_write_wildcard_key_except(use_compression, use_orjson, indent):
 	with pytest.raises(TypeError):
 		with DDB.at("test/*", key="any").session() as (session, d):
 			pass
+
+
+def test_upgradeable_session(use_compression, use_orjson, indent):
+	name = "test_upgradeable_session"
+	DDB.at(name).create({"a": 1, "b": 2}, force_overwrite=True)
+	with DDB.at(name).session(upgradeable=True) as (session, d):
+		# Reading inside the session is possible before and after upgrading
+		assert DDB.at(name).read() == d
+		d["a"] = 3
+		session.write()
+		assert DDB.at(name, key="a").read() == 3
+	assert DDB.at(name).read() == {"a": 3, "b": 2}
+
+	with DDB.at(name, key="b").session(upgradeable=True) as (session, b):
+		assert b == 2
+	assert DDB.at(name).read() == {"a": 3, "b": 2}
+
+	DDB.at(name, "d1").create({"a": 1}, force_overwrite=True)
+	DDB.at(name, "d2").create({"a": 2}, force_overwrite=True)
+	with DDB.at(name, "*", where=lambda k, v: v["a"] > 1).session(upgradeable=True) as (session, d):
+		assert DDB.at(name, "*").read() == {"d1": {"a": 1}, "d2": {"a": 2}}
+		d["d2"]["a"] = 4
+		session.write()
+	assert DDB.at(name, "*").read() == {"d1": {"a": 1}, "d2": {"a": 4}}
+
+
+def test_session_timeout(lock_backend):
+	name = "test_session_timeout"
+	DDB.at(name).create({"a": 1}, force_overwrite=True)
+	DDB.at(name, "d1").create({"a": 1}, force_overwrite=True)
+	entered, release = threading.Event(), threading.Event()
+
+	def hold_session():
+		with DDB.at(name).session(), DDB.at(name, "*").session():
+			entered.set()
+			release.wait(timeout=5.0)
+
+	t = threading.Thread(target=hold_session)
+	t.start()
+	entered.wait(timeout=5.0)
+	try:
+		with pytest.raises(DDB.locking.LockTimeoutError):
+			DDB.at(name).read(blocking=False)
+		with pytest.raises(DDB.locking.LockTimeoutError):
+			DDB.at(name, key="a").read(timeout=0.05)
+		with pytest.raises(DDB.locking.LockTimeoutError):
+			with DDB.at(name).session(timeout=0.05):
+				pass
+		with pytest.raises(DDB.locking.LockTimeoutError):
+			with DDB.at(name, "*").session(blocking=False):
+				pass
+	finally:
+		release.set()
+		t.join()
+	assert DDB.at(name).read(blocking=False) == {"a": 1}